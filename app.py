@@ -46,6 +46,7 @@ from youdub.step050_synthesize_video import synthesize_all_video_under_folder
 from youdub.step060_genrate_info import generate_all_info_under_folder
 from youdub.step070_upload_bilibili import upload_all_videos_under_folder
 from youdub.do_everything import do_everything
+from youdub.job_store import job_status
 import os
 
 
@@ -78,6 +79,7 @@ do_everything_interface = gr.Interface(
         gr.Slider(minimum=1, maximum=5, step=1, label='Max Workers (并行处理视频数)', value=1),
         gr.Slider(minimum=1, maximum=10, step=1, label='Max Retries', value=3),
         gr.Checkbox(label='Auto Upload Video', value=False),
+        gr.Checkbox(label='Stage Pipeline (按阶段流水线并行)', value=True),
     ],
     outputs='text',
 )
@@ -150,6 +152,7 @@ syntehsize_video_interface = gr.Interface(
         gr.Slider(minimum=0.5, maximum=2, step=0.05, label='Speed Up', value=1.05),
         gr.Slider(minimum=1, maximum=60, step=1, label='FPS', value=30),
         gr.Radio(['4320p', '2160p', '1440p', '1080p', '720p', '480p', '360p', '240p', '144p'], label='Resolution', value='720p'),
+        gr.Textbox(label='Extra Renditions (额外分辨率，逗号分隔，如 480p:crf=26)', value=os.getenv('VIDEO_RENDITIONS', '')),
     ],
     outputs='text',
 )
@@ -170,10 +173,19 @@ upload_bilibili_interface = gr.Interface(
     outputs='text',
 )
 
+job_status_interface = gr.Interface(
+    fn = job_status,
+    inputs = [
+        gr.Textbox(label='Folder', value='videos'),
+        gr.Checkbox(label='Rescan Folder (重新扫描文件系统)', value=False),
+    ],
+    outputs='text',
+)
+
 app = gr.TabbedInterface(
     interface_list=[do_everything_interface,youtube_interface, demucs_interface,
-                    whisper_inference, translation_interface, tts_interafce, syntehsize_video_interface, upload_bilibili_interface],
-    tab_names=['全自动', '下载视频', '人声分离', '语音识别', '字幕翻译', '语音合成', '视频合成', '上传B站'],
+                    whisper_inference, translation_interface, tts_interafce, syntehsize_video_interface, upload_bilibili_interface, job_status_interface],
+    tab_names=['全自动', '下载视频', '人声分离', '语音识别', '字幕翻译', '语音合成', '视频合成', '上传B站', '任务状态'],
     title='LXS_Dub')
 if __name__ == '__main__':
     app.launch()
\ No newline at end of file
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+火山 TTS 客户端压测：启动本地 mock 服务回放固定的音频响应，可配置延迟和限流比例
+用法: python tools/bench_bytedance_tts.py [--lines 200] [--latency 0.2] [--concurrency 8] [--throttle 0.05]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy.io import wavfile
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from youdub.step041_tts_bytedance import BytedanceTTSClient
+
+
+def canned_wav(seconds=1.0, sample_rate=24000):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16))
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def make_handler(latency, throttle, audio):
+    class Handler(BaseHTTPRequestHandler):
+        requests_seen = []
+        lock = threading.Lock()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with Handler.lock:
+                Handler.requests_seen.append((body['request']['reqid'], body['request']['text'], body['audio']['voice_type']))
+            time.sleep(latency)
+            if random.random() < throttle:
+                payload = {'code': 3003, 'message': 'concurrency limit exceeded'}
+            else:
+                payload = {'code': 3000, 'reqid': body['request']['reqid'], 'data': audio}
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=200, help='合成的句子数')
+    parser.add_argument('--latency', type=float, default=0.2, help='mock 服务每个请求的延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=8, help='客户端并发数')
+    parser.add_argument('--throttle', type=float, default=0.0, help='mock 服务返回 3003 限流的比例')
+    args = parser.parse_args()
+
+    handler = make_handler(args.latency, args.throttle, canned_wav())
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/api/v1/tts'
+    texts = [(f'第 {i} 句测试文本', f'BV{i % 3:03d}_streaming') for i in range(args.lines)]
+
+    for concurrency in (1, args.concurrency):
+        handler.requests_seen.clear()
+        client = BytedanceTTSClient(url=url, access_token='mock', concurrency=concurrency, max_retries=8)
+        t_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda item: client.synthesize(*item), texts))
+        elapsed = time.perf_counter() - t_start
+        # 每个请求的文本和音色都应与调用方一致（请求体互不串用）
+        sent = {reqid: (text, voice) for reqid, text, voice in handler.requests_seen}
+        mixed = len(set(sent.values()) - set(texts))
+        print(f'并发 {concurrency}: {len(results)} 句用时 {elapsed:.2f}s ({len(results) / elapsed:.1f} 句/秒), '
+              f'请求 {len(handler.requests_seen)} 次, 串用请求体 {mixed} 次, 最终并发上限 {client.limiter.concurrency}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+术语替换性能对比：旧的逐术语 re.sub vs 预编译单正则
+用法: python tools/bench_terminology.py [--terms 10000] [--lines 200]
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from youdub.terminology import TerminologyManager
+
+
+def legacy_apply(terms, text):
+    """重构前的实现：每次调用重新排序，每个术语单独编译并扫描一次"""
+    sorted_terms = sorted(terms.items(), key=lambda x: len(x[0]), reverse=True)
+    for en_term, cn_term in sorted_terms:
+        pattern = r'\b' + re.escape(en_term) + r'\b'
+        text = re.sub(pattern, cn_term, text, flags=re.IGNORECASE)
+    return text
+
+
+def random_word(rng):
+    return ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(4, 10)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--terms', type=int, default=10000, help='自定义术语数量')
+    parser.add_argument('--lines', type=int, default=200, help='测试的译文行数')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    manager = TerminologyManager()
+    terms = {}
+    for _ in range(args.terms):
+        words = ' '.join(random_word(rng) for _ in range(rng.randint(1, 3)))
+        terms[words] = f'术语{rng.randint(0, 99999)}'
+    manager.add_terms(terms)
+    term_list = list(manager.get_terms())
+    lines = []
+    for _ in range(args.lines):
+        parts = ['这是一段包含', rng.choice(term_list), '和', rng.choice(term_list), '的翻译，以及一些', random_word(rng), '普通文本。']
+        lines.append(''.join(parts))
+
+    print(f'术语数: {len(manager.get_terms())}, 行数: {len(lines)}')
+
+    t_start = time.perf_counter()
+    manager.apply_to_translation('warm up')
+    print(f'预编译耗时: {(time.perf_counter() - t_start) * 1000:.1f} ms')
+
+    t_start = time.perf_counter()
+    new_results = [manager.apply_to_translation(line) for line in lines]
+    new_cost = (time.perf_counter() - t_start) / len(lines)
+
+    legacy_lines = lines[:max(1, min(len(lines), 20))]
+    t_start = time.perf_counter()
+    legacy_results = [legacy_apply(manager.get_terms(), line) for line in legacy_lines]
+    legacy_cost = (time.perf_counter() - t_start) / len(legacy_lines)
+
+    mismatches = sum(a != b for a, b in zip(new_results, legacy_results))
+    print(f'旧实现: {legacy_cost * 1000:.2f} ms/行 (采样 {len(legacy_lines)} 行)')
+    print(f'新实现: {new_cost * 1000:.3f} ms/行')
+    print(f'加速比: {legacy_cost / new_cost:.0f}x, 结果不一致的行: {mismatches}/{len(legacy_lines)}')
+
+
+if __name__ == '__main__':
+    main()
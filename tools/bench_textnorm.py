@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+TextNorm 性能对比：旧的每次调用编译正则 + findall/str.replace + 每次重建数字系统 vs 预编译一遍替换 + LRU 缓存
+结果不一致的句子来自旧实现 str.replace 替换了第一处相同子串而不是匹配位置（如 "6.5度" 被读成 "六.五度"）
+用法: python tools/bench_textnorm.py [--sentences 100000] [--unique 0.3]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from youdub import cn_tx
+from youdub.cn_tx import (TextNorm, Date, Money, TelePhone, Fraction, Percentage, Cardinal, Digit,
+                          CURRENCY_UNITS, COM_QUANTIFIERS, ER_WHITELIST_PATTERN)
+
+
+def legacy_normalize_nsw(raw_text):
+    """重构前的实现：每次调用重新编译正则，每个匹配用 str.replace 重新扫描整个字符串"""
+    text = '^' + raw_text + '$'
+    stages = [
+        (r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)", lambda m: Date(date=m).date2chntext()),
+        (r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)", lambda m: Money(money=m).money2chntext()),
+        (r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D", lambda m: TelePhone(telephone=m).telephone2chntext()),
+        (r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D", lambda m: TelePhone(telephone=m).telephone2chntext(fixed=True)),
+        (r"(\d+/\d+)", lambda m: Fraction(fraction=m).fraction2chntext()),
+        (None, None),
+        (r"(\d+(\.\d+)?%)", lambda m: Percentage(percentage=m).percentage2chntext()),
+        (r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS, lambda m: Cardinal(cardinal=m).cardinal2chntext()),
+        (r"(\d{4,32})", lambda m: Digit(digit=m).digit2chntext()),
+        (r"(\d+(\.\d+)?)", lambda m: Cardinal(cardinal=m).cardinal2chntext()),
+    ]
+    for regex, convert in stages:
+        if regex is None:
+            text = text.replace('％', '%')
+            continue
+        for matcher in re.compile(regex).findall(text):
+            matcher = matcher[0] if isinstance(matcher, tuple) else matcher
+            text = text.replace(matcher, convert(matcher), 1)
+    for matcher in re.compile(r"(([a-zA-Z]+)二([a-zA-Z]+))").findall(text):
+        text = text.replace(matcher[0], matcher[1] + '2' + matcher[2], 1)
+    return text.lstrip('^').rstrip('$')
+
+
+def legacy_remove_erhua(text):
+    new_str = ''
+    while re.search('儿', text):
+        a = re.search('儿', text).span()
+        remove_er_flag = 0
+        if ER_WHITELIST_PATTERN.search(text):
+            b = ER_WHITELIST_PATTERN.search(text).span()
+            if b[0] <= a[0]:
+                remove_er_flag = 1
+        if remove_er_flag == 0:
+            new_str = new_str + text[0:a[0]]
+            text = text[a[1]:]
+        else:
+            new_str = new_str + text[0:b[1]]
+            text = text[b[1]:]
+    return new_str + text
+
+
+TEMPLATES = [
+    '他在{year}年{month}月{day}日发表了演讲',
+    '这台电脑售价{price}元，比去年便宜了{percent}%',
+    '请拨打{mobile}联系我们',
+    '大约有{fraction}的人选择了第{n}个方案',
+    '我们买了{n}个苹果和{n}斤香蕉',
+    '编号{code}的订单已经发货',
+    '温度上升了{float}度，持续了{n}天',
+    '这是P二P和B二B平台的区别',
+    '他女儿在那边儿玩，小孩儿们都很开心',
+    '谢谢观看，我们下期再见',
+    '感谢本期视频的赞助商',
+]
+
+
+def make_sentence(rng):
+    return rng.choice(TEMPLATES).format(
+        year=rng.randint(1950, 2030), month=rng.randint(1, 12), day=rng.randint(1, 28),
+        price=rng.randint(1, 99999), percent=rng.randint(1, 99), mobile=f'13{rng.randint(100000000, 999999999)}',
+        fraction=f'{rng.randint(1, 9)}/{rng.randint(10, 99)}', n=rng.randint(1, 999),
+        code=rng.randint(1000, 99999999), float=f'{rng.randint(0, 99)}.{rng.randint(0, 9)}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sentences', type=int, default=100000, help='语料句数')
+    parser.add_argument('--unique', type=float, default=0.3, help='不重复句子的比例（其余为重复句）')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    unique = [make_sentence(rng) for _ in range(max(1, int(args.sentences * args.unique)))]
+    corpus = unique + [rng.choice(unique) for _ in range(args.sentences - len(unique))]
+    rng.shuffle(corpus)
+    print(f'句数: {len(corpus)}, 不重复: {len(set(corpus))}')
+
+    # 旧实现每次 num2chn 都重新构建数字系统，对比时去掉 create_system 的缓存
+    create_system = cn_tx.create_system
+    cn_tx.create_system = create_system.__wrapped__
+    t_start = time.perf_counter()
+    legacy = [legacy_normalize_nsw(legacy_remove_erhua(text)) for text in corpus]
+    legacy_cost = time.perf_counter() - t_start
+    cn_tx.create_system = create_system
+    print(f'旧实现: {legacy_cost:.2f}s ({len(corpus) / legacy_cost:.0f} 句/秒)')
+
+    normalizer = TextNorm(remove_erhua=True, cache_size=0)
+    t_start = time.perf_counter()
+    uncached = [normalizer(text) for text in corpus]
+    uncached_cost = time.perf_counter() - t_start
+    print(f'预编译（无缓存）: {uncached_cost:.2f}s ({len(corpus) / uncached_cost:.0f} 句/秒)')
+
+    normalizer = TextNorm(remove_erhua=True)
+    t_start = time.perf_counter()
+    batch = normalizer.normalize_batch(corpus)
+    batch_cost = time.perf_counter() - t_start
+    print(f'预编译 + LRU normalize_batch: {batch_cost:.2f}s ({len(corpus) / batch_cost:.0f} 句/秒)')
+
+    mismatches = [(a, b, c) for a, b, c in zip(corpus, legacy, batch) if b != c]
+    print(f'加速比: {legacy_cost / uncached_cost:.1f}x（无缓存）, {legacy_cost / batch_cost:.1f}x（缓存）, '
+          f'结果不一致: {len(mismatches)}/{len(corpus)}')
+    for text, old, new in mismatches[:5]:
+        print(f'  {text} -> 旧: {old} / 新: {new}')
+    assert uncached == batch
+
+
+if __name__ == '__main__':
+    main()
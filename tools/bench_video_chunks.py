@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+视频合成耗时对比：单个 ffmpeg 进程编码整段 vs 按关键帧分段并行编码（libx264）
+用 lavfi 生成测试视频、配音和字幕，分别合成后比较耗时和输出时长
+用法: python tools/bench_video_chunks.py [--duration 300] [--resolution 1080p] [--chunks 0] [--threads 4]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from youdub import step050_synthesize_video as synth
+
+
+def make_source(folder, duration, resolution):
+    ffmpeg_path = synth.get_ffmpeg_path()
+    height = int(resolution[:-1])
+    width = height * 16 // 9 // 2 * 2
+    subprocess.run([ffmpeg_path, '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', f'testsrc2=size={width}x{height}:rate=30:duration={duration}',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60',
+                    os.path.join(folder, 'download.mp4')], check=True)
+    subprocess.run([ffmpeg_path, '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', f'sine=frequency=440:duration={duration}', '-ar', '24000',
+                    os.path.join(folder, 'audio_combined.wav')], check=True)
+    translation = [{'start': i * 3.0, 'end': i * 3.0 + 2.5, 'text': f'line {i}',
+                    'translation': f'这是第{i}句用来测试字幕烧录的配音文本。'}
+                   for i in range(int(duration // 3))]
+    with open(os.path.join(folder, 'translation.json'), 'w', encoding='utf-8') as f:
+        json.dump(translation, f, ensure_ascii=False)
+
+
+def run(folder, chunks, resolution):
+    synth.VIDEO_CHUNKS = chunks
+    output_video = os.path.join(folder, 'video.mp4')
+    if os.path.exists(output_video):
+        os.remove(output_video)
+    t_start = time.perf_counter()
+    # 跳过任务记录，直接调用合成函数
+    synth.synthesize_video.__wrapped__(folder, subtitles=True, resolution=resolution)
+    return time.perf_counter() - t_start, synth.get_video_duration(output_video)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=int, default=300, help='测试视频时长（秒）')
+    parser.add_argument('--resolution', default='1080p', help='输出分辨率')
+    parser.add_argument('--chunks', type=int, default=0, help='分段数（0 = 按 CPU 核数自动选择）')
+    parser.add_argument('--threads', type=int, default=synth.VIDEO_CHUNK_THREADS, help='每段线程数')
+    args = parser.parse_args()
+
+    synth.VIDEO_CHUNK_THREADS = args.threads
+    # 测试视频较短，放宽每段的最短时长，否则不会分段
+    synth.VIDEO_CHUNK_MIN_SECONDS = 10
+    folder = tempfile.mkdtemp(prefix='bench_video_chunks_')
+    try:
+        make_source(folder, args.duration, args.resolution)
+        video_codec, _ = synth.get_video_encoder_config()
+        synth.VIDEO_CHUNKS = args.chunks
+        chunks = synth.plan_video_chunks(os.path.join(folder, 'download.mp4'), video_codec)
+        print(f'视频: {args.duration}s {args.resolution}, 编码器: {video_codec}, CPU 核数: {os.cpu_count()}, '
+              f'分段: {len(chunks)} x {args.threads} 线程')
+
+        single_cost, single_duration = run(folder, 1, args.resolution)
+        print(f'单进程: {single_cost:.1f}s ({args.duration / single_cost:.2f}x 实时), 输出时长 {single_duration:.2f}s')
+        chunked_cost, chunked_duration = run(folder, args.chunks, args.resolution)
+        print(f'分段并行: {chunked_cost:.1f}s ({args.duration / chunked_cost:.2f}x 实时), 输出时长 {chunked_duration:.2f}s')
+        print(f'加速比: {single_cost / chunked_cost:.2f}x, 时长差: {abs(single_duration - chunked_duration) * 1000:.0f}ms')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
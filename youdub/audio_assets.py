@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+解码后音频的共享缓存
+同一个 wav 在分离、识别、说话人参考、配音拼接各步骤会被反复解码/重采样。
+这里按 (源文件指纹, 采样率, 声道) 把解码结果缓存为视频目录下 .audio_cache/ 中的 float32 .npy，
+以内存映射方式读取，后续步骤和重复运行都不再解码。
+缓存约为每小时音频 1GB，配音合成（最后一个读取它的步骤）结束后由 clear_cache 删除。
+"""
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+from loguru import logger
+
+AUDIO_ASSET_CACHE = os.getenv('AUDIO_ASSET_CACHE', '1') == '1'
+CACHE_DIR_NAME = '.audio_cache'
+# 指纹只读取文件头尾各 1MB，加上大小和修改时间，避免每次都哈希整个大文件
+_FINGERPRINT_BYTES = 1 << 20
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(_FINGERPRINT_BYTES))
+        if stat.st_size > _FINGERPRINT_BYTES:
+            f.seek(-_FINGERPRINT_BYTES, os.SEEK_END)
+            digest.update(f.read(_FINGERPRINT_BYTES))
+    return digest.hexdigest()[:16]
+
+
+def _lock_for(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def asset_path(path, sample_rate, mono=True):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    channels = 'mono' if mono else 'multi'
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME,
+                        f'{stem}.{sample_rate}.{channels}.{fingerprint(path)}.npy')
+
+
+def load_audio(path, sample_rate, mono=True):
+    """
+    返回 path 解码到 sample_rate 后的 float32 数组（只读内存映射）
+
+    mono=False 时形状为 (channels, samples)，与 librosa.load 一致。
+    源文件变化后指纹不同，旧的缓存文件会被删除。
+    """
+    if not AUDIO_ASSET_CACHE:
+        import librosa
+        return librosa.load(path, sr=sample_rate, mono=mono)[0]
+
+    cache_path = asset_path(path, sample_rate, mono)
+    with _lock_for(cache_path):
+        if not os.path.exists(cache_path):
+            import librosa
+            wav = librosa.load(path, sr=sample_rate, mono=mono)[0].astype(np.float32, copy=False)
+            cache_dir = os.path.dirname(cache_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            prefix = cache_path.rsplit('.', 2)[0] + '.'
+            for name in os.listdir(cache_dir):
+                stale = os.path.join(cache_dir, name)
+                if stale.startswith(prefix) and stale != cache_path:
+                    os.remove(stale)
+            tmp_path = cache_path + '.part'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, wav)
+            os.replace(tmp_path, cache_path)
+            logger.info(f'Decoded {path} at {sample_rate}Hz into asset cache')
+    return np.load(cache_path, mmap_mode='r')
+
+
+def clear_cache(folder):
+    """删除视频目录下的 .audio_cache/，调用前需释放该目录下 load_audio 返回的内存映射"""
+    cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+    if not os.path.isdir(cache_dir):
+        return
+    size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+    # Windows 下仍被映射的文件删不掉，留到下次运行时再清理
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    logger.info(f'Removed audio asset cache {cache_dir} ({size / 1024 / 1024:.0f}MB)')
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+内存中的变速不变调
+- wsola: 波形相似叠加（WSOLA），对语音效果好、无相位感
+- phase_vocoder: librosa 相位声码器
+变速比例在容差内时直接截断/补零，不做处理；批量接口用进程池并行，不产生中间文件。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+# 变速算法：wsola / phase_vocoder
+TTS_STRETCH_ALGORITHM = os.getenv('TTS_STRETCH_ALGORITHM', 'wsola')
+# 变速比例与 1 的差不超过该值时跳过变速
+TTS_STRETCH_TOLERANCE = float(os.getenv('TTS_STRETCH_TOLERANCE', '0.02'))
+# 批量变速的进程数（0 为按核数自动选择，1 为在当前进程内处理）
+TTS_STRETCH_WORKERS = int(os.getenv('TTS_STRETCH_WORKERS', '0'))
+# 句子数少于该值时不启动进程池（进程启动开销比变速本身还大）
+_MIN_POOL_JOBS = 16
+
+
+def wsola(wav, ratio, sample_rate=24000, frame_ms=40, search_ms=10):
+    """
+    WSOLA 时间伸缩，ratio 为输出长度 / 输入长度（>1 变慢，<1 变快）
+
+    每个输出帧在名义分析位置附近 ±search_ms 内搜索与上一帧自然延续最相似的位置，
+    用周期 Hann 窗 50% 重叠相加，避免相位声码器的“金属声”。
+    """
+    wav = np.asarray(wav, dtype=np.float32)
+    out_length = int(round(len(wav) * ratio))
+    frame = int(sample_rate * frame_ms / 1000) // 2 * 2
+    hop = frame // 2
+    tolerance = int(sample_rate * search_ms / 1000)
+    if len(wav) < frame or out_length == 0:
+        return fix_length(wav, out_length)
+
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+    padded = np.pad(wav, (tolerance, frame + 2 * tolerance + 4 * hop))
+    n_frames = out_length // hop + 1
+    out = np.zeros(n_frames * hop + frame, dtype=np.float32)
+    norm = np.zeros_like(out)
+    position = 0
+    for k in range(n_frames):
+        target = min(int(k * hop / ratio), len(wav))
+        if k == 0:
+            position = target
+        else:
+            # padded 中的下标比原始位置多 tolerance
+            natural = position + hop + tolerance
+            reference = padded[natural:natural + frame]
+            region = padded[target:target + frame + 2 * tolerance]
+            delta = int(np.argmax(np.correlate(region, reference, mode='valid')))
+            position = target - tolerance + delta
+        out[k * hop:k * hop + frame] += padded[position + tolerance:position + tolerance + frame] * window
+        norm[k * hop:k * hop + frame] += window
+    out /= np.maximum(norm, 1e-3)
+    return out[:out_length]
+
+
+def phase_vocoder(wav, ratio, sample_rate=24000):
+    import librosa
+    stretched = librosa.effects.time_stretch(np.asarray(wav, dtype=np.float32), rate=1 / ratio)
+    return stretched.astype(np.float32, copy=False)
+
+
+STRETCH_ALGORITHMS = {
+    'wsola': wsola,
+    'phase_vocoder': phase_vocoder,
+}
+
+
+def fix_length(wav, length):
+    if len(wav) >= length:
+        return wav[:length]
+    return np.pad(wav, (0, length - len(wav)))
+
+
+def stretch(wav, ratio, sample_rate=24000, algorithm=None, tolerance=None, length=None):
+    """把 wav 伸缩 ratio 倍，返回长度恰好为 length（默认 len(wav) * ratio）的 float32 数组"""
+    algorithm = algorithm or TTS_STRETCH_ALGORITHM
+    tolerance = TTS_STRETCH_TOLERANCE if tolerance is None else tolerance
+    if length is None:
+        length = int(len(wav) * ratio)
+    wav = np.asarray(wav, dtype=np.float32)
+    if abs(ratio - 1) > tolerance:
+        if algorithm not in STRETCH_ALGORITHMS:
+            raise ValueError(f'Unknown stretch algorithm: {algorithm}, expected one of {list(STRETCH_ALGORITHMS)}')
+        wav = STRETCH_ALGORITHMS[algorithm](wav, ratio, sample_rate)
+    return fix_length(wav, length)
+
+
+def stretch_file(wav_path, ratio, length, sample_rate=24000, algorithm=None, tolerance=None):
+    import librosa
+    wav, _ = librosa.load(wav_path, sr=sample_rate)
+    return stretch(wav, ratio, sample_rate, algorithm, tolerance, length)
+
+
+def _stretch_file_job(job, sample_rate, algorithm, tolerance):
+    wav_path, ratio, length = job
+    return stretch_file(wav_path, ratio, length, sample_rate, algorithm, tolerance)
+
+
+def iter_stretch_files(jobs, sample_rate=24000, algorithm=None, tolerance=None, workers=None):
+    """
+    批量变速：jobs 为 [(wav_path, ratio, length)]，按顺序逐个产出 float32 数组
+
+    使用 spawn 进程池，子进程只导入本模块，不会继承父进程中已加载的 TTS/GPU 模型。
+    调用方边取边写，内存中不必同时保留整段视频的配音。
+    """
+    algorithm = algorithm or TTS_STRETCH_ALGORITHM
+    tolerance = TTS_STRETCH_TOLERANCE if tolerance is None else tolerance
+    workers = TTS_STRETCH_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = max(1, min(os.cpu_count() or 1, 8))
+    if workers == 1 or len(jobs) < _MIN_POOL_JOBS:
+        for job in jobs:
+            yield _stretch_file_job(job, sample_rate, algorithm, tolerance)
+        return
+
+    logger.info(f'Stretching {len(jobs)} clips with {workers} processes ({algorithm})')
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        yield from executor.map(_stretch_file_job, jobs, [sample_rate] * len(jobs),
+                                [algorithm] * len(jobs), [tolerance] * len(jobs), chunksize=chunksize)
+
+
+def stretch_files(jobs, sample_rate=24000, algorithm=None, tolerance=None, workers=None):
+    """批量变速，返回数组列表"""
+    return list(iter_stretch_files(jobs, sample_rate, algorithm, tolerance, workers))
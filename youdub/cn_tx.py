@@ -15,6 +15,7 @@ import argparse
 import string
 import re
 import csv
+import functools
 
 # ================================================================================ #
 #                                    basic constant
@@ -530,6 +531,7 @@ class MathSymbol(object):
 # ================================================================================ #
 #                                    basic utils
 # ================================================================================ #
+@functools.lru_cache(maxsize=None)
 def create_system(numbering_type=NUMBERING_TYPES[1]):
     """
     根据数字系统类型返回创建相应的数字系统，默认为 mid
@@ -537,7 +539,7 @@ def create_system(numbering_type=NUMBERING_TYPES[1]):
         low:  '兆' = '亿' * '十' = $10^{9}$,  '京' = '兆' * '十', etc.
         mid:  '兆' = '亿' * '万' = $10^{12}$, '京' = '兆' * '万', etc.
         high: '兆' = '亿' * '亿' = $10^{16}$, '京' = '兆' * '兆', etc.
-    返回对应的数字系统
+    返回对应的数字系统（只读，按类型缓存，调用方不得修改）
     """
 
     # chinese number units of '亿' and larger
@@ -916,8 +918,7 @@ class Money:
 
     def money2chntext(self):
         money = self.money
-        pattern = re.compile(r'(\d+(\.\d+)?)')
-        matchers = pattern.findall(money)
+        matchers = CARDINAL_PATTERN.findall(money)
         if matchers:
             for matcher in matchers:
                 money = money.replace(matcher[0], Cardinal(
@@ -942,105 +943,84 @@ class Percentage:
         return '百分之' + num2chn(self.percentage.strip().strip('%'))
 
 
+# 预编译的规范化正则（模块加载时编译一次，不再在每次调用时重新编译）
+DATE_PATTERN = re.compile(
+    r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)")
+MONEY_PATTERN = re.compile(
+    r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)")
+# 手机
+# http://www.jihaoba.com/news/show/13680
+# 移动：139、138、137、136、135、134、159、158、157、150、151、152、188、187、182、183、184、178、198
+# 联通：130、131、132、156、155、186、185、176
+# 电信：133、153、189、180、181、177
+MOBILE_PATTERN = re.compile(
+    r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D")
+# 固话
+FIXED_PHONE_PATTERN = re.compile(r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D")
+FRACTION_PATTERN = re.compile(r"(\d+/\d+)")
+PERCENTAGE_PATTERN = re.compile(r"(\d+(\.\d+)?%)")
+QUANTIFIER_PATTERN = re.compile(r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS)
+DIGIT_PATTERN = re.compile(r"(\d{4,32})")
+CARDINAL_PATTERN = re.compile(r"(\d+(\.\d+)?)")
+# restore P2P, O2O, B2C, B2B etc
+ALNUM_TWO_PATTERN = re.compile(r"(([a-zA-Z]+)二([a-zA-Z]+))")
+# 白名单词整体保留，其余的“儿”删除；白名单在前，同一位置优先匹配白名单
+ERHUA_PATTERN = re.compile(ER_WHITELIST + '|儿')
+
+
+def _sub_group(pattern, convert, text):
+    """
+    从左到右一遍替换：每个匹配只把第 1 组换成 convert(组内容)，组外的上下文字符原样保留。
+    相比 findall + str.replace，不会对每个匹配重新扫描整个字符串。
+    """
+    def replace(m):
+        start, end = m.span(1)
+        if start == end:
+            return m.group(0)
+        offset = m.start()
+        whole = m.group(0)
+        return whole[:start - offset] + convert(m.group(1)) + whole[end - offset:]
+    return pattern.sub(replace, text)
+
+
 def normalize_nsw(raw_text):
     text = '^' + raw_text + '$'
+    if not any(c.isdigit() or c == '二' for c in text):
+        # 没有数字也没有“二”：除全角百分号外所有规则都不会命中
+        return text.replace('％', '%').lstrip('^').rstrip('$')
 
     # 规范化日期
-    pattern = re.compile(
-        r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('date')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Date(
-                date=matcher[0]).date2chntext(), 1)
+    if '年' in text or '月' in text:
+        text = _sub_group(DATE_PATTERN, lambda date: Date(date=date).date2chntext(), text)
 
     # 规范化金钱
-    pattern = re.compile(
-        r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('money')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Money(
-                money=matcher[0]).money2chntext(), 1)
+    text = _sub_group(MONEY_PATTERN, lambda money: Money(money=money).money2chntext(), text)
 
     # 规范化固话/手机号码
-    # 手机
-    # http://www.jihaoba.com/news/show/13680
-    # 移动：139、138、137、136、135、134、159、158、157、150、151、152、188、187、182、183、184、178、198
-    # 联通：130、131、132、156、155、186、185、176
-    # 电信：133、153、189、180、181、177
-    pattern = re.compile(
-        r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('telephone')
-        for matcher in matchers:
-            text = text.replace(matcher[0], TelePhone(
-                telephone=matcher[0]).telephone2chntext(), 1)
-    # 固话
-    pattern = re.compile(r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('fixed telephone')
-        for matcher in matchers:
-            text = text.replace(matcher[0], TelePhone(
-                telephone=matcher[0]).telephone2chntext(fixed=True), 1)
+    text = _sub_group(MOBILE_PATTERN, lambda phone: TelePhone(telephone=phone).telephone2chntext(), text)
+    text = _sub_group(FIXED_PHONE_PATTERN, lambda phone: TelePhone(telephone=phone).telephone2chntext(fixed=True), text)
 
     # 规范化分数
-    pattern = re.compile(r"(\d+/\d+)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('fraction')
-        for matcher in matchers:
-            text = text.replace(matcher, Fraction(
-                fraction=matcher).fraction2chntext(), 1)
+    if '/' in text:
+        text = _sub_group(FRACTION_PATTERN, lambda fraction: Fraction(fraction=fraction).fraction2chntext(), text)
 
     # 规范化百分数
     text = text.replace('％', '%')
-    pattern = re.compile(r"(\d+(\.\d+)?%)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('percentage')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Percentage(
-                percentage=matcher[0]).percentage2chntext(), 1)
+    if '%' in text:
+        text = _sub_group(PERCENTAGE_PATTERN, lambda percentage: Percentage(percentage=percentage).percentage2chntext(), text)
 
     # 规范化纯数+量词
-    pattern = re.compile(r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS)
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('cardinal+quantifier')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Cardinal(
-                cardinal=matcher[0]).cardinal2chntext(), 1)
+    text = _sub_group(QUANTIFIER_PATTERN, lambda cardinal: Cardinal(cardinal=cardinal).cardinal2chntext(), text)
 
     # 规范化数字编号
-    pattern = re.compile(r"(\d{4,32})")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('digit')
-        for matcher in matchers:
-            text = text.replace(matcher, Digit(
-                digit=matcher).digit2chntext(), 1)
+    text = _sub_group(DIGIT_PATTERN, lambda digit: Digit(digit=digit).digit2chntext(), text)
 
     # 规范化纯数
-    pattern = re.compile(r"(\d+(\.\d+)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('cardinal')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Cardinal(
-                cardinal=matcher[0]).cardinal2chntext(), 1)
+    text = _sub_group(CARDINAL_PATTERN, lambda cardinal: Cardinal(cardinal=cardinal).cardinal2chntext(), text)
 
     # restore P2P, O2O, B2C, B2B etc
-    pattern = re.compile(r"(([a-zA-Z]+)二([a-zA-Z]+))")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('particular')
-        for matcher in matchers:
-            text = text.replace(matcher[0], matcher[1]+'2'+matcher[2], 1)
+    if '二' in text:
+        text = ALNUM_TWO_PATTERN.sub(lambda m: m.group(2) + '2' + m.group(3), text)
 
     return text.lstrip('^').rstrip('$')
 
@@ -1050,26 +1030,7 @@ def remove_erhua(text):
     去除儿化音词中的儿:
     他女儿在那边儿 -> 他女儿在那边
     """
-
-    new_str = ''
-    while re.search('儿', text):
-        a = re.search('儿', text).span()
-        remove_er_flag = 0
-
-        if ER_WHITELIST_PATTERN.search(text):
-            b = ER_WHITELIST_PATTERN.search(text).span()
-            if b[0] <= a[0]:
-                remove_er_flag = 1
-
-        if remove_er_flag == 0:
-            new_str = new_str + text[0:a[0]]
-            text = text[a[1]:]
-        else:
-            new_str = new_str + text[0:b[1]]
-            text = text[b[1]:]
-
-    text = new_str + text
-    return text
+    return ERHUA_PATTERN.sub(lambda m: '' if m.group(0) == '儿' else m.group(0), text)
 
 
 def remove_space(text):
@@ -1093,6 +1054,7 @@ class TextNorm:
                  check_chars: bool = False,
                  remove_space: bool = False,
                  cc_mode: str = '',
+                 cache_size: int = 4096,
                  ):
         self.to_banjiao = to_banjiao
         self.to_upper = to_upper
@@ -1107,7 +1069,17 @@ class TextNorm:
             from opencc import OpenCC  # Open Chinese Convert: pip install opencc
             self.cc = OpenCC(cc_mode)
 
+        # 字幕中重复出现的句子（片头、口头禅等）直接命中缓存
+        self._cached = functools.lru_cache(maxsize=cache_size)(self.normalize) if cache_size else self.normalize
+
     def __call__(self, text):
+        return self._cached(text)
+
+    def normalize_batch(self, texts):
+        """批量规范化，重复的句子只计算一次"""
+        return [self._cached(text) for text in texts]
+
+    def normalize(self, text):
         if self.cc:
             text = self.cc.convert(text)
 
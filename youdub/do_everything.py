@@ -6,15 +6,17 @@ import torch
 from loguru import logger
 from .step000_video_downloader import get_info_list_from_url, download_single_video, get_target_folder
 from .step010_demucs_vr import separate_all_audio_under_folder, init_demucs
-from .step020_whisperx import transcribe_all_audio_under_folder, init_whisperx
+from .step020_whisperx import transcribe_all_audio_under_folder, transcribe_folders, init_whisperx, WHISPERX_MULTI_FILE, WHISPERX_POOL_FILES
 from .step030_translation import translate_all_transcript_under_folder
 from .step040_tts import generate_all_wavs_under_folder
 from .step042_tts_xtts import init_TTS
 from .step050_synthesize_video import synthesize_all_video_under_folder
 from .step060_genrate_info import generate_all_info_under_folder
 from .step070_upload_bilibili import upload_all_videos_under_folder
+from .scheduler import Stage, StagePipeline
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
+import threading
 import warnings
 
 # 过滤掉一些库产生的噪点警告，保持控制台整洁
@@ -58,12 +60,9 @@ def process_video(info, root_folder, resolution, demucs_model, device, shifts, w
                 logger.warning(f'Failed to get target folder for video {video_title}')
                 return False
             
-            if os.path.exists(os.path.join(folder, 'bilibili.json')):
-                with open(os.path.join(folder, 'bilibili.json'), 'r', encoding='utf-8') as f:
-                    bilibili_info = json.load(f)
-                if bilibili_info['results'][0]['code'] == 0:
-                    logger.info(f'Video already uploaded in {folder}')
-                    return True
+            if is_uploaded(folder):
+                logger.info(f'Video already uploaded in {folder}')
+                return True
                 
             folder = download_single_video(info, root_folder, resolution)
             if folder is None:
@@ -107,7 +106,97 @@ def process_video(info, root_folder, resolution, demucs_model, device, shifts, w
     return False
 
 
-def do_everything(root_folder, url, num_videos=5, resolution='720p', demucs_model='htdemucs', device='auto', shifts=0, whisper_model='medium', whisper_download_root='models/ASR/whisper', whisper_batch_size=4, whisper_diarization=False, whisper_min_speakers=None, whisper_max_speakers=None, translation_target_language='简体中文', force_bytedance=False, subtitles=True, speed_up=1.05, fps=30, target_resolution='720p', max_workers=1, max_retries=3, auto_upload_video=False):
+def is_uploaded(folder):
+    bilibili_path = os.path.join(folder, 'bilibili.json')
+    if not os.path.exists(bilibili_path):
+        return False
+    with open(bilibili_path, 'r', encoding='utf-8') as f:
+        bilibili_info = json.load(f)
+    return bilibili_info['results'][0]['code'] == 0
+
+
+def build_pipeline(root_folder, resolution, demucs_model, device, shifts, whisper_model, whisper_download_root, whisper_batch_size, whisper_diarization, whisper_min_speakers, whisper_max_speakers, translation_target_language, force_bytedance, subtitles, speed_up, fps, target_resolution, max_workers, max_retries, auto_upload_video):
+    """
+    构建按阶段并行的流水线
+    GPU 阶段（Demucs / WhisperX / TTS）各只有一个线程，共享已加载的全局模型，
+    并通过同一把 GPU 锁依次执行、每步结束后清理显存，与逐个视频处理时的显存占用一致；
+    网络、LLM、ffmpeg 阶段按 max_workers 并行。
+    """
+    gpu_lock = threading.Lock()
+
+    def download_stage(info):
+        video_title = info.get('title', info.get('id', 'unknown'))
+        folder = get_target_folder(info, root_folder)
+        if folder is None:
+            raise Exception(f'Failed to get target folder for video {video_title}')
+        if is_uploaded(folder):
+            logger.info(f'Video already uploaded in {folder}')
+            return None
+        folder = download_single_video(info, root_folder, resolution)
+        if folder is None:
+            # 与 process_video 一致：下载失败（如会员视频、已删除）直接跳过，不计为失败
+            logger.warning(f'Failed to download video {video_title}')
+            return None
+        return folder
+
+    def separate_stage(folder):
+        with gpu_lock:
+            try:
+                separate_all_audio_under_folder(
+                    folder, model_name=demucs_model, device=device, progress=True, shifts=shifts)
+            finally:
+                clear_gpu_memory()  # Clear GPU memory after Demucs
+        return folder
+
+    def transcribe_stage(folders):
+        # 队列中积压的多个视频一起交给 WhisperX，VAD 片段合并推理
+        with gpu_lock:
+            try:
+                transcribe_folders(
+                    folders, model_name=whisper_model, download_root=whisper_download_root, device=device, batch_size=whisper_batch_size, diarization=whisper_diarization,
+                    min_speakers=whisper_min_speakers,
+                    max_speakers=whisper_max_speakers)
+            finally:
+                clear_gpu_memory()  # Clear GPU memory after Whisper
+        return folders
+
+    def translate_stage(folder):
+        translate_all_transcript_under_folder(
+            folder, target_language=translation_target_language)
+        return folder
+
+    def tts_stage(folder):
+        with gpu_lock:
+            try:
+                generate_all_wavs_under_folder(folder, force_bytedance=force_bytedance)
+            finally:
+                clear_gpu_memory()  # Clear GPU memory after TTS
+        return folder
+
+    def synthesize_stage(folder):
+        synthesize_all_video_under_folder(folder, subtitles=subtitles, speed_up=speed_up, fps=fps, resolution=target_resolution)
+        generate_all_info_under_folder(folder)
+        return folder if auto_upload_video else None
+
+    def upload_stage(folder):
+        upload_all_videos_under_folder(folder)
+        return None
+
+    stages = [
+        Stage('download', download_stage, workers=max_workers, max_retries=max_retries),
+        Stage('demucs', separate_stage, workers=1, max_retries=max_retries),
+        Stage('whisperx', transcribe_stage, workers=1, max_retries=max_retries,
+              batch_size=WHISPERX_POOL_FILES if WHISPERX_MULTI_FILE else 1),  # 积压时合并推理
+        Stage('translation', translate_stage, workers=max_workers, max_retries=max_retries),
+        Stage('tts', tts_stage, workers=1, max_retries=max_retries),
+        Stage('synthesize', synthesize_stage, workers=max_workers, max_retries=max_retries),
+    ]
+    if auto_upload_video:
+        stages.append(Stage('upload', upload_stage, workers=1, max_retries=max_retries))
+    return StagePipeline(stages, label_fn=lambda info: info.get('title', info.get('id', 'unknown')))
+
+
+def do_everything(root_folder, url, num_videos=5, resolution='720p', demucs_model='htdemucs', device='auto', shifts=0, whisper_model='medium', whisper_download_root='models/ASR/whisper', whisper_batch_size=4, whisper_diarization=False, whisper_min_speakers=None, whisper_max_speakers=None, translation_target_language='简体中文', force_bytedance=False, subtitles=True, speed_up=1.05, fps=30, target_resolution='720p', max_workers=1, max_retries=3, auto_upload_video=False, pipeline=True):
     success_list = []
     fail_list = []
 
@@ -145,6 +234,14 @@ def do_everything(root_folder, url, num_videos=5, resolution='720p', demucs_mode
                                 whisper_diarization, whisper_min_speakers, whisper_max_speakers, translation_target_language, force_bytedance, subtitles, speed_up, fps, target_resolution, max_retries, auto_upload_video)
         return (info, success)
     
+    if pipeline:
+        # 按阶段流水线处理：不同视频的不同阶段同时进行
+        video_pipeline = build_pipeline(root_folder, resolution, demucs_model, device, shifts, whisper_model, whisper_download_root, whisper_batch_size,
+                                        whisper_diarization, whisper_min_speakers, whisper_max_speakers, translation_target_language, force_bytedance, subtitles, speed_up, fps, target_resolution, max_workers, max_retries, auto_upload_video)
+        video_infos = (info for info in get_info_list_from_url(urls, num_videos) if info is not None)
+        success_list, fail_list = video_pipeline.run(video_infos)
+        return f'Success: {len(success_list)}\nFail: {len(fail_list)}'
+
     # Use ThreadPoolExecutor for parallel processing
     video_infos = list(get_info_list_from_url(urls, num_videos))
     logger.info(f'Starting parallel processing of {len(video_infos)} videos with {max_workers} workers')
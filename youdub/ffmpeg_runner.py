@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+带实时进度的 ffmpeg 执行器
+用 -progress pipe:1 读取 ffmpeg 的机器可读进度（帧数、已输出时长、速度），
+定期输出到日志、写入任务数据库（WebUI 任务状态页可见），结束时记录本次的处理速度。
+返回值与 subprocess.run(capture_output=True, text=True) 一致，调用方照常检查 returncode / stderr。
+"""
+import os
+import subprocess
+import threading
+import time
+
+from loguru import logger
+
+from .job_store import get_job_store
+
+# 进度输出到日志和任务数据库的最小间隔（秒）
+FFMPEG_PROGRESS_INTERVAL = float(os.getenv('FFMPEG_PROGRESS_INTERVAL', '5'))
+
+
+def _parse_time(value):
+    """out_time_us / out_time_ms 都是微秒（ffmpeg 历史原因），N/A 时返回 None"""
+    try:
+        return int(value) / 1e6
+    except ValueError:
+        return None
+
+
+def _parse_speed(value):
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return None
+
+
+def make_progress_event(label, values, duration, elapsed):
+    """把一组 -progress 键值转换为进度事件"""
+    seconds = _parse_time(values.get('out_time_us', values.get('out_time_ms', 'N/A')))
+    speed = _parse_speed(values.get('speed', 'N/A'))
+    if not speed and seconds and elapsed > 0:
+        speed = seconds / elapsed
+    percent = eta = None
+    if duration and seconds is not None:
+        percent = min(100.0, seconds / duration * 100)
+        if speed:
+            eta = max(0.0, (duration - seconds) / speed)
+    return {
+        'label': label,
+        'frame': int(values['frame']) if values.get('frame', '').isdigit() else None,
+        'time': seconds,
+        'duration': duration,
+        'percent': percent,
+        'speed': speed,
+        'eta': eta,
+        'elapsed': elapsed,
+        'done': values.get('progress') == 'end',
+    }
+
+
+def _format_event(event):
+    parts = [event['label']]
+    if event['percent'] is not None:
+        parts.append(f"{event['percent']:.1f}%")
+    elif event['time'] is not None:
+        parts.append(f"{event['time']:.1f}s")
+    if event['speed']:
+        parts.append(f"{event['speed']:.2f}x")
+    if event['eta'] is not None:
+        parts.append(f"剩余 {event['eta']:.0f}s")
+    return ', '.join(parts)
+
+
+def run_ffmpeg(command, label='ffmpeg', duration=None, folder=None, stage=None, on_progress=None):
+    """
+    执行 ffmpeg 命令并实时解析进度
+
+    command 为完整命令（第一个元素是 ffmpeg 路径），会自动加上 -progress pipe:1 -nostats。
+    duration 为输出的预计时长（秒），有了才能计算百分比和剩余时间。
+    folder/stage 不为空时把进度写入任务数据库，结束后记录本次的处理速度。
+    on_progress(event) 在每次进度更新时调用（约每 0.5 秒一次）。
+    """
+    command = [command[0], '-progress', 'pipe:1', '-nostats'] + [arg for arg in command[1:] if arg != '-stats']
+    store = get_job_store() if folder and stage else None
+    t_start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='replace')
+    # stderr 在单独线程中读取，避免管道写满导致 ffmpeg 阻塞
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    values = {}
+    event = None
+    last_report = t_start
+    try:
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            values[key] = value
+            if key != 'progress':
+                continue
+            event = make_progress_event(label, values, duration, time.time() - t_start)
+            values = {}
+            if on_progress:
+                on_progress(event)
+            if time.time() - last_report >= FFMPEG_PROGRESS_INTERVAL and not event['done']:
+                last_report = time.time()
+                logger.info(f'ffmpeg 进度: {_format_event(event)}')
+                if store:
+                    store.update_progress(folder, stage, label, event['percent'], event['speed'], event['eta'])
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr_thread.join()
+        if store:
+            store.clear_progress(folder, stage, label)
+
+    elapsed = time.time() - t_start
+    if process.returncode == 0 and event and event['time']:
+        logger.info(f'ffmpeg 完成: {label}, {event["time"]:.1f}s 素材用时 {elapsed:.1f}s ({event["time"] / elapsed:.2f}x)')
+        if store:
+            store.record_ffmpeg_run(folder, stage, label, event['time'], elapsed)
+    return subprocess.CompletedProcess(command, process.returncode, stdout='', stderr=''.join(stderr_lines))
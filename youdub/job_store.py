@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+任务数据库
+用 SQLite 记录每个视频、每个阶段的状态、耗时、输入签名和错误信息。
+各个 step 在处理完成后写入，*_all_*_under_folder 和 WebUI 直接查询待处理列表，
+不再每次都 os.walk 整个 videos/ 目录。
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from loguru import logger
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join(project_root, 'jobs.db'))
+
+# 阶段顺序，以及每个阶段依赖的上一阶段
+STAGES = ['download', 'demucs', 'whisperx', 'translation', 'tts', 'synthesize', 'info', 'upload']
+STAGE_DEPENDS = {
+    'download': None,
+    'demucs': 'download',
+    'whisperx': 'demucs',
+    'translation': 'whisperx',
+    'tts': 'translation',
+    'synthesize': 'tts',
+    'info': 'synthesize',
+    'upload': 'synthesize',
+}
+
+# 阶段完成的标志文件（任意一组全部存在即视为完成），用于首次扫描和完成校验
+STAGE_OUTPUTS = {
+    'download': [['download.mp4'], ['download.webm']],
+    'demucs': [['audio_vocals.wav', 'audio_instruments.wav']],
+    'whisperx': [['transcript.json']],
+    'translation': [['translation.json']],
+    'tts': [['audio_combined.wav']],
+    'synthesize': [['video.mp4']],
+    'info': [['video.txt', 'video.png']],
+    'upload': [['bilibili.json']],
+}
+
+# 阶段的输入文件，用于计算输入签名；输入变化后该阶段重新处理（上传不可撤销，不因输入变化重新上传）
+STAGE_INPUTS = {
+    'download': [],
+    'demucs': ['audio.wav'],
+    'whisperx': ['audio_vocals.wav', 'audio.wav'],
+    'translation': ['transcript.json'],
+    'tts': ['translation.json'],
+    'synthesize': ['audio_combined.wav', 'translation.json'],
+    'info': ['summary.json'],
+    'upload': ['video.mp4'],
+}
+NO_REDO_STAGES = {'download', 'upload'}
+
+# 因输入变化重新处理时，除标志文件外还要删除的中间结果（否则步骤会直接复用旧结果）
+STAGE_REDO_CLEANUP = {
+    'tts': ['wavs'],
+}
+
+# 'stale' 记录的原因
+STALE_MISSING = 'outputs missing'
+STALE_INPUTS = 'inputs changed'
+# 内容指纹只读取文件头尾各 64KB
+_FINGERPRINT_BYTES = 64 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    folder TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    state TEXT NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    duration REAL,
+    input_hash TEXT,
+    error TEXT,
+    PRIMARY KEY (folder, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_stage_state ON jobs (stage, state);
+CREATE TABLE IF NOT EXISTS scans (
+    root TEXT PRIMARY KEY,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    folder TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    label TEXT NOT NULL,
+    percent REAL,
+    speed REAL,
+    eta REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (folder, stage, label)
+);
+CREATE TABLE IF NOT EXISTS ffmpeg_runs (
+    folder TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    label TEXT NOT NULL,
+    media_seconds REAL,
+    elapsed REAL,
+    speed REAL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ffmpeg_runs_finished ON ffmpeg_runs (finished_at);
+"""
+
+
+def _norm(folder):
+    return os.path.normcase(os.path.abspath(folder))
+
+
+def _upload_succeeded(folder):
+    """bilibili.json 在提交失败时也可能存在，与 is_uploaded 一样以返回码为准"""
+    try:
+        with open(os.path.join(folder, 'bilibili.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)['results'][0]['code'] == 0
+    except (OSError, ValueError, KeyError, IndexError, TypeError):
+        return False
+
+
+# 标志文件存在之外还需通过的检查
+STAGE_CHECKS = {
+    'upload': _upload_succeeded,
+}
+
+
+def stage_outputs_exist(folder, stage):
+    if not any(all(os.path.exists(os.path.join(folder, f)) for f in group) for group in STAGE_OUTPUTS[stage]):
+        return False
+    check = STAGE_CHECKS.get(stage)
+    return check is None or check(folder)
+
+
+def _fingerprint(path, size):
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(_FINGERPRINT_BYTES))
+        if size > _FINGERPRINT_BYTES:
+            f.seek(-_FINGERPRINT_BYTES, os.SEEK_END)
+            digest.update(f.read(_FINGERPRINT_BYTES))
+    return digest.hexdigest()[:16]
+
+
+def input_signature(folder, stage):
+    """
+    输入文件签名 {文件名: [大小, 修改时间, 内容指纹]}（JSON）
+
+    内容指纹只读取文件头尾，修改时间变了但指纹相同（拷贝、还原备份）时不算输入变化
+    """
+    signature = {}
+    for name in STAGE_INPUTS[stage]:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            st = os.stat(path)
+            signature[name] = [st.st_size, st.st_mtime_ns, _fingerprint(path, st.st_size)]
+    return json.dumps(signature, sort_keys=True)
+
+
+def compare_inputs(folder, stage, stored):
+    """
+    与记录的输入签名比较，返回 'same' / 'touched'（只有修改时间变了）/ 'changed'
+
+    没有记录或是旧格式的签名时无从比较，视为未变化
+    """
+    try:
+        saved = json.loads(stored)
+    except (TypeError, ValueError):
+        return 'same'
+    if not isinstance(saved, dict):
+        return 'same'
+    present = [name for name in STAGE_INPUTS[stage] if os.path.exists(os.path.join(folder, name))]
+    if set(present) != set(saved):
+        return 'changed'
+    result = 'same'
+    for name, (size, mtime_ns, fingerprint) in saved.items():
+        path = os.path.join(folder, name)
+        st = os.stat(path)
+        if st.st_size != size:
+            return 'changed'
+        if st.st_mtime_ns != mtime_ns:
+            if _fingerprint(path, st.st_size) != fingerprint:
+                return 'changed'
+            result = 'touched'
+    return result
+
+
+def _has_download(files):
+    return any(f.startswith('download') and (f.endswith('.mp4') or f.endswith('.webm')) for f in files)
+
+
+class JobStore:
+    """SQLite 任务状态库（线程安全）"""
+
+    def __init__(self, db_path=JOB_DB_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            self._conn.commit()
+            return rows
+
+    def _set(self, folder, stage, state, **fields):
+        columns = ['folder', 'stage', 'state'] + list(fields)
+        values = [_norm(folder), stage, state] + list(fields.values())
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns[2:])
+        self._execute(
+            f'INSERT INTO jobs ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+            f'ON CONFLICT(folder, stage) DO UPDATE SET {updates}',
+            values)
+
+    def mark_running(self, folder, stage, input_hash=None):
+        self._set(folder, stage, 'running', started_at=time.time(), finished_at=None, duration=None, input_hash=input_hash, error=None)
+
+    def mark_done(self, folder, stage, duration=None, input_hash=None):
+        self._set(folder, stage, 'done', finished_at=time.time(), duration=duration, input_hash=input_hash, error=None)
+
+    def mark_skipped(self, folder, stage, duration=None):
+        self._set(folder, stage, 'skipped', finished_at=time.time(), duration=duration)
+
+    def mark_failed(self, folder, stage, error, duration=None):
+        self._set(folder, stage, 'failed', finished_at=time.time(), duration=duration, error=str(error)[:2000])
+
+    def get_job(self, folder, stage):
+        rows = self._execute(
+            'SELECT state, started_at, finished_at, duration, input_hash, error FROM jobs WHERE folder = ? AND stage = ?',
+            (_norm(folder), stage))
+        if not rows:
+            return None
+        keys = ['state', 'started_at', 'finished_at', 'duration', 'input_hash', 'error']
+        return dict(zip(keys, rows[0]))
+
+    def is_done(self, folder, stage):
+        job = self.get_job(folder, stage)
+        return job is not None and job['state'] == 'done'
+
+    def _under(self, root):
+        root = _norm(root)
+        return '(folder = ? OR substr(folder, 1, ?) = ?)', [root, len(root) + 1, os.path.join(root, '')]
+
+    def is_scanned(self, root):
+        """root 本身或其任一上级目录是否已经扫描过"""
+        path = _norm(root)
+        candidates = [path]
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            candidates.append(parent)
+            path = parent
+        rows = self._execute(
+            f'SELECT 1 FROM scans WHERE root IN ({", ".join("?" * len(candidates))}) LIMIT 1', candidates)
+        return bool(rows)
+
+    def _scan_folder(self, folder):
+        for stage in STAGES:
+            if stage_outputs_exist(folder, stage):
+                self._execute(
+                    'INSERT OR IGNORE INTO jobs (folder, stage, state, finished_at) VALUES (?, ?, ?, ?)',
+                    (_norm(folder), stage, 'done', os.path.getmtime(folder)))
+
+    def scan(self, root):
+        """遍历一次目录，把已有的标志文件同步到数据库（只补充，不覆盖已有记录）"""
+        t_start = time.time()
+        count = 0
+        for folder, _, files in os.walk(root):
+            if not _has_download(files):
+                continue
+            count += 1
+            self._scan_folder(folder)
+        self._execute('INSERT OR REPLACE INTO scans (root, scanned_at) VALUES (?, ?)', (_norm(root), time.time()))
+        logger.info(f'任务数据库已同步 {root}: {count} 个视频，用时 {time.time() - t_start:.2f}s')
+
+    def refresh(self, root):
+        """
+        补充登记 root 下新出现的视频目录
+
+        已有记录的视频目录由 track() 维护，不再深入遍历（wavs/、SPEAKER/ 等大目录不会被列出）；
+        其余目录中有下载文件的即为新视频，按标志文件登记
+        """
+        if not self.is_scanned(root):
+            self.scan(root)
+            return
+        where, params = self._under(root)
+        known = {row[0] for row in self._execute(f'SELECT DISTINCT folder FROM jobs WHERE {where}', params)}
+        added = 0
+        for folder, dirs, files in os.walk(root):
+            if _norm(folder) in known:
+                dirs[:] = []
+                continue
+            if _has_download(files):
+                self._scan_folder(folder)
+                added += 1
+        if added:
+            logger.info(f'任务数据库登记了 {root} 下 {added} 个新视频')
+
+    def _still_done(self, folder, stage, input_hash):
+        """校验一条 done 记录：标志文件仍然存在、输入没有变化，否则标记为 stale"""
+        if not stage_outputs_exist(folder, stage):
+            reason = STALE_MISSING
+        else:
+            state = 'same' if stage in NO_REDO_STAGES else compare_inputs(folder, stage, input_hash)
+            if state == 'touched':
+                # 只是修改时间变了（拷贝、还原），更新签名，避免下次再读文件比较
+                self._execute('UPDATE jobs SET input_hash = ? WHERE folder = ? AND stage = ?',
+                              (input_signature(folder, stage), _norm(folder), stage))
+            if state != 'changed':
+                return True
+            reason = STALE_INPUTS
+        logger.info(f'[{stage}] {folder} 需要重新处理: {reason}')
+        self._set(folder, stage, 'stale', error=reason)
+        return False
+
+    def forget(self, root):
+        """清除 root 下的所有记录"""
+        where, params = self._under(root)
+        self._execute(f'DELETE FROM jobs WHERE {where}', params)
+        self._execute(f'DELETE FROM scans WHERE {where.replace("folder", "root")}', params)
+
+    def rescan(self, root):
+        """丢弃 root 下的记录并按文件系统重新同步（手动删除了中间文件时使用）"""
+        self.forget(root)
+        self.scan(root)
+
+    def pending(self, root, stage):
+        """返回 root 下上一阶段已完成、本阶段未完成的视频目录（done 记录会先与文件系统核对）"""
+        self.refresh(root)
+        depends = STAGE_DEPENDS[stage]
+        if depends is None:
+            # 下载阶段之前目录还不存在，没有可查询的待处理项
+            return []
+        where, params = self._under(root)
+        rows = self._execute(
+            f"SELECT folder, stage, input_hash FROM jobs WHERE stage IN (?, ?) AND state = 'done' AND {where}",
+            [depends, stage] + params)
+        done = {depends: set(), stage: set()}
+        for folder, row_stage, input_hash in rows:
+            if self._still_done(folder, row_stage, input_hash):
+                done[row_stage].add(folder)
+        return sorted(done[depends] - done[stage])
+
+    def summary(self, root):
+        """各阶段状态统计 {stage: {state: count}}"""
+        self.refresh(root)
+        where, params = self._under(root)
+        rows = self._execute(f'SELECT stage, state, COUNT(*) FROM jobs WHERE {where} GROUP BY stage, state', params)
+        result = {stage: {} for stage in STAGES}
+        for stage, state, count in rows:
+            result.setdefault(stage, {})[state] = count
+        return result
+
+    def failures(self, root, limit=20):
+        where, params = self._under(root)
+        return self._execute(
+            f"SELECT folder, stage, error FROM jobs WHERE state = 'failed' AND {where} ORDER BY finished_at DESC LIMIT ?",
+            params + [limit])
+
+    def update_progress(self, folder, stage, label, percent=None, speed=None, eta=None):
+        """记录正在运行的 ffmpeg 进度（percent 为 0-100，speed 为实时倍数，eta 为剩余秒数）"""
+        self._execute(
+            'INSERT OR REPLACE INTO progress (folder, stage, label, percent, speed, eta, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (_norm(folder), stage, label, percent, speed, eta, time.time()))
+
+    def clear_progress(self, folder, stage, label):
+        self._execute('DELETE FROM progress WHERE folder = ? AND stage = ? AND label = ?', (_norm(folder), stage, label))
+
+    def progress(self, root):
+        where, params = self._under(root)
+        return self._execute(
+            f'SELECT folder, stage, label, percent, speed, eta, updated_at FROM progress WHERE {where} '
+            f'ORDER BY folder, stage, label', params)
+
+    def record_ffmpeg_run(self, folder, stage, label, media_seconds, elapsed):
+        """记录一次 ffmpeg 的处理速度，用于发现编码速度的退化"""
+        speed = media_seconds / elapsed if media_seconds and elapsed else None
+        self._execute(
+            'INSERT INTO ffmpeg_runs (folder, stage, label, media_seconds, elapsed, speed, finished_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (_norm(folder), stage, label, media_seconds, elapsed, speed, time.time()))
+
+    def ffmpeg_runs(self, root, limit=20):
+        where, params = self._under(root)
+        return self._execute(
+            f'SELECT folder, stage, label, media_seconds, elapsed, speed, finished_at FROM ffmpeg_runs '
+            f'WHERE {where} ORDER BY finished_at DESC LIMIT ?', params + [limit])
+
+    def _clear_outputs(self, folder, stage):
+        """输入变化后重新处理前，删除旧的输出，否则步骤会因输出已存在而直接跳过"""
+        names = {name for group in STAGE_OUTPUTS[stage] for name in group} | set(STAGE_REDO_CLEANUP.get(stage, []))
+        for name in sorted(names):
+            path = os.path.join(folder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        logger.info(f'[{stage}] {folder} 输入已变化，删除旧的输出后重新处理')
+
+    @contextmanager
+    def track(self, folder, stage):
+        """记录一次阶段执行：开始、耗时、成功/跳过/失败"""
+        job = self.get_job(folder, stage)
+        if job is not None and job['state'] == 'stale' and job['error'] == STALE_INPUTS:
+            self._clear_outputs(folder, stage)
+        self.mark_running(folder, stage)
+        t_start = time.time()
+        try:
+            yield
+        except Exception as e:
+            self.mark_failed(folder, stage, e, duration=time.time() - t_start)
+            raise
+        duration = time.time() - t_start
+        if stage_outputs_exist(folder, stage):
+            # 签名在结束时计算：有的步骤会改写自己的输入（如 tts 回写 translation.json）
+            self.mark_done(folder, stage, duration=duration, input_hash=input_signature(folder, stage))
+        else:
+            self.mark_skipped(folder, stage, duration=duration)
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """获取任务数据库（延迟初始化）"""
+    global _job_store
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                _job_store = JobStore()
+    return _job_store
+
+
+def track_stage(stage):
+    """装饰器：被装饰函数的第一个参数必须是视频目录"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(folder, *args, **kwargs):
+            with get_job_store().track(folder, stage):
+                return fn(folder, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def pending_folders(root_folder, stage):
+    return get_job_store().pending(root_folder, stage)
+
+
+def job_status(root_folder='videos', rescan=False):
+    """WebUI 用：输出 root_folder 下各阶段的完成情况"""
+    store = get_job_store()
+    if rescan:
+        store.rescan(root_folder)
+    summary = store.summary(root_folder)
+    lines = []
+    for stage in STAGES:
+        states = summary.get(stage, {})
+        counts = ', '.join(f'{k}: {v}' for k, v in sorted(states.items())) or '-'
+        pending = len(store.pending(root_folder, stage))
+        lines.append(f'{stage:<12} 待处理: {pending:<5} {counts}')
+    running = store.progress(root_folder)
+    if running:
+        lines.append('\n进行中:')
+        for folder, stage, label, percent, speed, eta, _ in running:
+            percent = f'{percent:.1f}%' if percent is not None else '-'
+            speed = f'{speed:.2f}x' if speed else '-'
+            eta = f'{eta:.0f}s' if eta is not None else '-'
+            lines.append(f'[{stage}] {folder} {label}: {percent}, 速度 {speed}, 剩余 {eta}')
+    runs = store.ffmpeg_runs(root_folder, limit=10)
+    if runs:
+        lines.append('\n最近 ffmpeg 处理速度:')
+        for folder, stage, label, media_seconds, elapsed, speed, _ in runs:
+            speed = f'{speed:.2f}x' if speed else '-'
+            lines.append(f'[{stage}] {folder} {label}: {media_seconds or 0:.0f}s 素材用时 {elapsed:.1f}s ({speed})')
+    failures = store.failures(root_folder)
+    if failures:
+        lines.append('\n最近失败:')
+        for folder, stage, error in failures:
+            lines.append(f'[{stage}] {folder}: {error}')
+    return '\n'.join(lines)
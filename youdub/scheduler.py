@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+流水线调度器
+把每个 stepNNN 作为一个独立的 stage，每个 stage 拥有自己的工作线程和有界队列。
+这样视频 N+1 在做人声分离时，视频 N 可以同时翻译，视频 N-1 可以同时编码，
+GPU / LLM / 网络 / ffmpeg 不再互相等待。
+"""
+import queue
+import threading
+import time
+from loguru import logger
+
+_STOP = object()
+
+
+class Stage:
+    """流水线中的一个阶段"""
+
+    def __init__(self, name, fn, workers=1, queue_size=2, max_retries=1, batch_size=None):
+        """
+        Args:
+            name: 阶段名称（用于日志）
+            fn: 处理函数，接收上一阶段的输出，返回交给下一阶段的输入；
+                返回 None 表示该视频已无需继续处理（视为成功结束）；抛出异常表示失败
+            workers: 工作线程数（GPU 阶段通常为 1）
+            queue_size: 输入队列容量，限制上游最多领先多少个视频
+            max_retries: 单个视频（或一批）在本阶段的最大尝试次数
+            batch_size: 设置后为批处理阶段：队列中已在等待的视频最多 batch_size 个一起交给 fn，
+                fn 接收输入列表并返回等长的输出列表；不会为了凑批而等待
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size)) if batch_size else None
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size), self.batch_size or 1))
+        self.max_retries = max(1, int(max_retries))
+
+
+class _Job:
+    def __init__(self, item, label):
+        self.item = item
+        self.label = label
+        self.payload = item
+        self.timings = {}
+        self.error = None
+
+
+class StagePipeline:
+    """按阶段并行的流水线调度器"""
+
+    def __init__(self, stages, label_fn=str):
+        if not stages:
+            raise ValueError('StagePipeline 至少需要一个 stage')
+        self.stages = stages
+        self.label_fn = label_fn
+        self._lock = threading.Lock()
+        self._results = []
+
+    def _finish(self, job, success):
+        with self._lock:
+            self._results.append((job, success))
+        timings = ', '.join(f'{k}: {v:.1f}s' for k, v in job.timings.items())
+        if success:
+            logger.info(f'[pipeline] 完成: {job.label} ({timings})')
+        else:
+            logger.warning(f'[pipeline] 失败: {job.label} @ {job.error}')
+
+    def _take_batch(self, stage):
+        """阻塞取一个任务，再顺带取出队列中已在等待的任务；返回 (jobs, 是否收到结束信号)"""
+        job = stage.queue.get()
+        if job is _STOP:
+            return [], True
+        jobs = [job]
+        while len(jobs) < (stage.batch_size or 1):
+            try:
+                job = stage.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def _run_stage(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            jobs, stop = self._take_batch(stage)
+            if jobs:
+                label = jobs[0].label if len(jobs) == 1 else f'{len(jobs)} 个视频'
+                outputs = None
+                t_start = time.time()
+                for retry in range(stage.max_retries):
+                    try:
+                        if stage.batch_size:
+                            outputs = stage.fn([job.payload for job in jobs])
+                        else:
+                            outputs = [stage.fn(jobs[0].payload)]
+                        break
+                    except Exception as e:
+                        for job in jobs:
+                            job.error = f'{stage.name}: {e}'
+                        logger.error(f'[{stage.name}] {label} 处理失败 (retry {retry + 1}/{stage.max_retries}): {e}')
+                elapsed = time.time() - t_start
+
+                for i, job in enumerate(jobs):
+                    job.timings[stage.name] = elapsed
+                    if outputs is None:
+                        self._finish(job, False)
+                    elif outputs[i] is None or next_stage is None:
+                        self._finish(job, True)
+                    else:
+                        job.payload = outputs[i]
+                        next_stage.queue.put(job)
+            if stop:
+                break
+
+    def run(self, items):
+        """
+        运行流水线，阻塞直到所有视频处理完成
+
+        Returns:
+            (success_list, fail_list) 原始 item 列表
+        """
+        self._results = []
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage_threads = [threading.Thread(target=self._run_stage, args=(index,), name=f'{stage.name}-{i}', daemon=True)
+                             for i in range(stage.workers)]
+            for t in stage_threads:
+                t.start()
+            threads.append(stage_threads)
+        logger.info('[pipeline] ' + ' -> '.join(f'{s.name}(x{s.workers})' for s in self.stages))
+
+        # 有界队列会在上游领先太多时阻塞这里，避免一次性下载整个频道
+        for item in items:
+            self.stages[0].queue.put(_Job(item, self.label_fn(item)))
+
+        # 逐级关闭：上一阶段的所有线程退出后，下游才会收到结束信号
+        for stage, stage_threads in zip(self.stages, threads):
+            for _ in stage_threads:
+                stage.queue.put(_STOP)
+            for t in stage_threads:
+                t.join()
+
+        success_list = [job.item for job, success in self._results if success]
+        fail_list = [job.item for job, success in self._results if not success]
+        return success_list, fail_list
@@ -3,6 +3,7 @@ import re
 import subprocess
 import shutil
 from loguru import logger
+from .job_store import get_job_store
 
 # Setup Deno for yt-dlp JavaScript runtime before importing yt_dlp
 DENO_PATH = None
@@ -110,6 +111,7 @@ def download_single_video(info, folder_path, resolution='1080p'):
     # Check for existing video in either mp4 or webm format
     if os.path.exists(os.path.join(output_folder, 'download.mp4')) or os.path.exists(os.path.join(output_folder, 'download.webm')):
         logger.info(f'Video already downloaded in {output_folder}')
+        get_job_store().mark_done(output_folder, 'download')
         return output_folder
     
     resolution = resolution.replace('p', '')
@@ -123,8 +125,9 @@ def download_single_video(info, folder_path, resolution='1080p'):
     })
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([info['webpage_url']])
+        with get_job_store().track(output_folder, 'download'):
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.download([info['webpage_url']])
         logger.info(f'Video downloaded in {output_folder}')
         return output_folder
     except Exception as e:
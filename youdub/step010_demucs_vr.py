@@ -1,57 +1,27 @@
+import json
 import shutil
+import wave
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+from scipy.io import wavfile
 from demucs.api import Separator
 import os
 from loguru import logger
 import time
-import subprocess
+from .ffmpeg_runner import run_ffmpeg
+from .toolchain import get_ffmpeg_path
 from .utils import save_wav, normalize_wav
+from .job_store import track_stage, pending_folders, get_job_store
 import torch
 import shutil
 
 def check_ffmpeg():
-    """检查 ffmpeg 是否可用，优先使用环境变量配置的路径"""
-    # 首先检查环境变量 FFMPEG_PATH
-    env_ffmpeg_path = os.getenv('FFMPEG_PATH')
-    if env_ffmpeg_path and os.path.exists(env_ffmpeg_path):
-        logger.info(f"使用环境变量配置的 ffmpeg: {env_ffmpeg_path}")
-        return env_ffmpeg_path
-    elif env_ffmpeg_path:
-        logger.warning(f"环境变量 FFMPEG_PATH 指定的路径不存在: {env_ffmpeg_path}")
-    
-    # 尝试从系统 PATH 中查找
-    ffmpeg_path = shutil.which('ffmpeg')
-    if ffmpeg_path:
-        return ffmpeg_path
-    
-    # 尝试常见的 Windows 安装路径
-    common_paths = [
-        r'C:\ffmpeg\bin\ffmpeg.exe',
-        r'C:\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffmpeg.exe',
-        r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
-        r'C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe',
-    ]
-    
-    for path in common_paths:
-        if os.path.exists(path):
-            return path
-    
-    # 检查项目目录下的 ffmpeg（支持相对路径）
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    project_ffmpeg_paths = [
-        os.path.join(project_root, 'ffmpeg', 'bin', 'ffmpeg.exe'),
-        os.path.join(project_root, 'ffmpeg', 'ffmpeg-8.0.1-essentials_build', 'bin', 'ffmpeg.exe'),
-        os.path.join(project_root, 'ffmpeg.exe'),
-        # 支持 D:\YouDub-webui 这样的绝对路径项目目录
-        r'D:\YouDub-webui\ffmpeg\bin\ffmpeg.exe',
-        r'D:\YouDub-webui\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffmpeg.exe',
-    ]
-    
-    for path in project_ffmpeg_paths:
-        if os.path.exists(path):
-            logger.info(f"找到项目目录下的 ffmpeg: {path}")
-            return path
-    
-    return None
+    """检查 ffmpeg 是否可用，返回路径（未找到时为 None），优先使用环境变量配置的路径"""
+    return get_ffmpeg_path()
+
 
 def get_ffmpeg_install_guide():
     """返回 ffmpeg 安装指导"""
@@ -114,6 +84,32 @@ else:
 
 auto_device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 separator = None
+# 常驻的 CPU 分离进程池（按 模型/shifts/进程数/线程数 复用）
+cpu_pool = None
+cpu_pool_key = None
+cpu_pool_lock = threading.Lock()
+
+# 长音频分块分离：每块时长与相邻块重叠时长（秒），DEMUCS_CHUNK_SECONDS=0 关闭分块
+DEMUCS_CHUNK_SECONDS = float(os.getenv('DEMUCS_CHUNK_SECONDS', '600'))
+DEMUCS_OVERLAP_SECONDS = float(os.getenv('DEMUCS_OVERLAP_SECONDS', '5'))
+
+# CPU 多进程分离（默认关闭）：进程数（1 为关闭进程池，0 为按核数自动选择）与每个进程的线程数
+# 每个进程各加载一份模型，内存占用成倍增加，需要显式开启
+DEMUCS_CPU_WORKERS = int(os.getenv('DEMUCS_CPU_WORKERS', '1'))
+DEMUCS_THREADS_PER_WORKER = int(os.getenv('DEMUCS_THREADS_PER_WORKER', '4'))
+
+# 跳过分离（默认关闭）：先检测背景音乐，纯语音的视频（或时间段）直接把原音作为人声、乐器轨为静音
+# 误判为纯语音时背景音乐会留在人声轨里，所以需要显式开启
+DEMUCS_SKIP_DETECTION = os.getenv('DEMUCS_SKIP_DETECTION', '0') == '1'
+# 低能量帧比例低于该值的片段判定为有背景音乐（语音在词句间有大量停顿，音乐则持续有能量）
+MUSIC_LOW_ENERGY_RATIO = float(os.getenv('MUSIC_LOW_ENERGY_RATIO', '0.12'))
+# 低能量帧比例在阈值的 (1 + 该值) 倍以内的片段视为拿不准，按有音乐处理
+MUSIC_BORDERLINE_MARGIN = float(os.getenv('MUSIC_BORDERLINE_MARGIN', '0.5'))
+# 拿不准的片段超过该比例时检测结果不可靠，整段分离
+MUSIC_BORDERLINE_MAX_RATIO = float(os.getenv('MUSIC_BORDERLINE_MAX_RATIO', '0.2'))
+# 音乐片段占比不超过该值时整段跳过分离
+DEMUCS_SKIP_MUSIC_RATIO = float(os.getenv('DEMUCS_SKIP_MUSIC_RATIO', '0.05'))
+MUSIC_REGION_SECONDS = 10
 
 def init_demucs(model_name='htdemucs', device='auto', shifts=0):
     global separator
@@ -139,6 +135,126 @@ def reload_model(model_name: str = "htdemucs_ft", device: str = 'auto', progress
     t_end = time.time()
     logger.info(f'Demucs model reloaded in {t_end - t_start:.2f} seconds')
     
+def detect_music_regions(audio_path, region_seconds=MUSIC_REGION_SECONDS, frame_size=2048):
+    """
+    按固定时长的片段做廉价的音乐检测，返回 (sample_rate, regions)
+
+    每个片段计算帧能量的低能量帧比例（语音高、音乐低）和平均频谱平坦度（仅记录用于审计）。
+    静音片段视为无音乐。只读取内存映射的 int16 wav，格式不符时返回 None。
+    """
+    sample_rate, audio = wavfile.read(audio_path, mmap=True)
+    if audio.dtype != np.int16:
+        return sample_rate, None
+    region = int(region_seconds * sample_rate)
+    window = np.hanning(frame_size).astype(np.float32)
+    regions = []
+    for start in range(0, len(audio), region):
+        end = min(start + region, len(audio))
+        block = np.asarray(audio[start:end], dtype=np.float32) / 32768.0
+        if block.ndim == 2:
+            block = block.mean(axis=1)
+        n_frames = len(block) // frame_size
+        music, low_energy_ratio, flatness = False, 1.0, 0.0
+        if n_frames >= 4:
+            frames = block[:n_frames * frame_size].reshape(n_frames, frame_size)
+            rms = np.sqrt((frames ** 2).mean(axis=1))
+            mean_rms = float(rms.mean())
+            spectrum = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-10
+            flatness = float((np.exp(np.log(spectrum).mean(axis=1)) / spectrum.mean(axis=1)).mean())
+            if mean_rms >= 1e-3:
+                low_energy_ratio = float((rms < 0.5 * mean_rms).mean())
+                music = low_energy_ratio < MUSIC_LOW_ENERGY_RATIO
+        regions.append({
+            'start': round(start / sample_rate, 2),
+            'end': round(end / sample_rate, 2),
+            'music': bool(music),
+            'low_energy_ratio': round(low_energy_ratio, 3),
+            'flatness': round(flatness, 4),
+        })
+    return sample_rate, regions
+
+
+def analyze_separation_need(folder):
+    """
+    判断视频是否需要人声分离，并把判定结果写入 separation_decision.json 备查
+
+    mode: skip（整段跳过）/ partial（只分离有音乐的片段）/ separate（全部分离）
+    """
+    audio_path = os.path.join(folder, 'audio.wav')
+    t_start = time.time()
+    _, regions = detect_music_regions(audio_path)
+    if not regions:
+        return None
+    # 接近阈值的片段宁可多分离也不要漏掉音乐
+    borderline_limit = MUSIC_LOW_ENERGY_RATIO * (1 + MUSIC_BORDERLINE_MARGIN)
+    borderline = 0
+    for r in regions:
+        if not r['music'] and r['low_energy_ratio'] < borderline_limit:
+            r['music'] = True
+            r['borderline'] = True
+            borderline += 1
+    borderline_ratio = borderline / len(regions)
+    music_ratio = sum(r['music'] for r in regions) / len(regions)
+    if borderline_ratio > MUSIC_BORDERLINE_MAX_RATIO:
+        mode = 'separate'
+        logger.warning(f'{borderline_ratio:.1%} of {folder} is borderline for music detection, falling back to full separation')
+    elif music_ratio <= DEMUCS_SKIP_MUSIC_RATIO:
+        mode = 'skip'
+    elif music_ratio >= 1 - DEMUCS_SKIP_MUSIC_RATIO:
+        mode = 'separate'
+    else:
+        mode = 'partial'
+    decision = {
+        'mode': mode,
+        'music_ratio': round(music_ratio, 3),
+        'borderline_ratio': round(borderline_ratio, 3),
+        'low_energy_threshold': MUSIC_LOW_ENERGY_RATIO,
+        'borderline_threshold': round(borderline_limit, 3),
+        'skip_music_ratio': DEMUCS_SKIP_MUSIC_RATIO,
+        'region_seconds': MUSIC_REGION_SECONDS,
+        'regions': regions,
+    }
+    with open(os.path.join(folder, 'separation_decision.json'), 'w', encoding='utf-8') as f:
+        json.dump(decision, f, indent=2, ensure_ascii=False)
+    logger.info(f'Separation decision for {folder}: {mode} (music ratio {music_ratio:.1%}, '
+                f'{borderline} borderline regions treated as music, analyzed in {time.time() - t_start:.2f}s)')
+    if mode != 'separate':
+        logger.warning(f'Demucs will be skipped for {"all" if mode == "skip" else "part"} of {folder}; '
+                       f'if music leaks into the vocals, set DEMUCS_SKIP_DETECTION=0 and delete audio_vocals.wav')
+    return decision
+
+
+def _window_is_speech(decision, start, end, sample_rate):
+    """窗口覆盖的所有片段都没有音乐时，可以跳过分离；判定为整段分离时一律分离"""
+    if decision is None or decision['mode'] == 'separate':
+        return False
+    t0, t1 = start / sample_rate, end / sample_rate
+    return not any(r['music'] for r in decision['regions'] if r['end'] > t0 and r['start'] < t1)
+
+
+def _passthrough_window(audio, start, end):
+    vocals = np.asarray(audio[start:end], dtype=np.float32).T / 32768.0
+    return vocals, np.zeros_like(vocals)
+
+
+def write_passthrough(audio_path, vocal_output_path, instruments_output_path):
+    """纯语音：原音直接作为人声，乐器轨写入等长静音"""
+    logger.info(f'No background music detected, skipping separation for {audio_path}')
+    shutil.copyfile(audio_path, vocal_output_path)
+    sample_rate, audio = wavfile.read(audio_path, mmap=True)
+    channels = 1 if audio.ndim == 1 else audio.shape[1]
+    instruments_tmp = instruments_output_path + '.part'
+    writer = _open_wav_writer(instruments_tmp, channels, sample_rate)
+    try:
+        block = sample_rate * 60
+        for start in range(0, len(audio), block):
+            writer.writeframes(bytes(2 * channels * (min(start + block, len(audio)) - start)))
+    finally:
+        writer.close()
+    os.replace(instruments_tmp, instruments_output_path)
+
+
+@track_stage('demucs')
 def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5) -> None:
     global separator
     audio_path = os.path.join(folder, 'audio.wav')
@@ -151,8 +267,15 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
         logger.info(f'Audio already separated in {folder}')
         return
     
+    decision = analyze_separation_need(folder) if DEMUCS_SKIP_DETECTION else None
+    if decision is not None and decision['mode'] == 'skip':
+        write_passthrough(audio_path, vocal_output_path, instruments_output_path)
+        return
+    
     logger.info(f'Separating audio from {folder}')
     load_model(model_name, device, progress, shifts)
+    if DEMUCS_CHUNK_SECONDS > 0 and separate_audio_streaming(audio_path, vocal_output_path, instruments_output_path, decision=decision):
+        return
     t_start = time.time()
     try:
         origin, separated = separator.separate_audio_file(audio_path)
@@ -185,6 +308,249 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
     save_wav(instruments, instruments_output_path, sample_rate=44100)
     logger.info(f'Instruments saved to {instruments_output_path}')
     
+def _write_wav_frames(writer, wav):
+    """把 float 波形 (channels, n) 追加写入 int16 wav"""
+    frames = np.clip(wav.T * 32767, -32768, 32767).astype(np.int16)
+    writer.writeframes(frames.tobytes())
+
+
+def _open_wav_writer(path, channels, sample_rate):
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(channels)
+    writer.setsampwidth(2)
+    writer.setframerate(sample_rate)
+    return writer
+
+
+def _chunk_windows(total, step, overlap):
+    """把 [0, total) 切成 (start, end) 窗口，每个窗口向后多带 overlap 个采样用于交叉淡化"""
+    windows = []
+    for start in range(0, total, step):
+        end = min(start + step + overlap, total)
+        windows.append((start, end))
+        if end == total:
+            break
+    return windows
+
+
+def _separate_window(audio, start, end, sample_rate):
+    window = torch.from_numpy(np.asarray(audio[start:end], dtype=np.float32).T / 32768.0)
+    _, separated = separator.separate_tensor(window, sample_rate)
+    vocals = separated.pop('vocals').numpy()
+    instruments = sum(separated.values()).numpy()
+    return vocals, instruments
+
+
+def _write_stitched(outputs, windows, step, overlap, channels, sample_rate, vocal_output_path, instruments_output_path):
+    """
+    按窗口顺序拼接分离结果：重叠区线性交叉淡化，逐块写入 .part 文件，完成后再改名
+    outputs 为与 windows 一一对应的 (vocals, instruments) 迭代器
+    """
+    total = windows[-1][1]
+    fade_in = np.linspace(0, 1, overlap, dtype=np.float32)
+    fade_out = 1 - fade_in
+    vocal_tmp = vocal_output_path + '.part'
+    instruments_tmp = instruments_output_path + '.part'
+    vocal_writer = _open_wav_writer(vocal_tmp, channels, sample_rate)
+    instruments_writer = _open_wav_writer(instruments_tmp, channels, sample_rate)
+    prev_tail = None
+    try:
+        for (start, end), (vocals, instruments) in zip(windows, outputs):
+            outputs_ = [np.array(vocals, dtype=np.float32), np.array(instruments, dtype=np.float32)]
+            if prev_tail is not None:
+                n = min(overlap, outputs_[0].shape[1])
+                for out, tail in zip(outputs_, prev_tail):
+                    out[:, :n] = tail[:, :n] * fade_out[:n] + out[:, :n] * fade_in[:n]
+            last = end == total
+            keep = outputs_[0].shape[1] if last else step
+            _write_wav_frames(vocal_writer, outputs_[0][:, :keep])
+            _write_wav_frames(instruments_writer, outputs_[1][:, :keep])
+            prev_tail = [out[:, step:] for out in outputs_]
+            logger.info(f'Separated {end / sample_rate:.0f}/{total / sample_rate:.0f}s')
+    finally:
+        vocal_writer.close()
+        instruments_writer.close()
+    os.replace(vocal_tmp, vocal_output_path)
+    os.replace(instruments_tmp, instruments_output_path)
+    logger.info(f'Vocals saved to {vocal_output_path}')
+    logger.info(f'Instruments saved to {instruments_output_path}')
+
+
+def separate_audio_streaming(audio_path, vocal_output_path, instruments_output_path,
+                             chunk_seconds=None, overlap_seconds=None, decision=None):
+    """
+    分块流式分离长音频，峰值内存与时长无关
+
+    通过内存映射读取 audio.wav，每次只把一个窗口（chunk + overlap）送入模型，
+    相邻窗口在重叠区做线性交叉淡化，结果逐块写入磁盘。
+    没有音乐的窗口（见 analyze_separation_need）直接透传，不送入模型。
+    音频不长于一个窗口、或格式不支持时返回 False，由调用方走整段分离。
+    """
+    chunk_seconds = chunk_seconds or DEMUCS_CHUNK_SECONDS
+    overlap_seconds = overlap_seconds or DEMUCS_OVERLAP_SECONDS
+    sample_rate, audio = wavfile.read(audio_path, mmap=True)
+    if audio.dtype != np.int16 or audio.ndim != 2 or sample_rate != separator.samplerate:
+        return False
+    total = audio.shape[0]
+    step = int(chunk_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+    if total <= step + overlap:
+        return False
+
+    logger.info(f'Streaming separation: {total / sample_rate / 60:.1f} min in {chunk_seconds}s chunks')
+    t_start = time.time()
+    windows = _chunk_windows(total, step, overlap)
+    outputs = (_passthrough_window(audio, start, end) if _window_is_speech(decision, start, end, sample_rate)
+               else _separate_window(audio, start, end, sample_rate)
+               for start, end in windows)
+    _write_stitched(outputs, windows, step, overlap, audio.shape[1], sample_rate, vocal_output_path, instruments_output_path)
+    logger.info(f'Audio separated in {time.time() - t_start:.2f} seconds')
+    return True
+
+
+# ---------------- CPU 多进程分离 ----------------
+
+def _init_cpu_worker(model_name, shifts, threads):
+    """进程池初始化：固定线程数，每个进程只加载一次模型"""
+    global separator
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    separator = Separator(model_name, device='cpu', progress=False, shifts=shifts)
+
+
+def _cpu_separate_file(folder, model_name, shifts):
+    separate_audio(folder, model_name, 'cpu', False, shifts)
+    return folder
+
+
+def _cpu_separate_window(audio_path, start, end, output_prefix):
+    """分离一个时间窗口，结果写成 .npy 交给主进程拼接（避免大数组跨进程序列化）"""
+    sample_rate, audio = wavfile.read(audio_path, mmap=True)
+    vocals, instruments = _separate_window(audio, start, end, sample_rate)
+    vocal_path = f'{output_prefix}_{start}_vocals.npy'
+    instruments_path = f'{output_prefix}_{start}_instruments.npy'
+    np.save(vocal_path, vocals)
+    np.save(instruments_path, instruments)
+    return vocal_path, instruments_path
+
+
+def _load_and_remove_window(paths):
+    arrays = tuple(np.load(path) for path in paths)
+    for path in paths:
+        os.remove(path)
+    return arrays
+
+
+def get_cpu_pool_layout(num_files, workers=None, threads=None):
+    """根据 CPU 核数和待处理文件数选择进程池布局"""
+    threads = threads or DEMUCS_THREADS_PER_WORKER
+    cores = os.cpu_count() or 1
+    if not workers:
+        workers = DEMUCS_CPU_WORKERS if DEMUCS_CPU_WORKERS > 1 else max(1, cores // threads)
+    layout = 'files' if num_files > 1 else 'chunks'
+    return {'workers': workers, 'threads': threads, 'cores': cores, 'layout': layout}
+
+
+def get_cpu_pool(model_name, shifts, workers, threads):
+    """
+    常驻的 CPU 分离进程池（延迟创建），多个视频、多次调用共用，模型在每个进程中只加载一次
+
+    流水线中 demucs 阶段每次只处理一个视频，若每次都新建进程池，每个视频都要重新加载 N 份模型。
+    参数变化时关闭旧进程池重新创建。
+    """
+    global cpu_pool, cpu_pool_key
+    key = (model_name, shifts, workers, threads)
+    with cpu_pool_lock:
+        if cpu_pool is not None and cpu_pool_key != key:
+            cpu_pool.shutdown()
+            cpu_pool = None
+        if cpu_pool is None:
+            cpu_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_cpu_worker, initargs=(model_name, shifts, threads))
+            cpu_pool_key = key
+    return cpu_pool
+
+
+def shutdown_cpu_pool():
+    global cpu_pool, cpu_pool_key
+    with cpu_pool_lock:
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+            cpu_pool = None
+            cpu_pool_key = None
+
+
+def separate_all_audio_cpu_pool(folders, model_name='htdemucs', shifts=0, workers=None, threads=None):
+    """
+    CPU 节点上的多进程分离
+    - 多个视频：按文件分给各进程
+    - 单个长视频：按时间块分给各进程，主进程交叉淡化拼接
+    返回实际使用的布局信息
+    """
+    layout = get_cpu_pool_layout(len(folders), workers, threads)
+    logger.info(f"CPU Demucs 进程池: {layout['workers']} 进程 x {layout['threads']} 线程 "
+                f"({layout['cores']} 核), 布局: {layout['layout']}, 待处理 {len(folders)} 个视频")
+    executor = get_cpu_pool(model_name, shifts, layout['workers'], layout['threads'])
+    t_start = time.time()
+    if layout['layout'] == 'files':
+        for folder in executor.map(_cpu_separate_file, folders, repeat(model_name), repeat(shifts)):
+            logger.info(f'Audio separated in {folder}')
+    else:
+        for folder in folders:
+            _separate_file_in_chunks(executor, folder, layout['workers'])
+    logger.info(f'CPU pool separated {len(folders)} videos in {time.time() - t_start:.2f} seconds')
+    return layout
+
+
+def _separate_file_in_chunks(executor, folder, workers):
+    audio_path = os.path.join(folder, 'audio.wav')
+    vocal_output_path = os.path.join(folder, 'audio_vocals.wav')
+    instruments_output_path = os.path.join(folder, 'audio_instruments.wav')
+    if os.path.exists(vocal_output_path) and os.path.exists(instruments_output_path):
+        return
+    with get_job_store().track(folder, 'demucs'):
+        decision = analyze_separation_need(folder) if DEMUCS_SKIP_DETECTION else None
+        if decision is not None and decision['mode'] == 'skip':
+            write_passthrough(audio_path, vocal_output_path, instruments_output_path)
+            return
+        sample_rate, audio = wavfile.read(audio_path, mmap=True)
+        total = audio.shape[0]
+        # 每个进程至少一块，单块不超过 DEMUCS_CHUNK_SECONDS 以限制内存
+        step = max(int(total / workers) + 1, int(30 * sample_rate))
+        if DEMUCS_CHUNK_SECONDS > 0:
+            step = min(step, int(DEMUCS_CHUNK_SECONDS * sample_rate))
+        overlap = int(DEMUCS_OVERLAP_SECONDS * sample_rate)
+        windows = _chunk_windows(total, step, overlap)
+        output_prefix = os.path.join(folder, 'demucs_chunk')
+        futures = [None if _window_is_speech(decision, start, end, sample_rate)
+                   else executor.submit(_cpu_separate_window, audio_path, start, end, output_prefix)
+                   for start, end in windows]
+        try:
+            outputs = (_passthrough_window(audio, start, end) if future is None else _load_and_remove_window(future.result())
+                       for (start, end), future in zip(windows, futures))
+            _write_stitched(outputs, windows, step, overlap, audio.shape[1], sample_rate, vocal_output_path, instruments_output_path)
+        finally:
+            _cleanup_windows(futures, folder)
+
+
+def _cleanup_windows(futures, folder):
+    """取消未开始的分块，等待已在运行的分块结束后删除残留的 demucs_chunk_*.npy"""
+    for future in futures:
+        if future is not None and not future.cancel():
+            try:
+                future.result()
+            except Exception:
+                pass
+    for name in os.listdir(folder):
+        if name.startswith('demucs_chunk_') and name.endswith('.npy'):
+            os.remove(os.path.join(folder, name))
+
+
 def extract_audio_from_video(folder: str) -> bool:
     # 检查文件夹是否存在
     if not os.path.exists(folder):
@@ -233,8 +599,6 @@ def extract_audio_from_video(folder: str) -> bool:
     
     logger.info(f'Extracting audio from {video_path}')
     
-    # 使用 subprocess.run 代替 os.system，避免 Windows 路径问题
-    import subprocess
     cmd = [
         ffmpeg_path,
         '-loglevel', 'error',
@@ -246,7 +610,7 @@ def extract_audio_from_video(folder: str) -> bool:
         audio_path
     ]
     logger.info(f"执行命令: {' '.join(cmd)}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = run_ffmpeg(cmd, label='extract audio', folder=folder, stage='demucs')
     
     if result.returncode != 0:
         error_msg = result.stderr or "未知错误"
@@ -263,14 +627,16 @@ def extract_audio_from_video(folder: str) -> bool:
 
 def separate_all_audio_under_folder(root_folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5) -> None:
     global separator
-    for subdir, dirs, files in os.walk(root_folder):
-        # Check for any supported video format
-        has_video = any(f.startswith('download') and (f.endswith('.mp4') or f.endswith('.webm')) for f in files)
-        if not has_video:
-            continue
-        if 'audio.wav' not in files:
+    folders = pending_folders(root_folder, 'demucs')
+    for subdir in folders:
+        if not os.path.exists(os.path.join(subdir, 'audio.wav')):
             extract_audio_from_video(subdir)
-        if 'audio_vocals.wav' not in files:
+    resolved_device = str(auto_device) if device == 'auto' else device
+    if folders and resolved_device == 'cpu' and DEMUCS_CPU_WORKERS != 1:
+        folders = [f for f in folders if os.path.exists(os.path.join(f, 'audio.wav'))]
+        separate_all_audio_cpu_pool(folders, model_name, shifts)
+    else:
+        for subdir in folders:
             separate_audio(subdir, model_name, device, progress, shifts)
 
     logger.info(f'All audio separated under {root_folder}')
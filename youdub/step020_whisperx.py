@@ -1,6 +1,5 @@
 import json
 import time
-import librosa
 import numpy as np
 import whisperx
 import os
@@ -9,8 +8,16 @@ import torch
 from dotenv import load_dotenv
 
 from .utils import save_wav
+from .audio_assets import load_audio
+from .job_store import track_stage, pending_folders, get_job_store
 load_dotenv()
 
+# 多文件批量转写：把多个视频的 VAD 片段合并进同一批推理，按语言分组对齐
+WHISPERX_MULTI_FILE = os.getenv('WHISPERX_MULTI_FILE', '1') == '1'
+# 每轮合并的视频数上限（音频会整段驻留内存，16kHz 下每小时约 230MB）
+WHISPERX_POOL_FILES = int(os.getenv('WHISPERX_POOL_FILES', '8'))
+WHISPERX_SAMPLE_RATE = 16000
+
 whisper_model = None
 diarize_model = None
 
@@ -67,6 +74,11 @@ def load_diarize_model(device='auto'):
     logger.info(f'Loaded diarization model in {t_end - t_start:.2f}s')
 
 
+def _whisper_audio(wav_path):
+    """16kHz 单声道 float32（经共享音频缓存解码，复制一份可写数组交给 torch）"""
+    return np.array(load_audio(wav_path, WHISPERX_SAMPLE_RATE))
+
+
 def merge_segments(transcript, ending='!"\').:;?]}~'):
     merged_transcription = []
     buffer_segment = None
@@ -91,6 +103,7 @@ def merge_segments(transcript, ending='!"\').:;?]}~'):
 
     return merged_transcription
 
+@track_stage('whisperx')
 def transcribe_audio(folder, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True,min_speakers=None, max_speakers=None):
     if os.path.exists(os.path.join(folder, 'transcript.json')):
         logger.info(f'Transcript already exists in {folder}')
@@ -107,7 +120,7 @@ def transcribe_audio(folder, model_name: str = 'large', download_root='models/AS
     if device == 'auto':
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
     load_whisper_model(model_name, download_root, device)
-    rec_result = whisper_model.transcribe(wav_path, batch_size=batch_size)
+    rec_result = whisper_model.transcribe(_whisper_audio(wav_path), batch_size=batch_size)
     
     if rec_result['language'] == 'nn':
         logger.warning(f'No language detected in {wav_path}, trying with audio.wav')
@@ -115,7 +128,7 @@ def transcribe_audio(folder, model_name: str = 'large', download_root='models/AS
         if wav_path != os.path.join(folder, 'audio.wav'):
             wav_path = os.path.join(folder, 'audio.wav')
             if os.path.exists(wav_path):
-                rec_result = whisper_model.transcribe(wav_path, batch_size=batch_size)
+                rec_result = whisper_model.transcribe(_whisper_audio(wav_path), batch_size=batch_size)
                 if rec_result['language'] == 'nn':
                     logger.warning(f'No language detected in {wav_path} either')
                     return False
@@ -125,11 +138,15 @@ def transcribe_audio(folder, model_name: str = 'large', download_root='models/AS
     load_align_model(rec_result['language'])
     if align_model is not None:
         rec_result = whisperx.align(rec_result['segments'], align_model, align_metadata,
-                                    wav_path, device, return_char_alignments=False)
-    
+                                    _whisper_audio(wav_path), device, return_char_alignments=False)
+    save_transcript(folder, wav_path, rec_result, device, diarization, min_speakers, max_speakers)
+    return True
+
+def save_transcript(folder, wav_path, rec_result, device, diarization=True, min_speakers=None, max_speakers=None):
+    """说话人分离、合并句子并写入 transcript.json"""
     if diarization:
         load_diarize_model(device)
-        diarize_segments = diarize_model(wav_path,min_speakers=min_speakers, max_speakers=max_speakers)
+        diarize_segments = diarize_model(_whisper_audio(wav_path),min_speakers=min_speakers, max_speakers=max_speakers)
         rec_result = whisperx.assign_word_speakers(diarize_segments, rec_result)
         
     transcript = [{'start': segement['start'], 'end': segement['end'], 'text': segement['text'].strip(), 'speaker': segement.get('speaker', 'SPEAKER_00')} for segement in rec_result['segments']]
@@ -138,11 +155,11 @@ def transcribe_audio(folder, model_name: str = 'large', download_root='models/AS
         json.dump(transcript, f, indent=4, ensure_ascii=False)
     logger.info(f'Transcribed {wav_path} successfully, and saved to {os.path.join(folder, "transcript.json")}')
     generate_speaker_audio(folder, transcript)
-    return True
 
 def generate_speaker_audio(folder, transcript):
     wav_path = os.path.join(folder, 'audio_vocals.wav')
-    audio_data, samplerate = librosa.load(wav_path, sr=24000)
+    samplerate = 24000
+    audio_data = load_audio(wav_path, samplerate)
     
     # 获取每个说话者最长的一个片段作为克隆参考
     # 相比以前简单的全量拼接，选择单一长片段往往能获得更纯净的音质
@@ -175,11 +192,113 @@ def generate_speaker_audio(folder, transcript):
             save_wav(audio, speaker_file_path)
             
 
-def transcribe_all_audio_under_folder(folder, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True, min_speakers=None, max_speakers=None):
-    for root, dirs, files in os.walk(folder):
-        if 'audio_vocals.wav' in files and 'transcript.json' not in files:
-            transcribe_audio(root, model_name,
+def _vad_segments(audio, chunk_size=30):
+    """与 FasterWhisperPipeline.transcribe 相同的 VAD + 合并切块，兼容新旧版本的 whisperx"""
+    vad_model = whisper_model.vad_model
+    onset = whisper_model._vad_params['vad_onset']
+    offset = whisper_model._vad_params['vad_offset']
+    try:
+        from whisperx.vads import Vad, Pyannote
+        vad_class = type(vad_model) if isinstance(vad_model, Vad) else Pyannote
+        waveform = vad_class.preprocess_audio(audio)
+        merge_chunks = vad_class.merge_chunks
+    except ImportError:
+        from whisperx.vad import merge_chunks
+        waveform = torch.from_numpy(audio).unsqueeze(0)
+    segments = vad_model({'waveform': waveform, 'sample_rate': WHISPERX_SAMPLE_RATE})
+    return merge_chunks(segments, chunk_size, onset=onset, offset=offset)
+
+def _set_language(language):
+    from faster_whisper.tokenizer import Tokenizer
+    whisper_model.tokenizer = Tokenizer(whisper_model.model.hf_tokenizer, whisper_model.model.model.is_multilingual,
+                                        task='transcribe', language=language)
+
+def transcribe_audio_batch(folders, batch_size=32):
+    """
+    多个视频一起做 ASR 推理，返回 {folder: (wav_path, rec_result)}
+
+    每个视频单独做 VAD 和语言检测，然后按语言把所有视频的 VAD 片段拼成一条输入流，
+    短视频也能填满 batch_size；推理结果再按片段来源分回各个视频。
+    检测不到语言（nn）的视频不在结果中，由调用方逐个处理。
+    """
+    files = {}
+    for folder in folders:
+        wav_path = os.path.join(folder, 'audio_vocals.wav')
+        if not os.path.exists(wav_path):
+            wav_path = os.path.join(folder, 'audio.wav')
+            if not os.path.exists(wav_path):
+                continue
+        audio = _whisper_audio(wav_path)
+        language = whisper_model.detect_language(audio)
+        if language == 'nn':
+            continue
+        files[folder] = (wav_path, audio, language, _vad_segments(audio))
+
+    languages = sorted(set(language for _, _, language, _ in files.values()))
+    results = {}
+    preset_tokenizer = whisper_model.tokenizer
+    try:
+        for language in languages:
+            group = [(folder, audio, segments) for folder, (_, audio, lang, segments) in files.items() if lang == language]
+            inputs = [(folder, audio, segment) for folder, audio, segments in group for segment in segments]
+            logger.info(f'Transcribing {len(group)} files ({len(inputs)} segments) in language {language}')
+            t_start = time.time()
+            _set_language(language)
+            stream = ({'inputs': audio[int(segment['start'] * WHISPERX_SAMPLE_RATE):int(segment['end'] * WHISPERX_SAMPLE_RATE)]}
+                      for _, audio, segment in inputs)
+            transcribed = {folder: [] for folder, _, _ in group}
+            for (folder, _, segment), out in zip(inputs, whisper_model(stream, batch_size=batch_size, num_workers=0)):
+                text = out['text']
+                if batch_size in [0, 1, None]:
+                    text = text[0]
+                transcribed[folder].append({'text': text, 'start': round(segment['start'], 3), 'end': round(segment['end'], 3)})
+            for folder, segments in transcribed.items():
+                results[folder] = (files[folder][0], {'segments': segments, 'language': language})
+            logger.info(f'Transcribed {len(group)} files in language {language} in {time.time() - t_start:.2f}s')
+    finally:
+        whisper_model.tokenizer = preset_tokenizer
+    return results
+
+def transcribe_folders_pooled(folders, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True, min_speakers=None, max_speakers=None):
+    """多文件模式：合并推理、每种语言只加载一次对齐模型，最后分别写回各自的 transcript.json"""
+    if device == 'auto':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    load_whisper_model(model_name, download_root, device)
+    try:
+        results = transcribe_audio_batch(folders, batch_size)
+    except Exception as e:
+        logger.warning(f'Multi-file transcription failed, falling back to per-file mode: {e}')
+        results = {}
+
+    # 按语言排序，每种对齐模型只加载一次
+    for folder, (wav_path, rec_result) in sorted(results.items(), key=lambda item: item[1][1]['language']):
+        with get_job_store().track(folder, 'whisperx'):
+            load_align_model(rec_result['language'], device)
+            if align_model is not None:
+                rec_result = whisperx.align(rec_result['segments'], align_model, align_metadata,
+                                            _whisper_audio(wav_path), device, return_char_alignments=False)
+            save_transcript(folder, wav_path, rec_result, device, diarization, min_speakers, max_speakers)
+
+    for folder in folders:
+        if folder not in results:
+            transcribe_audio(folder, model_name, download_root, device, batch_size, diarization, min_speakers, max_speakers)
+
+def transcribe_folders(folders, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True, min_speakers=None, max_speakers=None):
+    """转写一组视频：多于一个且开启 WHISPERX_MULTI_FILE 时每 WHISPERX_POOL_FILES 个合并推理，否则逐个转写"""
+    # 流水线整批重试时跳过已经完成的视频
+    folders = [f for f in folders if not os.path.exists(os.path.join(f, 'transcript.json'))]
+    if WHISPERX_MULTI_FILE and len(folders) > 1:
+        for i in range(0, len(folders), WHISPERX_POOL_FILES):
+            transcribe_folders_pooled(folders[i:i + WHISPERX_POOL_FILES], model_name,
+                                      download_root, device, batch_size, diarization, min_speakers, max_speakers)
+        return
+    for root in folders:
+        transcribe_audio(root, model_name,
                              download_root, device, batch_size, diarization, min_speakers, max_speakers)
+
+def transcribe_all_audio_under_folder(folder, model_name: str = 'large', download_root='models/ASR/whisper', device='auto', batch_size=32, diarization=True, min_speakers=None, max_speakers=None):
+    transcribe_folders(pending_folders(folder, 'whisperx'), model_name, download_root, device,
+                       batch_size, diarization, min_speakers, max_speakers)
     return f'Transcribed all audio under {folder}'
 
 if __name__ == '__main__':
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import json
+import asyncio
 import os
 import re
-from openai import OpenAI
+import threading
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 import time
 from loguru import logger
 from .terminology import TerminologyManager
+from .translation_engine import TranslationEngine
+from .translation_cache import get_translation_cache, make_key
+from .job_store import track_stage, pending_folders
 
 load_dotenv()
 
@@ -36,6 +41,14 @@ else:
     model_name = os.getenv('MODEL_NAME', 'gpt-3.5-turbo')
     print(f'using model {model_name}')
 
+# 提示词版本：修改翻译/总结提示词后请递增，使旧的翻译缓存失效
+TRANSLATION_PROMPT_VERSION = 'v1'
+
+# 批量翻译：每次请求翻译的句子数，设为 1 则回退到逐句翻译
+TRANSLATION_BATCH_SIZE = int(os.getenv('TRANSLATION_BATCH_SIZE', '10'))
+# 单句译文校验失败后的重试间隔上限（秒，从 0.5s 开始指数增长）
+TRANSLATION_RETRY_MAX_DELAY = 8
+
 print(f'Using translation backend: {TRANSLATION_BACKEND}')
 if TRANSLATION_BACKEND == 'ollama':
     print(f'Using Ollama model: {OLLAMA_MODEL}')
@@ -92,15 +105,58 @@ def get_translation_client():
             api_key=os.getenv('OPENAI_API_KEY')
         )
 
+def get_async_translation_client():
+    """获取异步客户端（配置与 get_translation_client 相同）"""
+    if TRANSLATION_BACKEND == 'ollama':
+        return AsyncOpenAI(base_url=f'{OLLAMA_BASE_URL}/v1', api_key='ollama')
+    elif os.getenv('GROQ_API_KEY'):
+        return AsyncOpenAI(
+            base_url='https://api.groq.com/openai/v1',
+            api_key=os.getenv('GROQ_API_KEY')
+        )
+    else:
+        return AsyncOpenAI(
+            base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1'),
+            api_key=os.getenv('OPENAI_API_KEY')
+        )
+
+_translation_engine = None
+_translation_engine_lock = threading.Lock()
+
+def get_translation_engine():
+    """获取进程级共享的翻译引擎（所有视频共用同一个限流器）"""
+    global _translation_engine
+    with _translation_engine_lock:
+        if _translation_engine is None:
+            if TRANSLATION_BACKEND == 'ollama':
+                backend, current_model = 'ollama', OLLAMA_MODEL
+            elif os.getenv('GROQ_API_KEY'):
+                backend, current_model = 'groq', model_name
+            else:
+                backend, current_model = 'openai', model_name
+            _env_int = lambda key: int(os.getenv(key)) if os.getenv(key) else None
+            _translation_engine = TranslationEngine(
+                backend, current_model, get_async_translation_client, extra_body=extra_body,
+                rpm=_env_int('TRANSLATION_RPM'), tpm=_env_int('TRANSLATION_TPM'),
+                concurrency=_env_int('TRANSLATION_CONCURRENCY'))
+    return _translation_engine
+
 # 兼容旧函数名
 def get_openai_client():
     """获取 OpenAI 客户端，支持 Groq/Ollama 配置"""
     return get_translation_client()
 
 def summarize(info, transcript, target_language='简体中文'):
-    client = get_openai_client()
+    engine = get_translation_engine()
     transcript = ' '.join(line['text'] for line in transcript)
     transcript = ensure_transcript_length(transcript, max_length=2000)
+    cache = get_translation_cache()
+    cache_source = json.dumps([info['title'], info['uploader'], info['tags'], transcript], ensure_ascii=False)
+    cache_key = make_key('summary', cache_source, target_language, engine.model, TRANSLATION_PROMPT_VERSION, get_terminology_manager().get_version())
+    result = cache.get(cache_key)
+    if result is not None:
+        logger.info(f'总结缓存命中: {result["title"]}')
+        return result
     info_message = f'Title: "{info["title"]}" Author: "{info["uploader"]}". ' 
     # info_message = ''
     
@@ -113,21 +169,14 @@ def summarize(info, transcript, target_language='简体中文'):
     ]
     retry_message=''
     success = False
-    # 选择正确的模型
-    current_model = OLLAMA_MODEL if TRANSLATION_BACKEND == 'ollama' else model_name
     for retry in range(5):
         try:
             messages = [
                 {'role': 'system', 'content': 'You are a expert in the field of this video. Please summarize the video in JSON format. ```json {"title": "the title of the video", "summary": "the summary of the video"} ```'},
                 {'role': 'user', 'content': full_description+retry_message},
             ]
-            response = client.chat.completions.create(
-                model=current_model,
-                messages=messages,
-                timeout=240,
-                extra_body=extra_body
-            )
-            summary = response.choices[0].message.content.replace('\n', '')
+            # 429/5xx 由翻译引擎自动退避重试，这里只处理格式不合格的回复
+            summary = engine.complete(messages).replace('\n', '')
             if '视频标题' in summary:
                 raise Exception("包含“视频标题”")
             logger.info(summary)
@@ -144,7 +193,6 @@ def summarize(info, transcript, target_language='简体中文'):
         except Exception as e:
             retry_message += '\nSummarize the video in JSON format:\n```json\n{"title": "", "summary": ""}\n```'
             logger.warning(f'总结失败\n{e}')
-            time.sleep(1)
     if not success:
         raise Exception(f'总结失败')
         
@@ -159,13 +207,8 @@ def summarize(info, transcript, target_language='简体中文'):
     ]
     while True:
         try:
-            response = client.chat.completions.create(
-                model=current_model,
-                messages=messages,
-                timeout=240,
-                extra_body=extra_body
-            )
-            summary = response.choices[0].message.content.replace('\n', '')
+            # 429/5xx 由翻译引擎自动退避重试，这里只处理格式不合格的回复
+            summary = engine.complete(messages).replace('\n', '')
             logger.info(summary)
             summary = re.findall(r'\{.*?\}', summary)[0]
             summary = json.loads(summary)
@@ -181,10 +224,10 @@ def summarize(info, transcript, target_language='简体中文'):
                 'tags': summary['tags'],
                 'language': target_language
             }
+            cache.put(cache_key, 'summary', cache_source, result)
             return result
         except Exception as e:
             logger.warning(f'总结翻译失败\n{e}')
-            time.sleep(1)
 
 
 def translation_postprocess(result):
@@ -325,6 +368,9 @@ def split_sentences(translation):
         text = item['text']
         speaker = item['speaker']
         translation_text = item['translation']
+        if not translation_text:
+            logger.warning(f'译文为空，跳过：{text}')
+            continue
         sentences = split_text_into_sentences(translation_text)
         duration_per_char = (item['end'] - item['start']
                              ) / len(translation_text)
@@ -346,12 +392,153 @@ def split_sentences(translation):
             sentence_start += len(sentence)
     return output_data
     
-def _translate(summary, transcript, target_language='简体中文'):
-    client = get_translation_client()
-    info = f'This is a video called "{summary["title"]}". {summary["summary"]}.'
-    full_translation = []
-    # 选择正确的模型
-    current_model = OLLAMA_MODEL if TRANSLATION_BACKEND == 'ollama' else model_name
+def _context_history(texts, results, index, window=15):
+    """
+    构造第 index 句之前的上下文：已完成的邻句作为对话历史，
+    尚未完成的邻句只提供原文
+    """
+    history = []
+    pending = []
+    for j in range(max(0, index - window), index):
+        if results[j] is None:
+            pending.append(texts[j])
+        else:
+            history.append({'role': 'user', 'content': f'Translate:"{texts[j]}"'})
+            history.append({'role': 'assistant', 'content': f'翻译：“{results[j]}”'})
+    context = ''
+    if pending:
+        context = '上文原文（仅供理解语境，不要翻译）：\n' + '\n'.join(pending) + '\n\n'
+    return history, context
+
+
+class InvalidTranslation(Exception):
+    """译文未通过 valid_translation 校验"""
+
+
+async def _translate_line(engine, fixed_message, history, context, text, terminology):
+    """
+    逐句翻译（单句模式，也用于批量模式中校验失败的句子）
+
+    返回 (success, translation)。全部重试都未通过校验时 success 为 False，
+    translation 为最后一次模型的原始输出（而不是校验的错误提示；输出为空时用原文），调用方不应缓存。
+    请求本身出错（400、内容审核、鉴权等）时直接抛出，由阶段重试处理，已完成的句子已写入缓存。
+    """
+    retry_message = 'Only translate the quoted sentence and give me the final translation.'
+    fallback = ''
+    for retry in range(30):
+        messages = fixed_message + \
+            history[-30:] + [{'role': 'user',
+                              'content': f'{context}使用地道的中文Translate:"{text}"'}]
+        
+        try:
+            translation = (await engine.chat(messages)).replace('\n', '')
+            
+            # 应用术语一致性替换
+            translation_before = translation
+            translation = terminology.apply_to_translation(translation)
+            if translation != translation_before:
+                logger.debug(f"术语替换: '{translation_before}' -> '{translation}'")
+            
+            logger.info(f'原文：{text}')
+            logger.info(f'译文：{translation}')
+            fallback = translation
+            success, translation = valid_translation(text, translation)
+            if not success:
+                retry_message += translation
+                raise InvalidTranslation(f'Invalid translation: {translation}')
+            return True, translation
+        except InvalidTranslation as e:
+            logger.error(e)
+            # 校验失败时短暂退避再重试
+            await asyncio.sleep(min(TRANSLATION_RETRY_MAX_DELAY, 0.5 * 2 ** retry))
+        except Exception as e:
+            # engine.chat 已对限流和网络错误做过退避重试，这里的错误重试也不会恢复
+            logger.error(f'翻译请求失败，不再重试: {e}')
+            raise
+    logger.warning(f'翻译未通过校验，使用模型原始输出且不写入缓存：{text}')
+    return False, fallback or text
+
+
+def parse_batch_translation(content, size):
+    """从模型输出中解析 JSON 数组，长度必须与请求的句子数一致"""
+    content = content.strip()
+    if content.startswith('```'):
+        content = re.sub(r'^```(?:json)?', '', content).rstrip('`').strip()
+    match = re.search(r'\[.*\]', content, re.DOTALL)
+    if match is None:
+        raise ValueError('No JSON array in batch translation')
+    result = json.loads(match.group(0))
+    if not isinstance(result, list) or len(result) != size:
+        raise ValueError(f'Expected {size} translations, got {len(result) if isinstance(result, list) else type(result).__name__}')
+    return [str(item).replace('\n', '') for item in result]
+
+
+async def _translate_batch(engine, fixed_message, history, context, texts, terminology, max_retries=3):
+    """
+    一次请求翻译一个窗口内的多句字幕，返回逐句的 (success, translation)；
+    校验失败的句子 success 为 False，由调用方用单句模式重试
+    """
+    numbered = '\n'.join(f'{i + 1}. {text}' for i, text in enumerate(texts))
+    prompt = (f'{context}使用地道的中文翻译以下 {len(texts)} 句字幕，每句单独翻译，不要合并或拆分。\n'
+              f'只输出一个 JSON 字符串数组，长度为 {len(texts)}，第 i 个元素是第 i 句的译文：\n{numbered}')
+    messages = fixed_message + history[-30:] + [{'role': 'user', 'content': prompt}]
+    for retry in range(max_retries):
+        try:
+            translations = parse_batch_translation(await engine.chat(messages), len(texts))
+            break
+        except Exception as e:
+            logger.warning(f'批量翻译失败 (retry {retry + 1}/{max_retries}): {e}')
+    else:
+        return [(False, None)] * len(texts)
+
+    results = []
+    for text, translation in zip(texts, translations):
+        translation = terminology.apply_to_translation(translation)
+        success, translation = valid_translation(text, translation)
+        logger.info(f'原文：{text}')
+        logger.info(f'译文：{translation}')
+        results.append((success, translation))
+    return results
+
+
+async def _translate_async(engine, fixed_message, texts, terminology, batch_size, results=None, on_result=None):
+    """
+    按窗口并发翻译；窗口开始时才读取上下文，以便用上已完成的邻句。
+    results 中已有的译文（如缓存命中）会被跳过，on_result(index, success, translation) 在每句完成时回调
+    """
+    batch_size = max(1, batch_size)
+    results = list(results) if results is not None else [None] * len(texts)
+    pending = [i for i, translation in enumerate(results) if translation is None]
+    semaphore = asyncio.Semaphore(engine.concurrency)
+    finished = len(texts) - len(pending)
+
+    async def run_window(indices):
+        nonlocal finished
+        window = [texts[i] for i in indices]
+        async with semaphore:
+            if len(window) > 1:
+                history, context = _context_history(texts, results, indices[0])
+                translations = await _translate_batch(engine, fixed_message, history, context, window, terminology)
+            else:
+                translations = [(False, None)]
+            for index, text, (success, translation) in zip(indices, window, translations):
+                if not success:
+                    # 只对校验失败的句子单独重试
+                    history, context = _context_history(texts, results, index)
+                    success, translation = await _translate_line(engine, fixed_message, history, context, text, terminology)
+                results[index] = translation
+                if on_result is not None:
+                    on_result(index, success, translation)
+        finished += len(window)
+        logger.info(f"翻译进度: {finished}/{len(texts)}")
+
+    await asyncio.gather(*(run_window(pending[k:k + batch_size]) for k in range(0, len(pending), batch_size)))
+    return results
+
+
+def _translate(summary, transcript, target_language='简体中文', batch_size=TRANSLATION_BATCH_SIZE):
+    engine = get_translation_engine()
+    cache = get_translation_cache()
     
     # 初始化术语管理器
     terminology = get_terminology_manager()
@@ -361,56 +548,26 @@ def _translate(summary, transcript, target_language='简体中文'):
         {'role': 'system', 'content': f'你是一位天才翻译家和资深配音导演。正在处理视频《{summary["title"]}》。摘要：{summary["summary"]}\n\n你的任务是将以下字幕片段翻译成地道的{target_language}，用于后期配音。\n\n**金律：**\n1. **绝对不要“翻译腔”**：不要直译，要像中国人在说话。使用口语化表达。\n2. **信达雅**：保持原意，但要转换成目标语言中对应的惯用语、成语或流行梗。\n3. **配音适配**：控制语速和字数，确保配音时自然顺滑。\n4. **术语统一**：专业名词要准确，不要画蛇添足（如：agent -> 智能体）。\n5. **简洁有力**：只返回翻译后的文本，严禁带任何多余说明或转义符号。'},
     ]
     
-    history = []
-    for i, line in enumerate(transcript):
-        text = line['text']
-        # history = ''.join(full_translation[:-10])
-        
-        retry_message = 'Only translate the quoted sentence and give me the final translation.'
-        for retry in range(30):
-            messages = fixed_message + \
-                history[-30:] + [{'role': 'user',
-                                  'content': f'使用地道的中文Translate:"{text}"'}]
-            
-            try:
-                response = client.chat.completions.create(
-                    model=current_model,
-                    messages=messages,
-                    timeout=240,
-                    extra_body=extra_body
-                )
-                translation = response.choices[0].message.content.replace('\n', '')
-                
-                # 应用术语一致性替换
-                translation_before = translation
-                translation = terminology.apply_to_translation(translation)
-                if translation != translation_before:
-                    logger.debug(f"术语替换: '{translation_before}' -> '{translation}'")
-                
-                logger.info(f'原文：{text}')
-                logger.info(f'译文：{translation}')
-                success, translation = valid_translation(text, translation)
-                if not success:
-                    retry_message += translation
-                    raise Exception('Invalid translation')
-                break
-            except Exception as e:
-                logger.error(e)
-                if e == 'Internal Server Error':
-                    client = get_openai_client()
-                # logger.warning('翻译失败')
-                time.sleep(1)
-        full_translation.append(translation)
-        
-        # 每10句显示一次进度
-        if (i + 1) % 10 == 0:
-            logger.info(f"翻译进度: {i + 1}/{len(transcript)}")
-        history.append({'role': 'user', 'content': f'Translate:"{text}"'})
-        history.append({'role': 'assistant', 'content': f'翻译：“{translation}”'})
-        time.sleep(0.1)
-
-    return full_translation
-
+    texts = [line['text'] for line in transcript]
+    keys = [make_key('line', text, target_language, engine.model, TRANSLATION_PROMPT_VERSION, terminology.get_version()) for text in texts]
+    results = [cache.get(key) for key in keys]
+    cached = sum(translation is not None for translation in results)
+    if cached:
+        logger.info(f'翻译缓存命中 {cached}/{len(texts)} 句')
+
+    def on_result(index, success, translation):
+        # 未通过校验的译文不缓存，下次运行会重新翻译
+        if success and translation:
+            cache.put(keys[index], 'line', texts[index], translation)
+
+    if batch_size > 1:
+        logger.info(f'批量翻译模式：每次请求 {batch_size} 句')
+    results = asyncio.run(_translate_async(engine, fixed_message, texts, terminology, batch_size, results, on_result))
+    stats = cache.stats()
+    logger.info(f"翻译缓存: 命中 {stats['hits']}, 未命中 {stats['misses']}, 命中率 {stats['hit_rate']:.1%}, 共 {stats['entries']} 条")
+    return results
+
+@track_stage('translation')
 def translate(folder, target_language='简体中文'):
     if os.path.exists(os.path.join(folder, 'translation.json')):
         logger.info(f'Translation already exists in {folder}')
@@ -449,9 +606,8 @@ def translate(folder, target_language='简体中文'):
     return True
 
 def translate_all_transcript_under_folder(folder, target_language):
-    for root, dirs, files in os.walk(folder):
-        if 'transcript.json' in files and 'translation.json' not in files:
-            translate(root, target_language)
+    for root in pending_folders(folder, 'translation'):
+        translate(root, target_language)
     return f'Translated all videos under {folder}'
 
 if __name__ == '__main__':
@@ -1,14 +1,17 @@
 import json
 import os
 import re
+import wave
 import librosa
+import soundfile as sf
 
 from loguru import logger
 import numpy as np
 
-from .utils import save_wav, save_wav_norm
+from .audio_assets import load_audio, clear_cache, CACHE_DIR_NAME
 from .cn_tx import TextNorm
-from audiostretchy.stretch import stretch_audio
+from .job_store import track_stage, pending_folders
+from .audio_stretch import stretch, iter_stretch_files
 
 # Lazy imports to avoid dependency issues
 bytedance_tts = None
@@ -28,6 +31,17 @@ def _get_xtts_tts():
         xtts_tts = xtts_tts_func
     return xtts_tts
 
+def _get_bytedance_client():
+    from .step041_tts_bytedance import get_client
+    return get_client()
+
+def _get_xtts_module():
+    from . import step042_tts_xtts
+    return step042_tts_xtts
+
+# 混音时每块的采样点数（约 1MB float32）
+MIX_CHUNK_SAMPLES = 1 << 18
+
 normalizer = TextNorm()
 def preprocess_text(text):
     # 清理各种中英文引号
@@ -52,17 +66,123 @@ def preprocess_text(text):
     return text
     
     
+def plan_audio_length(current_length, desired_length, min_speed_factor = 0.6, max_speed_factor = 1.1):
+    """返回 (speed_factor, 调整后的时长)，只依赖时长，不需要先做变速"""
+    if current_length <= 0:
+        return 1.0, 0.0
+    speed_factor = max(
+        min(desired_length / current_length, max_speed_factor), min_speed_factor)
+    return speed_factor, current_length * speed_factor
+
 def adjust_audio_length(wav_path, desired_length, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
     wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
     current_length = len(wav)/sample_rate
-    speed_factor = max(
-        min(desired_length / current_length, max_speed_factor), min_speed_factor)
-    desired_length = current_length * speed_factor
-    target_path = wav_path.replace('.wav', f'_adjusted.wav')
-    stretch_audio(wav_path, target_path, ratio=speed_factor, sample_rate=sample_rate)
-    wav, sample_rate = librosa.load(target_path, sr=sample_rate)
-    return wav[:int(desired_length*sample_rate)], desired_length
+    speed_factor, desired_length = plan_audio_length(current_length, desired_length, min_speed_factor, max_speed_factor)
+    return stretch(wav, speed_factor, sample_rate, length=int(desired_length*sample_rate)), desired_length
+
+def build_timeline(transcript, output_folder, sample_rate=24000):
+    """
+    按字幕时间把每句配音排到时间轴上（以采样点为单位），返回 (segments, total_samples)
+
+    segments 为按顺序产出 (offset, wav) 的迭代器，wav 为 float32；同时把实际的 start / end 写回 transcript。
+    变速后的时长只由原始时长决定，所以先排好所有位置，再把整段视频的变速交给进程池批量处理。
+    只记录位置不做拼接，由调用方逐句写入预分配的时间轴，耗时与总采样点数成线性关系。
+    """
+    offsets = []
+    jobs = []
+    cursor = 0
+    for i, line in enumerate(transcript):
+        output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
+        
+        start = line['start']
+        end = line['end']
+        length = end - start
+        last_end = cursor / sample_rate
+        
+        if start > last_end:
+            cursor += int((start - last_end) * sample_rate)
+        
+        start = cursor / sample_rate
+        line['start'] = start
+        
+        if i < len(transcript) - 1:
+            next_line = transcript[i+1]
+            next_end = next_line['end']
+            end = min(start + length, next_end)
+            
+        speed_factor, length = plan_audio_length(sf.info(output_path).duration, end - start)
+        samples = int(length * sample_rate)
+        offsets.append(cursor)
+        jobs.append((output_path, speed_factor, samples))
+        cursor += samples
+        line['end'] = start + length
+    return zip(offsets, iter_stretch_files(jobs, sample_rate)), cursor
+
+def _chunks(total, size=MIX_CHUNK_SAMPLES):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
 
+def _peak(wav):
+    peak = 0.0
+    for start, end in _chunks(len(wav)):
+        peak = max(peak, float(np.max(np.abs(wav[start:end]))))
+    return peak
+
+def write_timeline(segments, total_samples, path):
+    """把 (offset, wav) 逐句写入磁盘上的 float32 时间轴（内存映射），返回 (timeline, 峰值)"""
+    timeline = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(total_samples,))
+    peak = 0.0
+    for offset, wav in segments:
+        timeline[offset:offset + len(wav)] = wav
+        if len(wav):
+            peak = max(peak, float(np.max(np.abs(wav))))
+    timeline.flush()
+    return timeline, peak
+
+def _open_wav_writer(path, sample_rate):
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(sample_rate)
+    return writer
+
+def _mix_chunk(tts_wav, scale, instruments_wav, start, end):
+    chunk = np.zeros(end - start, dtype=np.float32)
+    tts_end = min(end, len(tts_wav))
+    if tts_end > start:
+        chunk[:tts_end - start] = tts_wav[start:tts_end] * scale
+    instruments_end = min(end, len(instruments_wav))
+    if instruments_end > start:
+        chunk[:instruments_end - start] += instruments_wav[start:instruments_end]
+    return chunk
+
+def stream_mix(tts_wav, scale, instruments_wav, tts_path, combined_path, sample_rate=24000):
+    """
+    分块混音，内存占用只与块大小有关，与视频时长无关
+    - audio_tts.wav: 配音轨乘以 scale（与 save_wav 相同，不再归一化）
+    - audio_combined.wav: 配音 + 伴奏，按全局峰值归一化（与 save_wav_norm 相同）
+    """
+    total = max(len(tts_wav), len(instruments_wav))
+    peak = 0.0
+    for start, end in _chunks(total):
+        peak = max(peak, float(np.max(np.abs(_mix_chunk(tts_wav, scale, instruments_wav, start, end)))))
+    norm = 32767 / max(0.01, peak)
+
+    writer = _open_wav_writer(tts_path, sample_rate)
+    try:
+        for start, end in _chunks(len(tts_wav)):
+            writer.writeframes((tts_wav[start:end] * (scale * 32767)).astype(np.int16).tobytes())
+    finally:
+        writer.close()
+    writer = _open_wav_writer(combined_path, sample_rate)
+    try:
+        for start, end in _chunks(total):
+            chunk = _mix_chunk(tts_wav, scale, instruments_wav, start, end)
+            writer.writeframes((chunk * norm).astype(np.int16).tobytes())
+    finally:
+        writer.close()
+
+@track_stage('tts')
 def generate_wavs(folder, force_bytedance=False):
     transcript_path = os.path.join(folder, 'translation.json')
     output_folder = os.path.join(folder, 'wavs')
@@ -96,65 +216,47 @@ def generate_wavs(folder, force_bytedance=False):
             xtts_func(text, output_path, speaker_wav)
         return idx, output_path
 
-    logger.info(f"Starting parallel TTS generation with ThreadPoolExecutor...")
-    # 由于 XTTS 需要 GPU 锁，实际推理是串行的。
-    # 使用少量线程做文件读取/预处理的重叠，避免过多线程抢锁带来的开销。
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        list(executor.map(tts_worker, enumerate(transcript)))
+    if not force_bytedance and _get_xtts_module().tts_pool_enabled():
+        # CPU 节点：多进程各持有一份 XTTS 模型并行合成
+        items = [(preprocess_text(line['translation']),
+                  os.path.join(output_folder, f'{str(idx).zfill(4)}.wav'),
+                  os.path.join(folder, 'SPEAKER', f'{line["speaker"]}.wav'))
+                 for idx, line in enumerate(transcript)]
+        _get_xtts_module().tts_batch(items)
+    else:
+        logger.info(f"Starting parallel TTS generation with ThreadPoolExecutor...")
+        # 由于 XTTS 需要 GPU 锁，实际推理是串行的。
+        # 使用少量线程做文件读取/预处理的重叠，避免过多线程抢锁带来的开销。
+        # 火山 TTS 是网络请求，按客户端的并发上限开线程（限流在客户端内部完成）
+        max_workers = _get_bytedance_client().concurrency if force_bytedance else 2
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(tts_worker, enumerate(transcript)))
 
-    # 2. 顺序调整音频长度并拼接
-    full_wav = np.zeros((0, ))
-    for i, line in enumerate(transcript):
-        output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
-        
-        start = line['start']
-        end = line['end']
-        length = end - start
-        last_end = len(full_wav) / 24000
-        
-        if start > last_end:
-            full_wav = np.concatenate((full_wav, np.zeros((int((start - last_end) * 24000), ))))
-        
-        start = len(full_wav) / 24000
-        line['start'] = start
-        
-        if i < len(transcript) - 1:
-            next_line = transcript[i+1]
-            next_end = next_line['end']
-            end = min(start + length, next_end)
-            
-        wav, length = adjust_audio_length(output_path, end - start)
-        full_wav = np.concatenate((full_wav, wav))
-        line['end'] = start + length
-        
-    vocal_wav, sr = librosa.load(os.path.join(folder, 'audio_vocals.wav'), sr=24000)
-    full_wav = full_wav / np.max(np.abs(full_wav)) * np.max(np.abs(vocal_wav))
-    save_wav(full_wav, os.path.join(folder, 'audio_tts.wav'))
+    # 2. 顺序调整音频长度，计算每句在时间轴上的位置
+    segments, tts_samples = build_timeline(transcript, output_folder)
     with open(transcript_path, 'w', encoding='utf-8') as f:
         json.dump(transcript, f, indent=2, ensure_ascii=False)
-    
-    instruments_wav, sr = librosa.load(os.path.join(folder, 'audio_instruments.wav'), sr=24000)
-    len_full_wav = len(full_wav)
-    len_instruments_wav = len(instruments_wav)
-    
-    if len_full_wav > len_instruments_wav:
-        # 如果 full_wav 更长，将 instruments_wav 延伸到相同长度
-        instruments_wav = np.pad(
-            instruments_wav, (0, len_full_wav - len_instruments_wav), mode='constant')
-    elif len_instruments_wav > len_full_wav:
-        # 如果 instruments_wav 更长，将 full_wav 延伸到相同长度
-        full_wav = np.pad(
-            full_wav, (0, len_instruments_wav - len_full_wav), mode='constant')
-    combined_wav = full_wav + instruments_wav
-    # combined_wav /= np.max(np.abs(combined_wav))
-    save_wav_norm(combined_wav, os.path.join(folder, 'audio_combined.wav'))
+
+    # 3. 逐句写入磁盘上的时间轴，再分块两遍扫描混音：第一遍统计峰值，第二遍写出归一化结果
+    cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    timeline_path = os.path.join(cache_dir, 'tts_timeline.npy')
+    timeline, tts_peak = write_timeline(segments, tts_samples, timeline_path)
+    vocal_peak = _peak(load_audio(os.path.join(folder, 'audio_vocals.wav'), 24000))
+    instruments_wav = load_audio(os.path.join(folder, 'audio_instruments.wav'), 24000)
+    scale = vocal_peak / tts_peak if tts_peak > 0 else 1.0
+    stream_mix(timeline, scale, instruments_wav,
+               os.path.join(folder, 'audio_tts.wav'), os.path.join(folder, 'audio_combined.wav'))
+    del timeline, instruments_wav
+    os.remove(timeline_path)
+    # 之后的步骤不再读取解码缓存，合成完成即删除，避免每个视频目录常驻约 1GB/小时的 .npy
+    clear_cache(folder)
     logger.info(f'Generated {os.path.join(folder, "audio_combined.wav")}')
         
 
 def generate_all_wavs_under_folder(root_folder, force_bytedance=False):
-    for root, dirs, files in os.walk(root_folder):
-        if 'translation.json' in files and 'audio_combined.wav' not in files:
-            generate_wavs(root, force_bytedance)
+    for root in pending_folders(root_folder, 'tts'):
+        generate_wavs(root, force_bytedance)
     return f'Generated all wavs under {root_folder}'
 
 if __name__ == '__main__':
@@ -5,16 +5,21 @@ requires Python 3.6 or later
 pip install requests
 '''
 import base64
+import io
 import json
 import os
+import random
+import threading
 import time
 import uuid
-import librosa
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import requests
+from scipy.io import wavfile
 from loguru import logger
 from dotenv import load_dotenv
-from scipy.spatial.distance import cosine
+from .tts_cache import get_tts_cache, make_key
+from .translation_engine import TokenBucket
 
 # DON'T import pyannote at module level - it will crash due to torch version conflicts
 # Import it lazily inside functions only when needed
@@ -25,36 +30,180 @@ appid = os.getenv('BYTEDANCE_APPID')
 access_token = os.getenv('BYTEDANCE_ACCESS_TOKEN')
 
 host = "openspeech.bytedance.com"
-api_url = f"https://{host}/api/v1/tts"
-
-header = {"Authorization": f"Bearer;{access_token}"}
-
-request_json = {
-    "app": {
-        "appid": appid,
-        "token": "access_token",
-        "cluster": 'volcano_tts'
-    },
-    "user": {
-        "uid": "https://github.com/skyconnfig/YouDub-webui"
-    },
-    "audio": {
-        "voice_type": 'BV001_streaming',
-        "encoding": "wav",
-        "speed_ratio": 1.0,
-        "volume_ratio": 1.0,
-        "pitch_ratio": 1.0,
-    },
-    "request": {
-        "reqid": str(uuid.uuid4()),
-        "text": "Hello World!",
-        "text_type": "plain",
-        "operation": "query",
-        "with_frontend": 1,
-        "frontend_type": "unitTson"
+api_url = os.getenv('BYTEDANCE_TTS_URL', f"https://{host}/api/v1/tts")
+cluster = 'volcano_tts'
+# 并发请求数与每分钟请求上限（0 表示不限制），遇到限流时自动退避并临时降低并发
+BYTEDANCE_TTS_CONCURRENCY = int(os.getenv('BYTEDANCE_TTS_CONCURRENCY', '4'))
+BYTEDANCE_TTS_RPM = int(os.getenv('BYTEDANCE_TTS_RPM', '0'))
+# 接口返回码：3000 成功，3003 超出并发/QPS 限制，3005 服务繁忙
+SUCCESS_CODE = 3000
+RETRYABLE_CODES = {3003, 3005}
 
+
+def build_request(text, voice_type, reqid=None):
+    """每句生成一份独立的请求体，多线程并发时互不影响"""
+    return {
+        "app": {
+            "appid": appid,
+            "token": "access_token",
+            "cluster": cluster
+        },
+        "user": {
+            "uid": "https://github.com/skyconnfig/YouDub-webui"
+        },
+        "audio": {
+            "voice_type": voice_type,
+            "encoding": "wav",
+            "speed_ratio": 1.0,
+            "volume_ratio": 1.0,
+            "pitch_ratio": 1.0,
+        },
+        "request": {
+            "reqid": reqid or str(uuid.uuid4()),
+            "text": text,
+            "text_type": "plain",
+            "operation": "query",
+            "with_frontend": 1,
+            "frontend_type": "unitTson"
+        }
     }
-}
+
+
+class BytedanceTTSError(RuntimeError):
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """线程版的并发上限 + RPM 令牌桶；被限流时暂停并把并发减半，连续成功后逐步恢复"""
+
+    def __init__(self, concurrency=4, rpm=0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.max_concurrency = max(1, int(concurrency))
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.cooldown_until = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self.cooldown_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.concurrency:
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+        while self.requests is not None:
+            wait = self.requests.try_take(1)
+            if wait == 0:
+                break
+            time.sleep(wait)
+
+    def release(self, success=True):
+        with self._cond:
+            self.in_flight -= 1
+            if success:
+                self._successes += 1
+                if self._successes >= self.concurrency * 4 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    def throttle(self, delay):
+        with self._cond:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            self._cond.notify_all()
+
+
+class BytedanceTTSClient:
+    """
+    火山引擎 TTS 客户端
+    - requests.Session 连接池复用 TLS 连接
+    - 每句独立的请求体，线程安全
+    - 返回的 base64 音频直接解码为数组，不再写文件后重新读取校验
+    api_url 可指向本地 mock 服务（见 tools/bench_bytedance_tts.py）
+    """
+
+    def __init__(self, url=None, access_token=None, concurrency=None, rpm=None, timeout=60, max_retries=3):
+        self.url = url or api_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        concurrency = concurrency or BYTEDANCE_TTS_CONCURRENCY
+        self.limiter = AdaptiveLimiter(concurrency, BYTEDANCE_TTS_RPM if rpm is None else rpm)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"Authorization": f"Bearer;{access_token or globals()['access_token']}"})
+
+    @property
+    def concurrency(self):
+        return self.limiter.max_concurrency
+
+    def _post(self, payload):
+        try:
+            resp = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise BytedanceTTSError(f'Bytedance TTS request failed: {e}', retryable=True)
+        retry_after = resp.headers.get('Retry-After')
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise BytedanceTTSError(f'Bytedance TTS HTTP {resp.status_code}', retryable=True,
+                                    retry_after=float(retry_after) if retry_after else None)
+        try:
+            resp_json = resp.json()
+        except ValueError:
+            raise BytedanceTTSError(f'Bytedance TTS returned invalid JSON (HTTP {resp.status_code})')
+        code = resp_json.get('code', SUCCESS_CODE)
+        if "data" not in resp_json or code != SUCCESS_CODE:
+            raise BytedanceTTSError(f'Bytedance TTS API returned no data: {resp_json}', retryable=code in RETRYABLE_CODES)
+        return base64.b64decode(resp_json["data"])
+
+    def synthesize_bytes(self, text, voice_type):
+        """返回 wav 文件内容；仅对限流、5xx 和网络错误退避重试"""
+        for attempt in range(self.max_retries):
+            self.limiter.acquire()
+            success = False
+            try:
+                audio = self._post(build_request(text, voice_type))
+                success = True
+                return audio
+            except BytedanceTTSError as e:
+                if not e.retryable or attempt == self.max_retries - 1:
+                    raise
+                delay = e.retry_after or min(30.0, 2 ** attempt) + random.uniform(0, 0.5)
+                logger.warning(f'火山TTS 请求受限或出错，{delay:.1f}s 后重试 (retry {attempt + 1}/{self.max_retries}): {e}')
+                self.limiter.throttle(delay)
+            finally:
+                self.limiter.release(success)
+
+    def synthesize(self, text, voice_type):
+        """返回 (float32 数组, 采样率)"""
+        return decode_wav(self.synthesize_bytes(text, voice_type))
+
+
+def decode_wav(data):
+    sample_rate, wav = wavfile.read(io.BytesIO(data))
+    if wav.dtype == np.int16:
+        wav = wav.astype(np.float32) / 32768.0
+    return wav.astype(np.float32, copy=False), sample_rate
+
+
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    """获取共享的 TTS 客户端（延迟初始化）"""
+    global client
+    with client_lock:
+        if client is None:
+            client = BytedanceTTSClient()
+    return client
 
 embedding_model = None
 embedding_inference = None
@@ -85,38 +234,97 @@ def generate_embedding(wav_path):
     embedding = embedding_inference(wav_path)
     return embedding
 
+VOICE_TYPE_DIR = 'voice_type'
+VOICE_TYPES = ['BV001_streaming', 'BV002_streaming', 'BV005_streaming', 'BV007_streaming', 'BV033_streaming', 'BV034_streaming', 'BV056_streaming', 'BV102_streaming', 'BV113_streaming', 'BV115_streaming', 'BV119_streaming', 'BV700_streaming', 'BV701_streaming']
+# 额外的候选音色（逗号分隔），会与默认音色一起建立参考向量
+VOICE_TYPES += [v.strip() for v in os.getenv('BYTEDANCE_VOICE_TYPES', '').split(',') if v.strip() and v.strip() not in VOICE_TYPES]
+VOICE_REFERENCE_TEXT = 'YouDub 是一个创新的开源工具，专注于将 YouTube 等平台的优质视频翻译和配音为中文版本。此工具融合了先进的 AI 技术，包括语音识别、大型语言模型翻译以及 AI 声音克隆技术，为中文用户提供具有原始 YouTuber 音色的中文配音视频。'
+
+voice_bank = None # (names, 归一化的参考向量矩阵)
+voice_bank_lock = threading.Lock()
+
+
+def _normalize_rows(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-8)
+
+
+def _voice_sources(npy_files):
+    """参考向量文件列表（文件名、大小、修改时间），与索引中记录的不一致时重建"""
+    sources = []
+    for f in npy_files:
+        stat = os.stat(os.path.join(VOICE_TYPE_DIR, f))
+        sources.append(f'{f}:{stat.st_size}:{stat.st_mtime_ns}')
+    return sources
+
+
+def load_voice_bank():
+    """
+    加载音色库：所有参考音色的 embedding 归一化后存成一个矩阵（voice_type/voice_bank.npz），
+    进程内只加载一次；.npy 文件有增删或变化时重新生成索引。
+    """
+    global voice_bank
+    with voice_bank_lock:
+        if voice_bank is not None:
+            return voice_bank
+        index_path = os.path.join(VOICE_TYPE_DIR, 'voice_bank.npz')
+        npy_files = sorted(f for f in os.listdir(VOICE_TYPE_DIR) if f.endswith('.npy'))
+        sources = _voice_sources(npy_files)
+        index = None
+        if os.path.exists(index_path):
+            try:
+                index = np.load(index_path)
+                if 'sources' not in index or [str(source) for source in index['sources']] != sources:
+                    index = None
+            except (OSError, ValueError) as e:
+                logger.warning(f'Failed to load voice bank index {index_path}: {e}')
+                index = None
+        if index is not None:
+            names, matrix = [str(name) for name in index['names']], index['matrix']
+        else:
+            names = [f[:-len('.npy')] for f in npy_files]
+            matrix = _normalize_rows([np.load(os.path.join(VOICE_TYPE_DIR, f)) for f in npy_files]) if npy_files else np.zeros((0, 0), np.float32)
+            np.savez(index_path, names=np.array(names), matrix=matrix, sources=np.array(sources))
+            logger.info(f'Built voice bank index with {len(names)} voices')
+        voice_bank = (names, matrix)
+    return voice_bank
+
+
+def match_voice_types(embeddings):
+    """一次矩阵乘法为每个说话人选出余弦相似度最高的音色"""
+    names, matrix = load_voice_bank()
+    if not names:
+        raise RuntimeError('Voice bank is empty, run get_available_speakers() first')
+    similarity = _normalize_rows(embeddings) @ matrix.T
+    return [names[i] for i in similarity.argmax(axis=1)]
+
+
 def generate_speaker_to_voice_type(folder):
-    # Initialize pyannote if needed
-    _init_pyannote()
-    
     speaker_to_voice_type_path = os.path.join(folder, 'speaker_to_voice_type.json')
     if os.path.exists(speaker_to_voice_type_path):
         with open(speaker_to_voice_type_path, 'r', encoding='utf-8') as f:
             speaker_to_voice_type = json.load(f)
         return speaker_to_voice_type
     
-    speaker_to_voice_type = {}
+    # Initialize pyannote if needed
+    _init_pyannote()
+    # 目录已存在时也要补齐 BYTEDANCE_VOICE_TYPES 中新增的音色（没有缺失时直接返回）
+    get_available_speakers()
+    
     speaker_folder = os.path.join(folder, 'SPEAKER')
-    voice_types = {}
-    if not os.path.exists('voice_type'):
-        get_available_speakers()
-    for file in os.listdir('voice_type'):
-        voice_type = file.replace('.wav', '')
-        voice_types[voice_type] = np.load(f'voice_type/{file.replace(".wav", ".npy")}')
-        
-    for file in os.listdir(speaker_folder):
+    speakers = []
+    embeddings = []
+    for file in sorted(os.listdir(speaker_folder)):
         if not file.endswith('.wav'):
             continue
-        speaker = file.replace('.wav', '')
         wav_path = os.path.join(speaker_folder, file)
         embedding = generate_embedding(wav_path)
-        # find the 
         np.save(wav_path.replace('.wav', '.npy'), embedding)
-        speaker_to_voice_type[speaker] = sorted(voice_types.keys(), key=lambda x: 1 - cosine(voice_types[x], embedding))[0]
+        speakers.append(file.replace('.wav', ''))
+        embeddings.append(embedding)
+    speaker_to_voice_type = dict(zip(speakers, match_voice_types(embeddings))) if speakers else {}
     for k, v in speaker_to_voice_type.items():
-        new_v = v.replace('.npy', '')
-        speaker_to_voice_type[k] = new_v
-        logger.info(f'{k}: {new_v}')
+        logger.info(f'{k}: {v}')
     with open(speaker_to_voice_type_path, 'w', encoding='utf-8') as f:
         json.dump(speaker_to_voice_type, f, indent=2, ensure_ascii=False)
     return speaker_to_voice_type
@@ -131,63 +339,52 @@ def tts(text, output_path, speaker_wav, voice_type=None):
         speaker_to_voice_type = generate_speaker_to_voice_type(folder)
         speaker = os.path.basename(speaker_wav).replace('.wav', '')
         voice_type = speaker_to_voice_type[speaker]
-    for retry in range(3):
-        try:
-            global request_json
-            request_json["audio"]["voice_type"] = voice_type
-            request_json["request"]["text"] = text
-            request_json["request"]["reqid"] = str(uuid.uuid4())
-            resp = requests.post(api_url, json.dumps(request_json), headers=header, timeout=60)
-            resp_json = resp.json()
-            # print(f"resp body: \n{resp.json()}")
-            if "data" in resp_json:
-                data = resp_json["data"]
-                with open(output_path, "wb") as f:
-                    f.write(base64.b64decode(data))
-                # file_to_save = open(output_path, "wb")
-                # file_to_save.write(base64.b64decode(data))
-                
-                # ensure the file is saved
-                wav, sample_rate = librosa.load(output_path, sr=24000)
-                logger.info(f'火山TTS {text} 保存成功: {output_path}')
-                time.sleep(0.1)
-                return  # Success - exit function
-            else:
-                logger.warning(f"Bytedance TTS API returned no data: {resp_json}")
-        except Exception as e:
-            logger.error(f"Bytedance TTS failed: {e}")
-        
-        # Sleep between retries
-        if retry < 2:
-            time.sleep(1)
-    
-    # Check if file was created
-    if not os.path.exists(output_path):
-        raise RuntimeError(f"Bytedance TTS failed to generate audio after 3 retries: no output file created")
+    cache = get_tts_cache()
+    key = make_key(text, voice_type, 'bytedance', cluster, 'zh')
+    if cache is not None and cache.fetch(key, output_path):
+        logger.info(f'火山TTS {text} 命中缓存')
+        return
+    audio = get_client().synthesize_bytes(text, voice_type)
+    # 解码即校验：不是合法 wav 时在这里抛错，不会留下坏文件
+    decode_wav(audio)
+    tmp_path = output_path + '.part'
+    with open(tmp_path, "wb") as f:
+        f.write(audio)
+    os.replace(tmp_path, output_path)
+    if cache is not None:
+        cache.store(key, 'bytedance', text, output_path)
+    logger.info(f'火山TTS {text} 保存成功: {output_path}')
 
 def get_available_speakers():
+    """并行合成缺失的参考音色，再逐个提取 embedding（pyannote 模型不是线程安全的）"""
+    global voice_bank
     if not _init_pyannote():
         logger.warning("pyannote not available, skipping speaker download")
         return
+    os.makedirs(VOICE_TYPE_DIR, exist_ok=True)
+    missing = [v for v in VOICE_TYPES if not os.path.exists(os.path.join(VOICE_TYPE_DIR, f'{v}.npy'))]
+    if not missing:
         return
-    if not os.path.exists('voice_type'):
-        os.makedirs('voice_type')
-    voice_types = ['BV001_streaming', 'BV002_streaming', 'BV005_streaming', 'BV007_streaming', 'BV033_streaming', 'BV034_streaming', 'BV056_streaming', 'BV102_streaming', 'BV113_streaming', 'BV115_streaming', 'BV119_streaming', 'BV700_streaming', 'BV701_streaming']
-    for voice_type in voice_types:
-        output_path = f'voice_type/{voice_type}.wav'
-        if os.path.exists(output_path):
+
+    def synthesize_reference(voice_type):
+        output_path = os.path.join(VOICE_TYPE_DIR, f'{voice_type}.wav')
+        try:
+            tts(VOICE_REFERENCE_TEXT, output_path, None, voice_type=voice_type)
+            return voice_type, output_path
+        except Exception as e:
+            logger.warning(f'Failed to synthesize reference voice {voice_type}: {e}')
+            return voice_type, None
+
+    logger.info(f'Synthesizing {len(missing)} reference voices')
+    with ThreadPoolExecutor(max_workers=get_client().concurrency) as executor:
+        references = list(executor.map(synthesize_reference, missing))
+    for voice_type, output_path in references:
+        if output_path is None:
             continue
-        retry = 3
-        while retry > 0:
-            try:
-                tts('YouDub 是一个创新的开源工具，专注于将 YouTube 等平台的优质视频翻译和配音为中文版本。此工具融合了先进的 AI 技术，包括语音识别、大型语言模型翻译以及 AI 声音克隆技术，为中文用户提供具有原始 YouTuber 音色的中文配音视频。', output_path, None, voice_type=voice_type)
-                embedding = embedding_inference(output_path)
-                np.save(output_path.replace('.wav', '.npy'), embedding)
-                break
-            except Exception as e:
-                logger.warning(e)
-                retry -= 1
-                time.sleep(0.1)
+        embedding = embedding_inference(output_path)
+        np.save(output_path.replace('.wav', '.npy'), embedding)
+    with voice_bank_lock:
+        voice_bank = None
         
 if __name__ == '__main__':
     # tts('你好，你叫什么名字？', f'videos\Lex Clips\20231222 Jeff Bezos on fear of death ｜ Lex Fridman Podcast Clips\wavs\{str(uuid.uuid4())}.wav',
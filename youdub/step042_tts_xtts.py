@@ -1,11 +1,16 @@
 import os
+import hashlib
+from collections import OrderedDict
 from loguru import logger
 import numpy as np
 import torch
 import time
 from .utils import save_wav
+from .tts_cache import get_tts_cache, make_key
 
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Lazy import TTS to avoid dependency issues at startup
 TTS = None
@@ -17,6 +22,30 @@ except ImportError as e:
 model = None
 model_lock = threading.Lock() # Add lock for thread-safe GPU access
 
+# 说话人条件潜变量缓存：按参考音频内容哈希，每个说话人只编码一次
+XTTS_LATENT_CACHE_SIZE = int(os.getenv('XTTS_LATENT_CACHE_SIZE', '32'))
+speaker_latents = OrderedDict() # hash -> (gpt_cond_latent, speaker_embedding)
+speaker_latents_lock = threading.Lock()
+_file_hashes = {} # (path, mtime_ns, size) -> hash
+# CPU 节点多进程合成：进程数（0 为按核数 / 每进程线程数自动选择，1 为关闭）与每个进程的线程数
+# 每个进程各持有一份模型（约 2GB 内存），有 GPU 时不启用
+XTTS_WORKERS = int(os.getenv('XTTS_WORKERS', '1'))
+XTTS_THREADS_PER_WORKER = int(os.getenv('XTTS_THREADS_PER_WORKER', '4'))
+tts_pool = None
+tts_pool_lock = threading.Lock()
+
+# 与 model.tts -> Xtts.full_inference 的默认值一致（不是 XttsConfig 里的 gpt_cond_len 等），
+# 保证缓存潜变量后的音色与原来逐句调用 model.tts 时相同
+LATENT_PARAMS = {
+    'gpt_cond_len': 30,
+    'gpt_cond_chunk_len': 6,
+    'max_ref_length': 10,
+    'sound_norm_refs': False,
+}
+
+# XTTS api 在每个句子后补的静音长度（采样点），与 TTS.api 的输出保持一致
+SENTENCE_SILENCE = 10000
+
 def init_TTS():
     load_model()
     
@@ -37,6 +66,88 @@ def load_model(model_path="tts_models/multilingual/multi-dataset/xtts_v2", devic
     logger.info(f'TTS model loaded in {t_end - t_start:.2f}s')
     
 
+def _file_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        with open(path, 'rb') as f:
+            _file_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return _file_hashes[key]
+
+
+def get_speaker_latents(speaker_wav):
+    """
+    获取参考音频的 (gpt_cond_latent, speaker_embedding)
+
+    先查进程内 LRU，再查参考音频旁的 SPEAKER_XX.latents.pt（哈希一致才使用），
+    都没有时编码一次并写回磁盘。调用方需持有 model_lock。
+    """
+    digest = _file_hash(speaker_wav)
+    with speaker_latents_lock:
+        if digest in speaker_latents:
+            speaker_latents.move_to_end(digest)
+            return speaker_latents[digest]
+
+    xtts = model.synthesizer.tts_model
+    latents_path = os.path.splitext(speaker_wav)[0] + '.latents.pt'
+    latents = None
+    if os.path.exists(latents_path):
+        try:
+            saved = torch.load(latents_path, map_location=xtts.device)
+            if saved.get('hash') == digest and saved.get('params') == LATENT_PARAMS:
+                latents = (saved['gpt_cond_latent'], saved['speaker_embedding'])
+        except Exception as e:
+            logger.warning(f'Failed to load speaker latents {latents_path}: {e}')
+    if latents is None:
+        t_start = time.time()
+        latents = xtts.get_conditioning_latents(audio_path=[speaker_wav], **LATENT_PARAMS)
+        # 先写临时文件再替换，避免中断或多个进程同时写入时留下损坏的 .latents.pt
+        tmp_path = f'{latents_path}.{os.getpid()}.part'
+        try:
+            torch.save({'hash': digest, 'params': LATENT_PARAMS,
+                        'gpt_cond_latent': latents[0], 'speaker_embedding': latents[1]}, tmp_path)
+            os.replace(tmp_path, latents_path)
+        except Exception as e:
+            logger.warning(f'Failed to save speaker latents {latents_path}: {e}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info(f'Computed speaker latents for {speaker_wav} in {time.time() - t_start:.2f}s')
+
+    with speaker_latents_lock:
+        speaker_latents[digest] = latents
+        while len(speaker_latents) > XTTS_LATENT_CACHE_SIZE:
+            speaker_latents.popitem(last=False)
+    return latents
+
+
+def synthesize(text, speaker_wav, language='zh-cn'):
+    """
+    用缓存的说话人潜变量合成，与 model.tts 一样按句切分并在句间补静音。
+    模型不是 XTTS（没有条件潜变量接口）时退回 model.tts。调用方需持有 model_lock。
+    """
+    xtts = getattr(model.synthesizer, 'tts_model', None)
+    if not hasattr(xtts, 'get_conditioning_latents'):
+        return model.tts(text, speaker_wav=speaker_wav, language=language)
+    gpt_cond_latent, speaker_embedding = get_speaker_latents(speaker_wav)
+    config = xtts.config
+    wav = []
+    for sentence in model.synthesizer.split_into_sentences(text):
+        out = xtts.inference(
+            sentence, language, gpt_cond_latent, speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+        )
+        sentence_wav = out['wav']
+        if torch.is_tensor(sentence_wav):
+            sentence_wav = sentence_wav.cpu().numpy()
+        wav.append(np.asarray(sentence_wav).squeeze())
+        wav.append(np.zeros(SENTENCE_SILENCE))
+    return np.concatenate(wav) if wav else np.zeros(0)
+
+
 def clean_quotes(text: str) -> str:
     """清理文本中的多余引号，提升观看体验"""
     # 移除各种中英文引号
@@ -88,9 +199,7 @@ def dedup_repeated_sentences(text: str) -> str:
     return result
 
 
-def tts(text, output_path, speaker_wav, model_name="tts_models/multilingual/multi-dataset/xtts_v2", device='auto', language='zh-cn'):
-    global model
-    
+def prepare_text(text):
     # 清理文本中的多余引号
     text = clean_quotes(text)
     # 去除翻译复读
@@ -107,24 +216,17 @@ def tts(text, output_path, speaker_wav, model_name="tts_models/multilingual/mult
         original_text = text
         text = text[:cut_point]
         logger.warning(f'文本过长 ({len(original_text)} chars)，已截断至 {len(text)} chars')
-    
-    if os.path.exists(output_path):
-        logger.info(f'TTS {text} 已存在')
-        return
-    
-    if model is None:
-        load_model(model_name, device)
-    
+    return text
+
+
+def synthesize_with_retry(text, speaker_wav, language='zh-cn'):
     last_error = None
     for retry in range(3):
         try:
             # 使用锁确保同一时间只有一个线程访问 GPU 资源，避免 CUDA 冲突
             with model_lock:
-                wav = model.tts(text, speaker_wav=speaker_wav, language=language)
-            wav = np.array(wav)
-            save_wav(wav, output_path)
-            logger.info(f'TTS {text}')
-            return  # Success - exit function
+                wav = synthesize(text, speaker_wav, language)
+            return np.array(wav, dtype=np.float32)
         except Exception as e:
             last_error = e
             logger.warning(f'TTS {text} 失败 (retry {retry + 1}/3): {e}')
@@ -135,6 +237,132 @@ def tts(text, output_path, speaker_wav, model_name="tts_models/multilingual/mult
     raise RuntimeError(f"XTTS failed after 3 retries: {last_error}")
 
 
+def cache_key(text, speaker_wav, model_name, language):
+    # 按参考音频内容而不是路径取哈希；SPEAKER_XX.wav 是每个视频各自提取的，不同视频之间通常不会命中
+    return make_key(text, _file_hash(speaker_wav), 'xtts', model_name, language)
+
+
+def fetch_cached(text, output_path, speaker_wav, model_name, language):
+    cache = get_tts_cache()
+    if cache is None or not cache.fetch(cache_key(text, speaker_wav, model_name, language), output_path):
+        return False
+    logger.info(f'TTS {text} 命中缓存')
+    return True
+
+
+def store_cached(text, output_path, speaker_wav, model_name, language):
+    cache = get_tts_cache()
+    if cache is not None:
+        cache.store(cache_key(text, speaker_wav, model_name, language), 'xtts', text, output_path)
+
+
+def tts(text, output_path, speaker_wav, model_name="tts_models/multilingual/multi-dataset/xtts_v2", device='auto', language='zh-cn'):
+    global model
+    
+    text = prepare_text(text)
+    
+    if os.path.exists(output_path):
+        logger.info(f'TTS {text} 已存在')
+        return
+    if fetch_cached(text, output_path, speaker_wav, model_name, language):
+        return
+    
+    if model is None:
+        load_model(model_name, device)
+    
+    wav = synthesize_with_retry(text, speaker_wav, language)
+    save_wav(wav, output_path)
+    store_cached(text, output_path, speaker_wav, model_name, language)
+    logger.info(f'TTS {text}')
+
+
+def get_tts_pool_layout(workers=None, threads=None):
+    """XTTS 进程池布局：仅在没有 GPU 时启用，workers 为 1 表示不使用进程池"""
+    threads = threads or XTTS_THREADS_PER_WORKER
+    cores = os.cpu_count() or 1
+    workers = workers or XTTS_WORKERS or max(1, cores // threads)
+    if torch.cuda.is_available():
+        workers = 1
+    return {'workers': workers, 'threads': threads, 'cores': cores}
+
+
+def tts_pool_enabled():
+    return get_tts_pool_layout()['workers'] > 1
+
+
+def _init_tts_worker(model_name, threads):
+    """进程池初始化：固定线程数，每个进程各自加载一份模型"""
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    load_model(model_name, 'cpu')
+
+
+def _tts_worker_job(text, speaker_wav, language):
+    return synthesize_with_retry(text, speaker_wav, language)
+
+
+def get_tts_pool(model_name="tts_models/multilingual/multi-dataset/xtts_v2"):
+    """常驻的 XTTS 进程池（延迟创建），多个视频共用，模型在每个进程中只加载一次"""
+    global tts_pool
+    with tts_pool_lock:
+        if tts_pool is None:
+            layout = get_tts_pool_layout()
+            logger.info(f"XTTS 进程池: {layout['workers']} 进程 x {layout['threads']} 线程 ({layout['cores']} 核)")
+            tts_pool = ProcessPoolExecutor(max_workers=layout['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_tts_worker, initargs=(model_name, layout['threads']))
+    return tts_pool
+
+
+def shutdown_tts_pool():
+    global tts_pool
+    with tts_pool_lock:
+        if tts_pool is not None:
+            tts_pool.shutdown()
+            tts_pool = None
+
+
+def tts_batch(items, model_name="tts_models/multilingual/multi-dataset/xtts_v2", language='zh-cn', sample_rate=24000):
+    """
+    用进程池批量合成：items 为 [(text, output_path, speaker_wav)]
+
+    按文本长度从长到短派发，避免最后剩一条长句拖慢整批；结果以数组返回，由主进程写文件。
+    完成后报告吞吐（句/秒）和实时率（耗时 / 生成音频时长）。
+    """
+    jobs = []
+    for text, output_path, speaker_wav in items:
+        text = prepare_text(text)
+        if os.path.exists(output_path):
+            logger.info(f'TTS {text} 已存在')
+            continue
+        if fetch_cached(text, output_path, speaker_wav, model_name, language):
+            continue
+        jobs.append((text, output_path, speaker_wav))
+    if not jobs:
+        return
+    jobs.sort(key=lambda job: len(job[0]), reverse=True)
+
+    executor = get_tts_pool(model_name)
+    t_start = time.time()
+    futures = {executor.submit(_tts_worker_job, text, speaker_wav, language): (text, output_path, speaker_wav)
+               for text, output_path, speaker_wav in jobs}
+    audio_seconds = 0
+    for future in as_completed(futures):
+        text, output_path, speaker_wav = futures[future]
+        wav = future.result()
+        save_wav(wav, output_path)
+        store_cached(text, output_path, speaker_wav, model_name, language)
+        audio_seconds += len(wav) / sample_rate
+        logger.info(f'TTS {text}')
+    elapsed = time.time() - t_start
+    logger.info(f'XTTS 进程池合成 {len(jobs)} 句用时 {elapsed:.2f}s: {len(jobs) / elapsed:.2f} 句/秒, '
+                f'实时率 {elapsed / max(audio_seconds, 1e-6):.2f} (生成音频 {audio_seconds:.1f}s)')
+
+
 if __name__ == '__main__':
     speaker_wav = r'videos\TED-Ed\20231121 Why did the US try to kill all the bison？ - Andrew C. Isenberg\audio_vocals.wav'
     while True:
@@ -1,49 +1,39 @@
 # -*- coding: utf-8 -*-
+import bisect
 import json
 import os
 import subprocess
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 from loguru import logger
+from .ffmpeg_runner import run_ffmpeg
+from .job_store import track_stage, pending_folders
+from .toolchain import get_ffmpeg_path, get_ffprobe_path, has_encoder
 
 load_dotenv()
 
 # 视频编码配置
 VIDEO_ENCODER = os.getenv('VIDEO_ENCODER', 'auto')  # auto, nvenc, x264
 VIDEO_QUALITY = os.getenv('VIDEO_QUALITY', 'high')  # high, medium, low
-
-def get_ffmpeg_path():
-    """获取 ffmpeg 路径，支持多种查找方式，优先使用环境变量配置"""
-    # 首先检查环境变量 FFMPEG_PATH
-    env_ffmpeg_path = os.getenv('FFMPEG_PATH')
-    if env_ffmpeg_path and os.path.exists(env_ffmpeg_path):
-        logger.info(f"使用环境变量配置的 ffmpeg: {env_ffmpeg_path}")
-        return env_ffmpeg_path
-    elif env_ffmpeg_path:
-        logger.warning(f"环境变量 FFMPEG_PATH 指定的路径不存在: {env_ffmpeg_path}")
-    
-    # 尝试从系统 PATH 中查找
-    ffmpeg_path = shutil.which('ffmpeg')
-    if ffmpeg_path:
-        return ffmpeg_path
-    
-    # 检查项目目录下的 ffmpeg
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    project_ffmpeg_paths = [
-        os.path.join(project_root, 'ffmpeg', 'bin', 'ffmpeg.exe'),
-        os.path.join(project_root, 'ffmpeg', 'ffmpeg-8.0.1-essentials_build', 'bin', 'ffmpeg.exe'),
-        r'D:\YouDub-webui\ffmpeg\bin\ffmpeg.exe',
-        r'D:\YouDub-webui\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffmpeg.exe',
-    ]
-    
-    for path in project_ffmpeg_paths:
-        if os.path.exists(path):
-            logger.info(f"使用项目目录下的 ffmpeg: {path}")
-            return path
-    
-    return None
+# 分段并行编码（仅 libx264）：段数，0 = 按 CPU 核数 / 每段线程数自动选择，1 = 关闭
+VIDEO_CHUNKS = int(os.getenv('VIDEO_CHUNKS', '0'))
+# 分段编码时每个 ffmpeg 进程的线程数
+VIDEO_CHUNK_THREADS = int(os.getenv('VIDEO_CHUNK_THREADS', '4'))
+# 每段的最短时长（秒），短视频不分段
+VIDEO_CHUNK_MIN_SECONDS = float(os.getenv('VIDEO_CHUNK_MIN_SECONDS', '60'))
+CHUNK_DIR_NAME = '.video_chunks'
+# 字幕方式：burn = 烧录进画面，soft = 作为 mov_text 字幕轨封装，sidecar = 只保留同目录的 subtitles.srt
+SUBTITLE_MODE = os.getenv('SUBTITLE_MODE', 'burn')
+# 不变速、不缩放、不烧录字幕时直接复制视频流（只编码音频），设为 0 则总是重新编码
+VIDEO_REMUX = os.getenv('VIDEO_REMUX', '1') == '1'
+# 可以直接复制进 mp4 的视频编码
+REMUX_VIDEO_CODECS = ('h264', 'hevc')
+# 额外输出的分辨率（逗号分隔），与主视频 video.mp4 在同一次 ffmpeg 中解码、编码，输出为 video_<分辨率>.mp4
+# 每项可以覆盖编码参数，如 480p:crf=26:preset=fast
+VIDEO_RENDITIONS = os.getenv('VIDEO_RENDITIONS', '')
 
 def get_video_encoder_config():
     """
@@ -55,16 +45,8 @@ def get_video_encoder_config():
         logger.warning("未找到 ffmpeg，使用默认 libx264 编码")
         return 'libx264', ['-crf', '23', '-preset', 'medium']
     
-    logger.info(f"检测到 ffmpeg: {ffmpeg_path}")
-    
-    # 检测 NVENC 支持
-    try:
-        result = subprocess.run([ffmpeg_path, '-encoders'], 
-                              capture_output=True, text=True, timeout=10)
-        has_nvenc = 'h264_nvenc' in result.stdout
-    except Exception as e:
-        logger.warning(f"检测 NVENC 支持失败: {e}")
-        has_nvenc = False
+    # 检测 NVENC 支持（探测结果按进程缓存）
+    has_nvenc = has_encoder('h264_nvenc')
     
     # 根据配置和硬件选择编码器
     if VIDEO_ENCODER == 'nvenc' and has_nvenc:
@@ -193,57 +175,17 @@ def generate_srt(translation, srt_path, speed_up=1, max_line_char=30):
             f.write(f'{text}\n\n')
 
 
-def get_ffprobe_path():
-    """获取 ffprobe 路径，优先使用环境变量或根据 FFMPEG_PATH 推断"""
-    # 首先检查环境变量 FFPROBE_PATH
-    env_ffprobe_path = os.getenv('FFPROBE_PATH')
-    if env_ffprobe_path and os.path.exists(env_ffprobe_path):
-        logger.info(f"使用环境变量配置的 ffprobe: {env_ffprobe_path}")
-        return env_ffprobe_path
-    elif env_ffprobe_path:
-        logger.warning(f"环境变量 FFPROBE_PATH 指定的路径不存在: {env_ffprobe_path}")
-    
-    # 尝试从 FFMPEG_PATH 推断 ffprobe 路径
-    env_ffmpeg_path = os.getenv('FFMPEG_PATH')
-    if env_ffmpeg_path:
-        inferred_ffprobe = env_ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe')
-        if os.path.exists(inferred_ffprobe):
-            logger.info(f"根据 FFMPEG_PATH 推断的 ffprobe: {inferred_ffprobe}")
-            return inferred_ffprobe
-    
-    # 尝试从系统 PATH 中查找
-    ffprobe_path = shutil.which('ffprobe')
-    if ffprobe_path:
-        return ffprobe_path
-    
-    # 检查项目目录下的 ffprobe（与 ffmpeg 同目录）
-    ffmpeg_path = get_ffmpeg_path()
-    if ffmpeg_path and ffmpeg_path != 'ffmpeg':
-        ffprobe_path = ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe')
-        if os.path.exists(ffprobe_path):
-            return ffprobe_path
-    
-    # 常见路径
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    common_paths = [
-        os.path.join(project_root, 'ffmpeg', 'bin', 'ffprobe.exe'),
-        os.path.join(project_root, 'ffmpeg', 'ffmpeg-8.0.1-essentials_build', 'bin', 'ffprobe.exe'),
-        r'D:\YouDub-webui\ffmpeg\bin\ffprobe.exe',
-        r'D:\YouDub-webui\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffprobe.exe',
-    ]
-    
-    for path in common_paths:
-        if os.path.exists(path):
-            return path
-    
-    return 'ffprobe'  # fallback 到系统命令
-
-def get_aspect_ratio(video_path):
+def get_video_stream_info(video_path):
+    """返回第一个视频流的 width, height, codec_name, r_frame_rate"""
     ffprobe_path = get_ffprobe_path()
     command = [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
-               '-show_entries', 'stream=width,height', '-of', 'json', video_path]
+               '-show_entries', 'stream=width,height,codec_name,r_frame_rate', '-of', 'json', video_path]
     result = subprocess.run(command, capture_output=True, text=True)
-    dimensions = json.loads(result.stdout)['streams'][0]
+    return json.loads(result.stdout)['streams'][0]
+
+
+def get_aspect_ratio(video_path):
+    dimensions = get_video_stream_info(video_path)
     return dimensions['width'] / dimensions['height']
 
 
@@ -261,13 +203,336 @@ def convert_resolution(aspect_ratio, resolution='1080p'):
     # return f'{width}x{height}'
     return width, height
     
-def synthesize_video(folder, subtitles=True, speed_up=1.05, fps=30, resolution='1080p'):
+def get_video_duration(video_path):
+    ffprobe_path = get_ffprobe_path()
+    command = [ffprobe_path, '-v', 'error', '-show_entries', 'format=duration',
+               '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    return float(result.stdout.strip())
+
+
+def get_keyframe_times(video_path):
+    """读取视频流所有关键帧的时间（只解复用，不解码）"""
+    ffprobe_path = get_ffprobe_path()
+    command = [ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags', '-of', 'csv=print_section=0', video_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if flags.startswith('K') and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    return sorted(times)
+
+
+def plan_chunks(keyframes, duration, chunks):
+    """在关键帧处把 [0, duration) 切成约 chunks 段，返回 [(start, end)]（源视频时间）"""
+    boundaries = [0.0]
+    for i in range(1, chunks):
+        index = bisect.bisect_left(keyframes, duration * i / chunks)
+        if index < len(keyframes) and boundaries[-1] < keyframes[index] < duration:
+            boundaries.append(keyframes[index])
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def plan_video_chunks(input_video, video_codec, duration=None):
+    """
+    决定是否分段编码，返回分段列表；只有一段时走单进程编码
+
+    NVENC 本身不受 CPU 核数限制，只对 libx264 分段。段数默认按 CPU 核数 / VIDEO_CHUNK_THREADS，
+    且每段不短于 VIDEO_CHUNK_MIN_SECONDS。
+    """
+    if video_codec != 'libx264' or VIDEO_CHUNKS == 1:
+        return []
+    chunks = VIDEO_CHUNKS or (os.cpu_count() or 1) // max(1, VIDEO_CHUNK_THREADS)
+    try:
+        if duration is None:
+            duration = get_video_duration(input_video)
+        chunks = min(chunks, int(duration // VIDEO_CHUNK_MIN_SECONDS))
+        if chunks <= 1:
+            return []
+        return plan_chunks(get_keyframe_times(input_video), duration, chunks)
+    except Exception as e:
+        logger.warning(f"读取视频关键帧失败，使用单进程编码: {e}")
+        return []
+
+
+def _frame_rate(rate):
+    numerator, _, denominator = rate.partition('/')
+    denominator = float(denominator or 1)
+    return float(numerator) / denominator if denominator else 0.0
+
+
+def can_remux(stream, speed_up, fps, width, height, burn_subtitles):
+    """不变速、分辨率和帧率与源视频一致、不烧录字幕时，视频流可以原样复制"""
+    if not VIDEO_REMUX or burn_subtitles or speed_up != 1:
+        return False
+    if stream.get('codec_name') not in REMUX_VIDEO_CODECS:
+        return False
+    if (stream['width'], stream['height']) != (width, height):
+        return False
+    return abs(_frame_rate(stream.get('r_frame_rate', '0/1')) - fps) / fps < 0.01
+
+
+def _subtitle_track_args(srt_path, input_index):
+    """soft 模式下把 srt 作为第 input_index 个输入，封装为 mov_text 字幕轨；返回 (输入参数, 输出参数)"""
+    if not srt_path:
+        return [], []
+    return ['-i', srt_path], ['-map', f'{input_index}:s', '-c:s', 'mov_text']
+
+
+def remux_video(ffmpeg_path, input_video, input_audio, output_video, audio_params, soft_subtitle=None,
+                duration=None):
+    """复制视频流，只编码配音音轨"""
+    subtitle_inputs, subtitle_outputs = _subtitle_track_args(soft_subtitle, 2)
+    command = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'warning',
+        '-i', input_video,
+        '-i', input_audio,
+        *subtitle_inputs,
+        '-map', '0:v:0', '-map', '1:a',
+        *subtitle_outputs,
+        '-c:v', 'copy',
+        *audio_params,
+        output_video, '-y',
+    ]
+    result = run_ffmpeg(command, label='remux', duration=duration,
+                        folder=os.path.dirname(output_video), stage='synthesize')
+    if result.returncode != 0:
+        raise Exception(f"视频封装失败: {result.stderr}")
+
+
+def encode_video(ffmpeg_path, input_video, input_audio, output_video, filter_complex,
+                 resolution_str, fps, video_codec, video_params, audio_params, soft_subtitle=None,
+                 duration=None):
+    """单个 ffmpeg 进程编码整段视频，NVENC 失败时回退到软件编码；duration 为输出视频的预计时长"""
+    subtitle_inputs, subtitle_outputs = _subtitle_track_args(soft_subtitle, 2)
+    ffmpeg_command = [
+        ffmpeg_path,
+        '-hide_banner',          # 隐藏版本信息
+        '-loglevel', 'warning',  # 只显示警告和错误
+        '-i', input_video,
+        '-i', input_audio,
+        *subtitle_inputs,
+        '-filter_complex', filter_complex,
+        '-map', '[v]',
+        '-map', '[a]',
+        *subtitle_outputs,
+        '-r', str(fps),
+        '-s', resolution_str,
+        '-c:v', video_codec,
+    ]
+    
+    # 添加视频编码参数
+    ffmpeg_command.extend(video_params)
+    
+    # 添加音频编码参数
+    ffmpeg_command.extend(audio_params)
+    
+    # 输出文件
+    ffmpeg_command.extend([output_video, '-y'])
+    
+    # 执行编码
+    logger.info(f"使用命令: {' '.join(ffmpeg_command[:10])}...")
+    run_args = dict(label='encode', duration=duration, folder=os.path.dirname(output_video), stage='synthesize')
+    result = run_ffmpeg(ffmpeg_command, **run_args)
+    
+    if result.returncode != 0:
+        logger.error(f"视频合成失败: {result.stderr}")
+        # 如果 NVENC 失败，回退到软件编码
+        if video_codec == 'h264_nvenc':
+            logger.warning("NVENC 编码失败，尝试使用软件编码...")
+            ffmpeg_command[ffmpeg_command.index('h264_nvenc')] = 'libx264'
+            # 替换视频参数
+            idx = ffmpeg_command.index('-cq') if '-cq' in ffmpeg_command else -1
+            if idx > 0:
+                ffmpeg_command[idx:idx+6] = ['-crf', '20', '-preset', 'medium']
+            result = run_ffmpeg(ffmpeg_command, **run_args)
+            if result.returncode != 0:
+                raise Exception(f"视频合成失败: {result.stderr}")
+
+
+def _encode_chunk(ffmpeg_path, input_video, chunk, frames, filter_complex, fps, resolution_str,
+                  video_codec, video_params, chunk_path, label, duration, folder):
+    start, end = chunk
+    command = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'warning',
+        # 多读 1 秒，保证 fps 滤镜能补满本段的帧数，多余的帧由 -frames:v 截掉
+        '-ss', f'{start:.6f}', '-t', f'{end - start + 1:.6f}', '-i', input_video,
+        '-filter_complex', filter_complex,
+        '-map', '[v]', '-an',
+        '-r', str(fps),
+        '-s', resolution_str,
+        '-c:v', video_codec,
+        *video_params,
+        '-threads', str(VIDEO_CHUNK_THREADS),
+    ]
+    if frames is not None:
+        command.extend(['-frames:v', str(frames)])
+    command.extend([chunk_path, '-y'])
+    result = run_ffmpeg(command, label=label, duration=duration, folder=folder, stage='synthesize')
+    if result.returncode != 0:
+        raise Exception(f"分段编码失败 ({start:.1f}s - {end:.1f}s): {result.stderr}")
+
+
+def encode_video_chunked(ffmpeg_path, input_video, input_audio, output_video, chunks, speed_up, fps,
+                         subtitle_filter, resolution_str, video_codec, video_params, audio_params,
+                         soft_subtitle=None, duration=None):
+    """
+    分段并行编码：每段一个 ffmpeg 进程只编码视频，最后用 concat 分离器直接拼接，音频整段编码一次
+
+    - 每段先把时间戳平移到整段视频中的位置再烧录字幕和取帧，字幕时间和帧网格与整段编码一致
+    - 每段的帧数按整段时间轴上的帧号计算，拼接后不会在段边界累积误差
+    - 音频不分段编码，避免 AAC 每段的编码延迟在拼接处产生停顿和爆音
+    """
+    folder = os.path.dirname(output_video)
+    chunk_dir = os.path.join(folder, CHUNK_DIR_NAME)
+    os.makedirs(chunk_dir, exist_ok=True)
+    jobs = []
+    chunk_paths = []
+    for i, (start, end) in enumerate(chunks):
+        offset = start / speed_up
+        video_filter = f"setpts=PTS/{speed_up}+{offset:.6f}/TB"
+        if subtitle_filter:
+            video_filter += f",{subtitle_filter}"
+        filter_complex = f"[0:v]{video_filter},fps={fps},setpts=PTS-STARTPTS[v]"
+        frames = None
+        if i < len(chunks) - 1:
+            frames = round(end / speed_up * fps) - round(start / speed_up * fps)
+        chunk_path = os.path.join(chunk_dir, f'chunk_{i:03d}.mp4')
+        chunk_paths.append(chunk_path)
+        jobs.append((ffmpeg_path, input_video, (start, end), frames, filter_complex, fps, resolution_str,
+                     video_codec, video_params, chunk_path, f'chunk {i + 1}/{len(chunks)}',
+                     (end - start) / speed_up, folder))
+
+    logger.info(f"分段并行编码: {len(chunks)} 段，每段 {VIDEO_CHUNK_THREADS} 线程")
+    try:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            for future in [executor.submit(_encode_chunk, *job) for job in jobs]:
+                future.result()
+
+        # concat 列表中的相对路径以列表文件所在目录为准
+        list_path = os.path.join(chunk_dir, 'chunks.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for chunk_path in chunk_paths:
+                f.write(f"file '{os.path.basename(chunk_path)}'\n")
+        subtitle_inputs, subtitle_outputs = _subtitle_track_args(soft_subtitle, 2)
+        command = [
+            ffmpeg_path, '-hide_banner', '-loglevel', 'warning',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', input_audio,
+            *subtitle_inputs,
+            '-filter_complex', f"[1:a]atempo={speed_up}[a]",
+            '-map', '0:v', '-map', '[a]',
+            *subtitle_outputs,
+            '-c:v', 'copy',
+            *audio_params,
+            output_video, '-y',
+        ]
+        result = run_ffmpeg(command, label='concat', duration=duration, folder=folder, stage='synthesize')
+        if result.returncode != 0:
+            raise Exception(f"分段拼接失败: {result.stderr}")
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+def parse_renditions(spec):
+    """'720p,480p:crf=26:preset=fast' -> [('720p', {}), ('480p', {'crf': '26', 'preset': 'fast'})]"""
+    renditions = []
+    for item in spec.split(',') if isinstance(spec, str) else spec:
+        resolution, *options = item.strip().split(':')
+        if resolution:
+            renditions.append((resolution, dict(option.split('=', 1) for option in options)))
+    return renditions
+
+
+# 各编码器中对应同一含义的参数名：NVENC 忽略 -crf，质量由 -cq 控制；libx264 没有 -cq
+ENCODER_OPTION_ALIASES = {
+    'h264_nvenc': {'crf': 'cq'},
+    'libx264': {'cq': 'crf'},
+}
+
+
+def _override_params(params, overrides, codec):
+    params = list(params)
+    aliases = ENCODER_OPTION_ALIASES.get(codec, {})
+    for key, value in overrides.items():
+        if key in aliases:
+            logger.info(f'{codec} 不支持 -{key}，改用 -{aliases[key]} {value}')
+            key = aliases[key]
+        if f'-{key}' in params:
+            params[params.index(f'-{key}') + 1] = value
+        else:
+            params.extend([f'-{key}', value])
+    return params
+
+
+def _stream_params(params, index):
+    """把编码参数限定到第 index 路视频流：-crf 18 -> -crf:v:1 18，-b:v 0 -> -b:v:1 0（先去掉原有的流限定）"""
+    return [f'{arg.split(":", 1)[0]}:v:{index}' if i % 2 == 0 else arg for i, arg in enumerate(params)]
+
+
+def _tee_output(path, video_index, soft_subtitle):
+    # tee 的输出列表中 \ ' | 需要转义，Windows 路径统一改用 /
+    path = path.replace('\\', '/').replace("'", "\\'").replace('|', '\\|')
+    streams = f'v\\:{video_index},a' + (',s' if soft_subtitle else '')
+    return f"[select='{streams}':f=mp4]{path}"
+
+
+def encode_renditions(ffmpeg_path, input_video, input_audio, outputs, video_filter, speed_up, fps,
+                      video_codec, video_params, audio_params, soft_subtitle=None, duration=None):
+    """
+    一次解码、变速、烧录字幕后用 split 分成多路，每路缩放到各自的分辨率并用各自的参数编码
+
+    outputs 为 [(输出路径, (宽, 高), 编码参数覆盖)]。音频只编码一次，由 tee 封装器写入所有输出文件。
+    """
+    branches = ''.join(f'[s{i}]' for i in range(len(outputs)))
+    filters = [f"[0:v]{video_filter},split={len(outputs)}{branches}"]
+    for i, (_, (width, height), _) in enumerate(outputs):
+        filters.append(f"[s{i}]scale={width}:{height},setsar=1[v{i}]")
+    filters.append(f"[1:a]atempo={speed_up}[a]")
+    subtitle_inputs, subtitle_outputs = _subtitle_track_args(soft_subtitle, 2)
+
+    for attempt_codec, attempt_params in ((video_codec, video_params), ('libx264', ['-crf', '20', '-preset', 'medium'])):
+        command = [
+            ffmpeg_path, '-hide_banner', '-loglevel', 'warning', '-y',
+            '-i', input_video,
+            '-i', input_audio,
+            *subtitle_inputs,
+            '-filter_complex', ';'.join(filters),
+        ]
+        for i in range(len(outputs)):
+            command.extend(['-map', f'[v{i}]'])
+        command.extend(['-map', '[a]', *subtitle_outputs, '-r', str(fps), '-c:v', attempt_codec])
+        for i, (_, _, overrides) in enumerate(outputs):
+            command.extend(_stream_params(_override_params(attempt_params, overrides, attempt_codec), i))
+        command.extend([*audio_params, '-flags', '+global_header', '-f', 'tee',
+                        '|'.join(_tee_output(path, i, soft_subtitle) for i, (path, _, _) in enumerate(outputs))])
+        result = run_ffmpeg(command, label=f'{len(outputs)} renditions', duration=duration,
+                            folder=os.path.dirname(outputs[0][0]), stage='synthesize')
+        if result.returncode == 0:
+            return
+        logger.error(f"多分辨率合成失败: {result.stderr}")
+        # 如果 NVENC 失败，回退到软件编码
+        if attempt_codec != 'h264_nvenc':
+            break
+        logger.warning("NVENC 编码失败，尝试使用软件编码...")
+    raise Exception(f"多分辨率合成失败: {result.stderr}")
+
+
+@track_stage('synthesize')
+def synthesize_video(folder, subtitles=True, speed_up=1.05, fps=30, resolution='1080p', renditions=None):
     """
     合成视频，使用优化的编码参数
     
     环境变量配置：
     - VIDEO_ENCODER: 视频编码器 (auto/nvenc/x264)
     - VIDEO_QUALITY: 视频质量 (high/medium/low)
+    - VIDEO_CHUNKS / VIDEO_CHUNK_THREADS: libx264 分段并行编码的段数和每段线程数
+    - SUBTITLE_MODE: 字幕方式 (burn/soft/sidecar)
+    - VIDEO_REMUX: speed_up 为 1、分辨率和帧率与源视频一致且不烧录字幕时，直接复制视频流
+    - VIDEO_RENDITIONS: 额外输出的分辨率（renditions 参数为空时使用），如 480p 或 480p:crf=26
     """
     if os.path.exists(os.path.join(folder, 'video.mp4')):
         logger.info(f'Video already synthesized in {folder}')
@@ -297,7 +562,8 @@ def synthesize_video(folder, subtitles=True, speed_up=1.05, fps=30, resolution='
     output_video = os.path.join(folder, 'video.mp4')
     generate_srt(translation, srt_path, speed_up)
     srt_path = srt_path.replace('\\', '/')
-    aspect_ratio = get_aspect_ratio(input_video)
+    stream = get_video_stream_info(input_video)
+    aspect_ratio = stream['width'] / stream['height']
     width, height = convert_resolution(aspect_ratio, resolution)
     resolution_str = f'{width}x{height}'
     font_size = int(width/128)
@@ -305,67 +571,65 @@ def synthesize_video(folder, subtitles=True, speed_up=1.05, fps=30, resolution='
     video_speed_filter = f"setpts=PTS/{speed_up}"
     audio_speed_filter = f"atempo={speed_up}"
     subtitle_filter = f"subtitles={srt_path}:force_style='FontName=Arial,FontSize={font_size},PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline={outline},WrapStyle=2'"
+    burn_subtitles = subtitles and SUBTITLE_MODE == 'burn'
+    soft_subtitle = srt_path if subtitles and SUBTITLE_MODE == 'soft' else None
     
-    if subtitles:
+    if burn_subtitles:
         filter_complex = f"[0:v]{video_speed_filter},{subtitle_filter}[v];[1:a]{audio_speed_filter}[a]"
     else:
         filter_complex = f"[0:v]{video_speed_filter}[v];[1:a]{audio_speed_filter}[a]"
     
-    # 获取优化的编码配置
-    video_codec, video_params = get_video_encoder_config()
-    audio_params = get_audio_encoder_config()
-    
     # 获取 ffmpeg 路径
     ffmpeg_path = get_ffmpeg_path()
     if not ffmpeg_path:
         raise Exception("未找到 ffmpeg，无法合成视频")
-    
-    logger.info(f"开始视频合成: {folder}")
-    logger.info(f"视频编码器: {video_codec}, 分辨率: {resolution_str}, 帧率: {fps}")
-    logger.info(f"使用 ffmpeg: {ffmpeg_path}")
-    
-    # 构建 ffmpeg 命令
-    ffmpeg_command = [
-        ffmpeg_path,
-        '-hide_banner',          # 隐藏版本信息
-        '-loglevel', 'warning',  # 只显示警告和错误
-        '-stats',                # 显示编码进度
-        '-i', input_video,
-        '-i', input_audio,
-        '-filter_complex', filter_complex,
-        '-map', '[v]',
-        '-map', '[a]',
-        '-r', str(fps),
-        '-s', resolution_str,
-        '-c:v', video_codec,
-    ]
-    
-    # 添加视频编码参数
-    ffmpeg_command.extend(video_params)
-    
-    # 添加音频编码参数
-    ffmpeg_command.extend(audio_params)
-    
-    # 输出文件
-    ffmpeg_command.extend([output_video, '-y'])
-    
-    # 执行编码
-    logger.info(f"使用命令: {' '.join(ffmpeg_command[:10])}...")
-    result = subprocess.run(ffmpeg_command, capture_output=True, text=True)
-    
-    if result.returncode != 0:
-        logger.error(f"视频合成失败: {result.stderr}")
-        # 如果 NVENC 失败，回退到软件编码
-        if video_codec == 'h264_nvenc':
-            logger.warning("NVENC 编码失败，尝试使用软件编码...")
-            ffmpeg_command[ffmpeg_command.index('h264_nvenc')] = 'libx264'
-            # 替换视频参数
-            idx = ffmpeg_command.index('-cq') if '-cq' in ffmpeg_command else -1
-            if idx > 0:
-                ffmpeg_command[idx:idx+6] = ['-crf', '20', '-preset', 'medium']
-            result = subprocess.run(ffmpeg_command, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"视频合成失败: {result.stderr}")
+    audio_params = get_audio_encoder_config()
+    try:
+        source_duration = get_video_duration(input_video)
+    except Exception as e:
+        logger.warning(f"读取视频时长失败，无法估计剩余时间: {e}")
+        source_duration = None
+    output_duration = source_duration / speed_up if source_duration else None
+    
+    renditions = parse_renditions(VIDEO_RENDITIONS if renditions is None else renditions)
+    extra_outputs = [(os.path.join(folder, f'video_{name}.mp4'), convert_resolution(aspect_ratio, name), overrides)
+                     for name, overrides in renditions if name != resolution]
+    
+    if extra_outputs:
+        video_codec, video_params = get_video_encoder_config()
+        logger.info(f"开始多分辨率合成: {folder}, 分辨率: {resolution_str}, "
+                    f"{', '.join(f'{w}x{h}' for _, (w, h), _ in extra_outputs)}")
+        video_filter = f"{video_speed_filter},{subtitle_filter}" if burn_subtitles else video_speed_filter
+        encode_renditions(ffmpeg_path, input_video, input_audio, [(output_video, (width, height), {})] + extra_outputs,
+                          video_filter, speed_up, fps, video_codec, video_params, audio_params, soft_subtitle,
+                          duration=output_duration)
+    elif can_remux(stream, speed_up, fps, width, height, burn_subtitles):
+        logger.info(f"开始视频封装（复制视频流，只编码音频）: {folder}")
+        remux_video(ffmpeg_path, input_video, input_audio, output_video, audio_params, soft_subtitle,
+                    duration=output_duration)
+    else:
+        # 获取优化的编码配置
+        video_codec, video_params = get_video_encoder_config()
+        
+        logger.info(f"开始视频合成: {folder}")
+        logger.info(f"视频编码器: {video_codec}, 分辨率: {resolution_str}, 帧率: {fps}")
+        logger.info(f"使用 ffmpeg: {ffmpeg_path}")
+        
+        chunks = plan_video_chunks(input_video, video_codec, source_duration)
+        encoded = False
+        if chunks:
+            try:
+                encode_video_chunked(ffmpeg_path, input_video, input_audio, output_video, chunks, speed_up, fps,
+                                     subtitle_filter if burn_subtitles else None, resolution_str,
+                                     video_codec, video_params, audio_params, soft_subtitle,
+                                     duration=output_duration)
+                encoded = True
+            except Exception as e:
+                logger.warning(f"分段编码失败，改用单进程编码: {e}")
+        if not encoded:
+            encode_video(ffmpeg_path, input_video, input_audio, output_video, filter_complex,
+                         resolution_str, fps, video_codec, video_params, audio_params, soft_subtitle,
+                         duration=output_duration)
     
     # 验证输出文件
     if os.path.exists(output_video):
@@ -377,13 +641,10 @@ def synthesize_video(folder, subtitles=True, speed_up=1.05, fps=30, resolution='
     time.sleep(0.5)
     
 
-def synthesize_all_video_under_folder(folder, subtitles=True, speed_up=1.05, fps=30, resolution='1080p'):
-    for root, dirs, files in os.walk(folder):
-        # Check for either .mp4 or .webm input files
-        has_input = 'download.mp4' in files or 'download.webm' in files
-        if has_input and 'video.mp4' not in files:
-            synthesize_video(root, subtitles=subtitles,
-                             speed_up=speed_up, fps=fps, resolution=resolution)
+def synthesize_all_video_under_folder(folder, subtitles=True, speed_up=1.05, fps=30, resolution='1080p', renditions=None):
+    for root in pending_folders(folder, 'synthesize'):
+        synthesize_video(root, subtitles=subtitles,
+                         speed_up=speed_up, fps=fps, resolution=resolution, renditions=renditions)
     return f'Synthesized all videos under {folder}'
 if __name__ == '__main__':
     folder = r'videos\3Blue1Brown\20231207 Im still astounded this is true'
@@ -2,6 +2,7 @@ import json
 import os
 from PIL import Image
 from loguru import logger
+from .job_store import track_stage, pending_folders
 
 
 def resize_thumbnail(folder, size=(1280, 960)):
@@ -53,13 +54,14 @@ def generate_summary_txt(folder):
     with open(os.path.join(folder, 'video.txt'), 'w', encoding='utf-8') as f:
         f.write(txt)
 
+@track_stage('info')
 def generate_info(folder):
     generate_summary_txt(folder)
     resize_thumbnail(folder)
     
 def generate_all_info_under_folder(root_folder):
-    for root, dirs, files in os.walk(root_folder):
-        if 'download.info.json' in files:
+    for root in pending_folders(root_folder, 'info'):
+        if os.path.exists(os.path.join(root, 'download.info.json')):
             generate_info(root)
     return f'Generated all info under {root_folder}'
 if __name__ == '__main__':
@@ -8,6 +8,7 @@ from bilibili_toolman.bilisession.common.submission import Submission
 from dotenv import load_dotenv
 from loguru import logger
 from requests.exceptions import ProxyError
+from .job_store import track_stage, pending_folders
 # Load environment variables
 load_dotenv()
 
@@ -90,6 +91,7 @@ def bili_login():
         logger.debug(traceback.format_exc())
         raise Exception(f'bilibili 登录失败，请检查 SESSDATA 和 bili_jct 是否有效: {e}')
 
+@track_stage('upload')
 def upload_video(folder):
     submission_result_path = os.path.join(folder, 'bilibili.json')
     if os.path.exists(submission_result_path):
@@ -274,9 +276,8 @@ def upload_video(folder):
     raise Exception('上传失败：已达到最大重试次数')
 
 def upload_all_videos_under_folder(folder):
-    for dir, _, files in os.walk(folder):
-        if 'video.mp4' in files:
-            upload_video(dir)
+    for dir in pending_folders(folder, 'upload'):
+        upload_video(dir)
     return f'All videos under {folder} uploaded.'
 
 if __name__ == '__main__':
@@ -3,12 +3,18 @@
 术语一致性管理模块
 确保专业术语在翻译中保持一致
 """
+import hashlib
 import json
 import os
 import re
+import threading
+import time
 from pathlib import Path
 from loguru import logger
 
+# 逐句替换时最多每隔多少秒检查一次 config/terminology.json 是否被修改
+TERMINOLOGY_RELOAD_INTERVAL = float(os.getenv('TERMINOLOGY_RELOAD_INTERVAL', '5'))
+
 # 默认术语词典 - AI/科技领域常用术语
 DEFAULT_TERMINOLOGY = {
     # AI/Machine Learning
@@ -508,6 +514,11 @@ class TerminologyManager:
             custom_dict_path: 自定义术语词典文件路径（JSON格式）
         """
         self.terms = DEFAULT_TERMINOLOGY.copy()
+        # (正则, 替换表) 作为一个整体替换，翻译线程读到的两者总是同一版本
+        self._matcher = None
+        self._matcher_lock = threading.Lock()
+        self._next_config_check = 0.0
+        self._version = None
         
         # 加载自定义术语
         if custom_dict_path and os.path.exists(custom_dict_path):
@@ -521,40 +532,80 @@ class TerminologyManager:
         
         # 尝试从项目根目录加载术语文件
         project_root = Path(__file__).parent.parent
-        terms_file = project_root / 'config' / 'terminology.json'
-        if terms_file.exists():
-            try:
-                with open(terms_file, 'r', encoding='utf-8') as f:
-                    custom_terms = json.load(f)
-                    self.terms.update(custom_terms)
-                    logger.info(f"从配置文件加载了 {len(custom_terms)} 个术语")
-            except Exception as e:
-                logger.warning(f"加载配置文件术语失败: {e}")
+        self._config_file = project_root / 'config' / 'terminology.json'
+        self._config_mtime = None
+        self._load_config_terms()
+    
+    def _load_config_terms(self):
+        """加载 config/terminology.json，记录修改时间以便文件变化时重新加载"""
+        terms_file = self._config_file
+        if not terms_file.exists():
+            return
+        try:
+            self._config_mtime = terms_file.stat().st_mtime_ns
+            with open(terms_file, 'r', encoding='utf-8') as f:
+                custom_terms = json.load(f)
+                self.terms.update(custom_terms)
+                logger.info(f"从配置文件加载了 {len(custom_terms)} 个术语")
+        except Exception as e:
+            logger.warning(f"加载配置文件术语失败: {e}")
+        self._matcher = None
+        self._version = None
+    
+    def _config_changed(self):
+        try:
+            mtime = self._config_file.stat().st_mtime_ns
+        except OSError:
+            return False
+        return mtime != self._config_mtime
+    
+    def _config_check_due(self):
+        """节流：翻译热路径中每 TERMINOLOGY_RELOAD_INTERVAL 秒才 stat 一次配置文件"""
+        now = time.monotonic()
+        if now < self._next_config_check:
+            return False
+        self._next_config_check = now + TERMINOLOGY_RELOAD_INTERVAL
+        return self._config_changed()
+    
+    def _build_matcher(self):
+        """
+        把所有术语编译成一个交替正则，返回 (正则, 替换表)
+        
+        按长度降序排列，同一位置优先匹配最长的术语；
+        替换表以小写为键，实现大小写不敏感的查找。
+        先在局部变量中构建，再在锁内一次性替换，不会出现新正则配旧替换表的中间状态
+        """
+        with self._matcher_lock:
+            if self._config_changed():
+                self._load_config_terms()
+            if self._matcher is not None:
+                return self._matcher
+            sorted_terms = sorted(self.terms.items(), key=lambda x: len(x[0]), reverse=True)
+            replacements = {}
+            for en_term, cn_term in sorted_terms:
+                replacements.setdefault(en_term.lower(), cn_term)
+            pattern = '|'.join(re.escape(en_term) for en_term, _ in sorted_terms)
+            regex = re.compile(r'\b(?:' + pattern + r')\b', flags=re.IGNORECASE)
+            self._matcher = (regex, replacements)
+            return self._matcher
     
     def apply_to_translation(self, text):
         """
         对翻译文本应用术语替换
         
         策略：
-        1. 先替换最长的术语（避免部分匹配）
+        1. 同一位置优先替换最长的术语（避免部分匹配）
         2. 使用单词边界确保完整匹配
         3. 保持大小写不敏感
+        4. 预编译为单个正则，一次线性扫描完成全部替换
         """
-        # 按长度降序排序，优先替换长术语
-        sorted_terms = sorted(self.terms.items(), key=lambda x: len(x[0]), reverse=True)
-        
-        for en_term, cn_term in sorted_terms:
-            # 使用单词边界正则，确保完整匹配
-            # 处理带空格的术语（如 "Machine Learning"）
-            if ' ' in en_term:
-                pattern = r'\b' + re.escape(en_term) + r'\b'
-            else:
-                pattern = r'\b' + re.escape(en_term) + r'\b'
-            
-            # 替换（保持大小写不敏感）
-            text = re.sub(pattern, cn_term, text, flags=re.IGNORECASE)
-        
-        return text
+        matcher = self._matcher
+        if matcher is None or self._config_check_due():
+            matcher = self._build_matcher()
+        regex, replacements = matcher
+        if not replacements:
+            return text
+        return regex.sub(lambda m: replacements.get(m.group(0).lower(), m.group(0)), text)
     
     def extract_terms_from_text(self, text, min_length=3):
         """
@@ -574,9 +625,29 @@ class TerminologyManager:
     
     def add_term(self, en_term, cn_term):
         """添加新术语"""
-        self.terms[en_term] = cn_term
+        with self._matcher_lock:
+            self.terms[en_term] = cn_term
+            self._matcher = None
+            self._version = None
         logger.info(f"添加术语: {en_term} -> {cn_term}")
     
+    def add_terms(self, terms):
+        """批量添加术语（只重建一次正则）"""
+        with self._matcher_lock:
+            self.terms.update(terms)
+            self._matcher = None
+            self._version = None
+        logger.info(f"添加了 {len(terms)} 个术语")
+    
+    def get_version(self):
+        """术语表版本（内容哈希），术语变化后翻译缓存自动失效；每次调用都检查配置文件是否被修改"""
+        if self._config_changed():
+            self._build_matcher()
+        if self._version is None:
+            content = json.dumps(self.terms, sort_keys=True, ensure_ascii=False)
+            self._version = hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+        return self._version
+    
     def get_terms(self):
         """获取所有术语"""
         return self.terms.copy()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+ffmpeg / ffprobe 工具链探测
+每个进程只查找一次 ffmpeg、ffprobe 路径，并探测版本、可用的编码器、滤镜和硬件加速方式。
+探测结果按可执行文件的路径、大小和修改时间缓存为 JSON，批量处理和重复启动时不再反复启动子进程；
+升级或替换 ffmpeg 后缓存自动失效。
+"""
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+from loguru import logger
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLCHAIN_CACHE_PATH = os.getenv('TOOLCHAIN_CACHE_PATH', os.path.join(project_root, 'cache', 'toolchain.json'))
+
+# 不在 PATH 中时依次检查的位置
+FFMPEG_CANDIDATES = [
+    os.path.join(project_root, 'ffmpeg', 'bin', 'ffmpeg.exe'),
+    os.path.join(project_root, 'ffmpeg', 'ffmpeg-8.0.1-essentials_build', 'bin', 'ffmpeg.exe'),
+    os.path.join(project_root, 'ffmpeg.exe'),
+    r'C:\ffmpeg\bin\ffmpeg.exe',
+    r'C:\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffmpeg.exe',
+    r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
+    r'C:\Program Files (x86)\ffmpeg\bin\ffmpeg.exe',
+    # 支持 D:\YouDub-webui 这样的绝对路径项目目录
+    r'D:\YouDub-webui\ffmpeg\bin\ffmpeg.exe',
+    r'D:\YouDub-webui\ffmpeg\ffmpeg-8.0.1-essentials_build\bin\ffmpeg.exe',
+]
+
+_toolchain = None
+_toolchain_lock = threading.Lock()
+
+
+def find_ffmpeg():
+    """查找 ffmpeg：环境变量 FFMPEG_PATH > 系统 PATH > 常见安装位置"""
+    env_ffmpeg_path = os.getenv('FFMPEG_PATH')
+    if env_ffmpeg_path and os.path.exists(env_ffmpeg_path):
+        logger.info(f"使用环境变量配置的 ffmpeg: {env_ffmpeg_path}")
+        return env_ffmpeg_path
+    elif env_ffmpeg_path:
+        logger.warning(f"环境变量 FFMPEG_PATH 指定的路径不存在: {env_ffmpeg_path}")
+
+    ffmpeg_path = shutil.which('ffmpeg')
+    if ffmpeg_path:
+        return ffmpeg_path
+
+    for path in FFMPEG_CANDIDATES:
+        if os.path.exists(path):
+            logger.info(f"找到 ffmpeg: {path}")
+            return path
+    return None
+
+
+def find_ffprobe(ffmpeg_path=None):
+    """查找 ffprobe：环境变量 FFPROBE_PATH > ffmpeg 同目录 > 系统 PATH"""
+    env_ffprobe_path = os.getenv('FFPROBE_PATH')
+    if env_ffprobe_path and os.path.exists(env_ffprobe_path):
+        logger.info(f"使用环境变量配置的 ffprobe: {env_ffprobe_path}")
+        return env_ffprobe_path
+    elif env_ffprobe_path:
+        logger.warning(f"环境变量 FFPROBE_PATH 指定的路径不存在: {env_ffprobe_path}")
+
+    if ffmpeg_path:
+        directory, name = os.path.split(ffmpeg_path)
+        sibling = os.path.join(directory, name.replace('ffmpeg', 'ffprobe'))
+        if sibling != ffmpeg_path and os.path.exists(sibling):
+            return sibling
+
+    return shutil.which('ffprobe')
+
+
+def _binary_key(path):
+    if not path:
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def _run(ffmpeg_path, *args):
+    result = subprocess.run([ffmpeg_path, '-hide_banner', *args], capture_output=True, text=True,
+                            encoding='utf-8', errors='replace', timeout=30)
+    return result.stdout
+
+
+def _parse_listing(output):
+    """解析 -encoders / -filters 的输出：每行为 标志位 名称 描述，跳过图例和表头"""
+    names = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or parts[1] == '=' or set(parts[0]) - set('VASDFXBTCN.|'):
+            continue
+        names.append(parts[1])
+    return names
+
+
+def probe(ffmpeg_path, ffprobe_path):
+    """启动 ffmpeg 读取版本、编码器、滤镜和硬件加速方式"""
+    version = _run(ffmpeg_path, '-version').splitlines()
+    hwaccels = _run(ffmpeg_path, '-hwaccels').splitlines()
+    return {
+        'ffmpeg': ffmpeg_path,
+        'ffprobe': ffprobe_path,
+        'key': [_binary_key(ffmpeg_path), _binary_key(ffprobe_path)],
+        'version': version[0] if version else '',
+        'encoders': _parse_listing(_run(ffmpeg_path, '-encoders')),
+        'filters': _parse_listing(_run(ffmpeg_path, '-filters')),
+        'hwaccels': [line.strip() for line in hwaccels[1:] if line.strip()],
+    }
+
+
+def _load_cached(key):
+    try:
+        with open(TOOLCHAIN_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached if cached.get('key') == key else None
+
+
+def _save_cached(toolchain):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(TOOLCHAIN_CACHE_PATH)), exist_ok=True)
+        tmp_path = TOOLCHAIN_CACHE_PATH + '.part'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(toolchain, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, TOOLCHAIN_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"保存工具链缓存失败: {e}")
+
+
+def get_toolchain():
+    """
+    获取工具链信息（延迟初始化，每个进程只探测一次）
+
+    返回 dict: ffmpeg, ffprobe（未找到时为 None）, version, encoders, filters, hwaccels
+    """
+    global _toolchain
+    if _toolchain is None:
+        with _toolchain_lock:
+            if _toolchain is None:
+                ffmpeg_path = find_ffmpeg()
+                ffprobe_path = find_ffprobe(ffmpeg_path)
+                if not ffmpeg_path:
+                    toolchain = {'ffmpeg': None, 'ffprobe': ffprobe_path, 'key': None, 'version': '',
+                                 'encoders': [], 'filters': [], 'hwaccels': []}
+                else:
+                    key = [_binary_key(ffmpeg_path), _binary_key(ffprobe_path)]
+                    toolchain = _load_cached(key)
+                    if toolchain is None:
+                        try:
+                            toolchain = probe(ffmpeg_path, ffprobe_path)
+                            _save_cached(toolchain)
+                        except (OSError, subprocess.SubprocessError) as e:
+                            logger.warning(f"探测 ffmpeg 功能失败: {e}")
+                            toolchain = {'ffmpeg': ffmpeg_path, 'ffprobe': ffprobe_path, 'key': key, 'version': '',
+                                         'encoders': [], 'filters': [], 'hwaccels': []}
+                    logger.info(f"ffmpeg: {ffmpeg_path} ({toolchain['version']}), "
+                                f"{len(toolchain['encoders'])} 个编码器, 硬件加速: {toolchain['hwaccels'] or '无'}")
+                _toolchain = toolchain
+    return _toolchain
+
+
+def get_ffmpeg_path():
+    return get_toolchain()['ffmpeg']
+
+
+def get_ffprobe_path():
+    # 找不到时交给系统 PATH 解析，出错信息由调用方处理
+    return get_toolchain()['ffprobe'] or 'ffprobe'
+
+
+def has_encoder(name):
+    return name in get_toolchain()['encoders']
+
+
+def has_filter(name):
+    return name in get_toolchain()['filters']
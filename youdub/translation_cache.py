@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+翻译记忆缓存
+按 (原文, 目标语言, 模型, 提示词版本, 术语表版本) 的哈希缓存 LLM 翻译结果，
+重新翻译同一视频或剪辑合集中重复出现的片段时直接命中，不再请求 LLM。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from loguru import logger
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRANSLATION_CACHE_PATH = os.getenv('TRANSLATION_CACHE_PATH', os.path.join(project_root, 'cache', 'translation_cache.db'))
+# 最多保留的条目数，超出后按最近使用时间淘汰
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', '200000'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used);
+"""
+
+
+def make_key(kind, source, target_language, model, prompt_version, terminology_version):
+    content = json.dumps([kind, source, target_language, model, prompt_version, terminology_version], ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class TranslationCache:
+    """SQLite 翻译缓存（线程安全，LRU 淘汰）"""
+
+    def __init__(self, db_path=TRANSLATION_CACHE_PATH, max_entries=TRANSLATION_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._count = self._conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM translations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE translations SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, key, kind, source, value):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO translations (key, kind, source, value, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, kind, source, json.dumps(value, ensure_ascii=False), now, now))
+            self._count += cursor.rowcount
+            if self.max_entries and self._count > self.max_entries:
+                # 一次淘汰 10%，避免每次写入都触发删除
+                evict = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    'DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY last_used LIMIT ?)', (evict,))
+                self._count -= evict
+                logger.info(f'翻译缓存淘汰 {evict} 条最久未使用的记录')
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate, 'entries': self._count}
+
+
+_translation_cache = None
+_translation_cache_lock = threading.Lock()
+
+
+def get_translation_cache():
+    """获取翻译缓存（延迟初始化）"""
+    global _translation_cache
+    with _translation_cache_lock:
+        if _translation_cache is None:
+            _translation_cache = TranslationCache()
+    return _translation_cache
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+异步翻译引擎
+- 每个后端一个进程级限流器（令牌桶：RPM/TPM + 并发上限），多视频、多线程共享
+- 遇到 429/5xx/连接错误时按 Retry-After 或指数退避，并临时收紧并发（AIMD）
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from loguru import logger
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+# 各后端默认限额，可通过环境变量覆盖（0 表示不限制）
+BACKEND_LIMITS = {
+    'groq': {'rpm': 30, 'tpm': 12000, 'concurrency': 4},
+    'openai': {'rpm': 500, 'tpm': 200000, 'concurrency': 16},
+    'ollama': {'rpm': 0, 'tpm': 0, 'concurrency': 2},
+}
+
+
+def estimate_tokens(messages):
+    """粗略估算 token 数（中英混合约 3 字符 / token），再加上回复的余量"""
+    chars = sum(len(m.get('content', '')) for m in messages)
+    return chars // 3 + 256
+
+
+class TokenBucket:
+    """线程安全的令牌桶，按分钟速率补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self, amount):
+        """成功返回 0，否则返回需要等待的秒数"""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """RPM / TPM 令牌桶 + 自适应并发上限"""
+
+    def __init__(self, rpm=0, tpm=0, concurrency=4):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max(1, int(concurrency))
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.cooldown_until = 0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def _try_enter(self):
+        with self._lock:
+            if time.monotonic() < self.cooldown_until:
+                return self.cooldown_until - time.monotonic()
+            if self.in_flight >= self.concurrency:
+                return 0.05
+            self.in_flight += 1
+            return 0
+
+    async def acquire(self, tokens):
+        # 先等令牌桶再占并发名额：等待期间被取消时不会留下未释放的名额
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            while bucket is not None:
+                wait = bucket.try_take(amount)
+                if wait == 0:
+                    break
+                await asyncio.sleep(wait)
+        while True:
+            wait = self._try_enter()
+            if wait == 0:
+                break
+            await asyncio.sleep(wait)
+
+    def release(self, success=True):
+        with self._lock:
+            self.in_flight -= 1
+            if success:
+                # 连续成功后逐步恢复并发
+                self._successes += 1
+                if self._successes >= self.concurrency * 4 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self._successes = 0
+
+    def throttle(self, delay):
+        """被限流或服务端出错：所有请求暂停 delay 秒，并发减半"""
+        with self._lock:
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+
+    @asynccontextmanager
+    async def slot(self, tokens):
+        await self.acquire(tokens)
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.release(success)
+
+
+def _retry_delay(error, attempt):
+    """优先使用服务端的 Retry-After，否则指数退避加抖动"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        try:
+            if retry_after:
+                return float(retry_after)
+        except ValueError:
+            pass
+    return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+
+def _is_retryable(error):
+    if openai is None:
+        return False
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class TranslationEngine:
+    """共享限流器的异步 chat-completion 客户端"""
+
+    def __init__(self, backend, model, client_factory, extra_body=None, rpm=None, tpm=None, concurrency=None):
+        limits = dict(BACKEND_LIMITS.get(backend, BACKEND_LIMITS['openai']))
+        if rpm is not None:
+            limits['rpm'] = rpm
+        if tpm is not None:
+            limits['tpm'] = tpm
+        if concurrency is not None:
+            limits['concurrency'] = concurrency
+        self.backend = backend
+        self.model = model
+        self.extra_body = extra_body or {}
+        self.limiter = RateLimiter(**limits)
+        self._client_factory = client_factory
+        # AsyncOpenAI 绑定创建时的事件循环，每个事件循环各用一个客户端
+        self._clients = weakref.WeakKeyDictionary()
+        logger.info(f'翻译引擎: {backend} / {model}, RPM={limits["rpm"] or "∞"}, TPM={limits["tpm"] or "∞"}, 并发={limits["concurrency"]}')
+
+    @property
+    def concurrency(self):
+        return self.limiter.max_concurrency
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._client_factory()
+            self._clients[loop] = client
+        return client
+
+    async def chat(self, messages, timeout=240, max_retries=8):
+        """发送一次对话请求，返回回复文本；仅对 429/5xx/网络错误自动退避重试"""
+        tokens = estimate_tokens(messages)
+        for attempt in range(max_retries):
+            try:
+                async with self.limiter.slot(tokens):
+                    response = await self._client().chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        timeout=timeout,
+                        extra_body=self.extra_body
+                    )
+                return response.choices[0].message.content
+            except Exception as e:
+                if not _is_retryable(e) or attempt == max_retries - 1:
+                    raise
+                delay = _retry_delay(e, attempt)
+                logger.warning(f'{self.backend} 请求受限或出错，{delay:.1f}s 后重试 (retry {attempt + 1}/{max_retries}): {e}')
+                self.limiter.throttle(delay)
+
+    def complete(self, messages, timeout=240):
+        """同步调用入口（用于总结等单次请求）"""
+        return asyncio.run(self.chat(messages, timeout=timeout))
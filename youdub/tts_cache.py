@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+跨视频的配音缓存
+按 (预处理后的文本, 音色哈希, 引擎, 模型版本, 语言) 的哈希缓存合成结果，
+频道里反复出现的开场白、结束语、赞助口播等短句只合成一次；
+视频目录下的 wavs/NNNN.wav 是缓存文件的硬链接（跨文件系统时为拷贝）。
+音色哈希：火山 TTS 为 voice_type，可跨视频命中；XTTS 为参考音频的内容哈希，
+参考音频从每个视频各自提取，因此 XTTS 实际上只在同一视频重跑时命中。
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from loguru import logger
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TTS_CACHE_ENABLED = os.getenv('TTS_CACHE', '1') == '1'
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', os.path.join(project_root, 'cache', 'tts'))
+# 缓存总大小上限（MB），超出后按最近使用时间淘汰
+TTS_CACHE_SIZE_MB = int(os.getenv('TTS_CACHE_SIZE_MB', '2048'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tts (
+    key TEXT PRIMARY KEY,
+    engine TEXT NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tts_last_used ON tts (last_used);
+"""
+
+
+def make_key(text, voice, engine, model, language):
+    content = json.dumps([text, voice, engine, model, language], ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    tmp = dst + '.part'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class TTSCache:
+    """内容寻址的配音缓存（SQLite 索引 + wav 文件，线程安全，按总大小 LRU 淘汰）"""
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_SIZE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM tts').fetchone()[0]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.wav')
+
+    def fetch(self, key, output_path):
+        """命中时把缓存文件链接到 output_path 并返回 True"""
+        path = self._path(key)
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM tts WHERE key = ?', (key,)).fetchone()
+            if row is None or not os.path.exists(path):
+                self.misses += 1
+                return False
+            self.hits += 1
+            self._conn.execute('UPDATE tts SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            _link_or_copy(path, output_path)
+        return True
+
+    def store(self, key, engine, text, source_path):
+        """把刚合成的 source_path 放入缓存"""
+        path = self._path(key)
+        now = time.time()
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 写入时拷贝，缓存文件与视频目录中的文件不共用 inode，后者被改写也不会污染缓存
+            shutil.copyfile(source_path, path + '.part')
+            os.replace(path + '.part', path)
+            size = os.path.getsize(path)
+            old = self._conn.execute('SELECT size FROM tts WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tts (key, engine, text, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, engine, text, size, now, now))
+            self._bytes += size - (old[0] if old else 0)
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target_bytes):
+        # 一次淘汰到 90%，避免每次写入都触发删除；视频目录中的硬链接不受影响
+        evicted = 0
+        for key, size in self._conn.execute('SELECT key, size FROM tts ORDER BY last_used').fetchall():
+            if self._bytes <= target_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._conn.execute('DELETE FROM tts WHERE key = ?', (key,))
+            self._bytes -= size
+            evicted += 1
+        logger.info(f'配音缓存淘汰 {evicted} 条最久未使用的记录')
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate, 'bytes': self._bytes}
+
+
+_tts_cache = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """获取配音缓存（延迟初始化），TTS_CACHE=0 时返回 None"""
+    global _tts_cache
+    if not TTS_CACHE_ENABLED:
+        return None
+    with _tts_cache_lock:
+        if _tts_cache is None:
+            _tts_cache = TTSCache()
+    return _tts_cache